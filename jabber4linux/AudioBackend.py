@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+
+# Audio backends. The interface is modeled after PyAudio (devices of one host API, callback or blocking
+# streams via open()), which is what AudioSocket.py was written against:
+# - PyAudioBackend: sound cards via PortAudio (default)
+# - PulseAudioBackend: direct connection to PulseAudio or PipeWire (pipewire-pulse), needs `pasimple`
+# - NullAudio: virtual devices for headless operation, benchmarks and automated tests
+# - WaveFileAudio: plays a WAV file as microphone and records the played audio into a WAV file
+# The non-PortAudio streams run in real time, paced by the monotonic clock or by blocking I/O.
+
+import subprocess
+import threading
+import json
+import wave
+import time
+import re
+
+from .Tools import ignoreStderr
+
+try:
+    import pyaudio
+except ImportError:
+    pyaudio = None
+try:
+    import pasimple
+except ImportError:
+    pasimple = None
+
+
+# same values as PortAudio, so that all backends understand the pyaudio constants
+paFloat32 = 1
+paInt32 = 2
+paInt24 = 4
+paInt16 = 8
+paInt8 = 16
+paUInt8 = 32
+paContinue = 0
+paComplete = 1
+paInputOverflow = 2
+paOutputUnderflow = 4
+FORMAT_WIDTHS = {paFloat32: 4, paInt32: 4, paInt24: 3, paInt16: 2, paInt8: 1, paUInt8: 1}
+
+class AudioBackend():
+    # subclasses implement open() with the signature of PyAudio.open()
+    name = None
+    defaultSampleRate = 48000
+
+    def __init__(self):
+        # dicts with at least 'name', 'maxInputChannels' and 'maxOutputChannels'
+        self.devices = []
+
+    def get_host_api_count(self):
+        return 1
+
+    def get_host_api_info_by_index(self, index):
+        return {'index': 0, 'name': self.name, 'deviceCount': len(self.devices)}
+
+    def get_device_info_by_index(self, index):
+        return self.get_device_info_by_host_api_device_index(0, index)
+
+    def get_device_info_by_host_api_device_index(self, hostApiIndex, index):
+        return {'defaultSampleRate': float(self.defaultSampleRate), **self.devices[index], 'index': index, 'hostApi': 0}
+
+    def get_default_input_device_info(self):
+        for i, device in enumerate(self.devices):
+            if(device['maxInputChannels'] > 0): return self.get_device_info_by_host_api_device_index(0, i)
+        raise OSError('No Default Input Device Available')
+
+    def get_default_output_device_info(self):
+        for i, device in enumerate(self.devices):
+            if(device['maxOutputChannels'] > 0): return self.get_device_info_by_host_api_device_index(0, i)
+        raise OSError('No Default Output Device Available')
+
+    def is_format_supported(self, rate, input_device=None, input_channels=None, input_format=None,
+        output_device=None, output_channels=None, output_format=None):
+        return True
+
+    def get_format_from_width(self, width, unsigned=True):
+        return {1: paUInt8 if unsigned else paInt8, 2: paInt16, 3: paInt24, 4: paFloat32}[width]
+
+    def terminate(self):
+        pass
+
+class PyAudioBackend(AudioBackend):
+    name = 'PortAudio'
+
+    def __init__(self):
+        with ignoreStderr(): self.audio = pyaudio.PyAudio()
+
+    def get_host_api_count(self):
+        return self.audio.get_host_api_count()
+
+    def get_host_api_info_by_index(self, index):
+        return self.audio.get_host_api_info_by_index(index)
+
+    def get_device_info_by_index(self, index):
+        return self.audio.get_device_info_by_index(index)
+
+    def get_device_info_by_host_api_device_index(self, hostApiIndex, index):
+        return self.audio.get_device_info_by_host_api_device_index(hostApiIndex, index)
+
+    def get_default_input_device_info(self):
+        return self.audio.get_default_input_device_info()
+
+    def get_default_output_device_info(self):
+        return self.audio.get_default_output_device_info()
+
+    def is_format_supported(self, *args, **kwargs):
+        return self.audio.is_format_supported(*args, **kwargs)
+
+    def get_format_from_width(self, width, unsigned=True):
+        return self.audio.get_format_from_width(width, unsigned)
+
+    def open(self, *args, suggested_latency=None, **kwargs):
+        # PyAudio always opens PortAudio streams with the device's default low latency,
+        # so the latency can only be influenced via frames_per_buffer
+        return self.audio.open(*args, **kwargs)
+
+    def terminate(self):
+        self.audio.terminate()
+
+class NullStream():
+    def __init__(self, backend, rate, channels=1, format=paInt16, frames_per_buffer=1024,
+        input=False, output=False, input_device_index=None, output_device_index=None,
+        stream_callback=None, start=True, suggested_latency=None):
+        self.backend = backend
+        self.rate = rate
+        self.channels = channels
+        self.sampleWidth = FORMAT_WIDTHS[format]
+        self.framesPerBuffer = frames_per_buffer
+        self.suggestedLatency = suggested_latency
+        self.isInput = input
+        self.isOutput = output
+        self.deviceIndex = input_device_index if input else output_device_index
+        self.callback = stream_callback
+        self.active = False
+        self.closed = False
+        self.thread = None
+        self.nextTime = None
+        if(start): self.start_stream()
+
+    def sampleBytes(self, frameCount):
+        return frameCount * self.channels * self.sampleWidth
+
+    def start_stream(self):
+        if(self.active or self.closed): return
+        self.active = True
+        self.nextTime = time.monotonic()
+        if(self.callback != None):
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop_stream(self):
+        self.active = False
+        if(self.thread != None and self.thread != threading.current_thread()):
+            self.thread.join()
+        self.thread = None
+
+    def close(self):
+        self.stop_stream()
+        self.closed = True
+
+    def is_active(self):
+        return self.active
+
+    def get_input_latency(self):
+        return self.framesPerBuffer / self.rate if self.isInput else 0.0
+
+    def get_output_latency(self):
+        return self.framesPerBuffer / self.rate if self.isOutput else 0.0
+
+    def run(self):
+        period = self.framesPerBuffer / self.rate
+        status = 0
+        while(self.active):
+            inData = self.backend.capture(self, self.framesPerBuffer) if self.isInput else None
+            outData, flag = self.callback(inData, self.framesPerBuffer, {'current_time': time.monotonic()}, status)
+            if(self.isOutput): self.backend.play(self, outData or bytes(self.sampleBytes(self.framesPerBuffer)))
+            if(flag != paContinue): break
+            status = self.pace(period)
+        self.active = False
+
+    def pace(self, period):
+        # sleep until the next buffer is due; returns the PortAudio status flags for the next callback
+        self.nextTime += period
+        delay = self.nextTime - time.monotonic()
+        if(delay > 0):
+            time.sleep(delay)
+            return 0
+        if(delay < -period):
+            # the callback was too slow, like a real sound card we do not wait for it
+            missed = int(-delay / period)
+            self.nextTime += missed * period
+            if(self.isInput): self.backend.capture(self, missed * self.framesPerBuffer) # lost audio
+            return paInputOverflow if self.isInput else paOutputUnderflow
+        return 0
+
+    def read(self, num_frames, exception_on_overflow=True):
+        data = self.backend.capture(self, num_frames)
+        self.pace(num_frames / self.rate)
+        return data
+
+    def write(self, frames, num_frames=None, exception_on_underflow=False):
+        self.backend.play(self, frames)
+        self.pace(len(frames) / self.sampleBytes(1) / self.rate)
+
+class NullAudio(AudioBackend):
+    # One virtual input and one virtual output device. The input delivers the audio produced by
+    # `source(frameCount, rate)` (silence by default), the output hands the played audio to
+    # `sink(data, rate)` (discarded by default). If `sampleRate` is given, only this rate is supported,
+    # which e.g. forces the resampling path of the audio sockets.
+    name = 'Null'
+
+    def __init__(self, source=None, sink=None, sampleRate=None):
+        self.devices = [
+            {'name': 'Null Input', 'maxInputChannels': 2, 'maxOutputChannels': 0},
+            {'name': 'Null Output', 'maxInputChannels': 0, 'maxOutputChannels': 2},
+        ]
+        self.source = source
+        self.sink = sink
+        self.sampleRate = sampleRate
+        if(sampleRate != None): self.defaultSampleRate = sampleRate
+
+    def is_format_supported(self, rate, input_device=None, input_channels=None, input_format=None,
+        output_device=None, output_channels=None, output_format=None):
+        if(self.sampleRate != None and rate != self.sampleRate): raise ValueError('Invalid sample rate')
+        return True
+
+    def open(self, *args, **kwargs):
+        return NullStream(self, *args, **kwargs)
+
+    def capture(self, stream, frameCount):
+        if(self.source == None): return bytes(stream.sampleBytes(frameCount))
+        return self.source(frameCount, stream.rate)
+
+    def play(self, stream, data):
+        if(self.sink != None): self.sink(data, stream.rate)
+
+class WaveFileAudio(NullAudio):
+    # The input device plays a 16 bit mono WAV file in an endless loop, the output device records into a WAV file.
+    # The input file's sample rate is the only supported rate, so the audio sockets resample if necessary.
+    name = 'WAV File'
+
+    def __init__(self, inputFile=None, outputFile=None):
+        self.inputWave = None
+        self.outputWave = None
+        self.outputFile = outputFile
+        self.lock = threading.Lock()
+        sampleRate = None
+        if(inputFile != None):
+            self.inputWave = wave.open(inputFile, 'rb')
+            if(self.inputWave.getsampwidth() != 2 or self.inputWave.getnchannels() != 1 or self.inputWave.getnframes() == 0):
+                raise ValueError(f'{inputFile} is not a 16 bit mono WAV file')
+            sampleRate = self.inputWave.getframerate()
+        super(WaveFileAudio, self).__init__(self.readInput, self.writeOutput, sampleRate)
+
+    def readInput(self, frameCount, rate):
+        if(self.inputWave == None): return bytes(frameCount * 2)
+        data = b''
+        while(len(data) < frameCount * 2):
+            chunk = self.inputWave.readframes(frameCount - len(data) // 2)
+            if(chunk == b''): self.inputWave.rewind()
+            data += chunk
+        return data
+
+    def writeOutput(self, data, rate):
+        if(self.outputFile == None): return
+        with self.lock:
+            if(self.outputWave == None):
+                self.outputWave = wave.open(self.outputFile, 'wb')
+                self.outputWave.setnchannels(1)
+                self.outputWave.setsampwidth(2)
+                self.outputWave.setframerate(rate)
+            self.outputWave.writeframes(data)
+
+    def terminate(self):
+        if(self.inputWave != None): self.inputWave.close()
+        with self.lock:
+            if(self.outputWave != None): self.outputWave.close()
+            self.outputWave = None
+
+class PulseAudioStream(NullStream):
+    # connection via the PulseAudio simple API, in callback mode a thread does the blocking I/O
+    def __init__(self, backend, rate, channels=1, format=paInt16, frames_per_buffer=1024,
+        input=False, output=False, input_device_index=None, output_device_index=None,
+        stream_callback=None, start=True, suggested_latency=None):
+        if(format != paInt16): raise ValueError('Only 16 bit audio is supported')
+        bufferBytes = frames_per_buffer * channels * 2
+        # without suggested latency, request server side buffers of one period (capture) or two periods (playback)
+        latencyBytes = int(suggested_latency * rate) * channels * 2 if suggested_latency else None
+        deviceIndex = input_device_index if input else output_device_index
+        device = backend.devices[deviceIndex] if deviceIndex != None else {}
+        self.connection = pasimple.PaSimple(
+            pasimple.PA_STREAM_RECORD if input else pasimple.PA_STREAM_PLAYBACK,
+            pasimple.PA_SAMPLE_S16LE, channels, rate,
+            app_name='Jabber4Linux', stream_name='Capture' if input else 'Playback',
+            device_name=device.get('pulseName'),
+            fragsize=(latencyBytes or bufferBytes) if input else -1,
+            tlength=(latencyBytes or 2 * bufferBytes) if output else -1 # -1: chosen by the server
+        )
+        super(PulseAudioStream, self).__init__(backend, rate, channels, format, frames_per_buffer,
+            input, output, input_device_index, output_device_index, stream_callback, start, suggested_latency)
+
+    def pace(self, period):
+        # the blocking read/write of the connection already runs in real time
+        return 0
+
+    def close(self):
+        super(PulseAudioStream, self).close()
+        self.connection.close()
+
+class PulseAudioBackend(AudioBackend):
+    # Talks to PulseAudio or PipeWire directly, without the PortAudio/ALSA layers in between.
+    # Device 0 and 1 are the server's default source and sink, followed by all devices reported by `pactl`.
+    name = 'PulseAudio'
+
+    def __init__(self):
+        self.devices = [
+            {'name': 'Default', 'maxInputChannels': 2, 'maxOutputChannels': 0, 'pulseName': None},
+            {'name': 'Default', 'maxInputChannels': 0, 'maxOutputChannels': 2, 'pulseName': None},
+        ]
+        for kind, channelKey in (('sources', 'maxInputChannels'), ('sinks', 'maxOutputChannels')):
+            try:
+                output = subprocess.run(['pactl', '--format=json', 'list', kind], capture_output=True, check=True, timeout=5).stdout
+                entries = json.loads(output)
+            except (OSError, subprocess.SubprocessError, ValueError):
+                continue # pactl not installed or too old for JSON output
+            for entry in entries:
+                if(entry.get('monitor_of_sink', 'n/a') != 'n/a'): continue # skip monitors of the output devices
+                rate = re.search(r'(\d+)Hz', entry.get('sample_specification', ''))
+                self.devices.append({
+                    'name': entry.get('description') or entry['name'],
+                    'pulseName': entry['name'],
+                    'maxInputChannels': 0, 'maxOutputChannels': 0, channelKey: 2,
+                    'defaultSampleRate': float(rate.group(1)) if rate else float(self.defaultSampleRate),
+                })
+
+    def open(self, *args, **kwargs):
+        return PulseAudioStream(self, *args, **kwargs)
+
+    def capture(self, stream, frameCount):
+        return stream.connection.read(stream.sampleBytes(frameCount))
+
+    def play(self, stream, data):
+        stream.connection.write(data)
+
+AUDIO_BACKENDS = {
+    'pyaudio': PyAudioBackend,
+    'pulse': PulseAudioBackend,
+    'null': NullAudio,
+    'file': WaveFileAudio,
+}
+
+def createAudioBackend(mediaSettings={}):
+    name = mediaSettings.get('audio-backend', 'pyaudio')
+    if(name not in AUDIO_BACKENDS):
+        print(f':: unknown audio backend {name}, using pyaudio')
+        name = 'pyaudio'
+    if((name == 'pyaudio' and pyaudio == None) or (name == 'pulse' and pasimple == None)):
+        print(f':: audio backend {name} is not installed, using null audio backend (no sound)')
+        name = 'null'
+    if(name == 'file'):
+        return WaveFileAudio(mediaSettings.get('audio-input-file'), mediaSettings.get('audio-output-file'))
+    return AUDIO_BACKENDS[name]()
@@ -1,8 +1,6 @@
 #!/usr/bin/env python3
 
 import socket
-import pyaudio
-import wave
 import threading
 import struct
 import time
@@ -10,24 +8,119 @@ import re
 import os, sys
 import traceback
 
-# codec imports
-import audioop
-import opuslib
-import g729lib
-
+from .RingBuffer import RingBuffer
+from .Rtp import RTP_MAX_DATAGRAM, unpackRtpHeader, RtpPacketizer
+from .Rtcp import CallStatistics, RtcpSocket
+from .Resampler import Resampler
+from .ClockDrift import ClockDriftCompensator
+from .Codecs import createCodecs, findPayloadType, PcmuCodec
+from .ComfortNoise import VoiceActivityDetector, ComfortNoiseGenerator, parseComfortNoisePayload
+from .Dsp import DspPipeline, AutomaticGainControl, EchoSuppressor
+from .RingtoneCache import RingtoneCache
+from .CallRecorder import createCallRecorder
+from .Scheduling import applyThreadScheduling
+from .AudioBackend import paInt16, paContinue, paComplete, paInputOverflow
+
+
+def findHostApi(audio, hostApiName):
+    # index of the host API whose name contains `hostApiName` (e.g. 'ALSA', 'PulseAudio', 'JACK'), 0 if not set
+    if(not hostApiName): return 0
+    for i in range(0, audio.get_host_api_count()):
+        if(hostApiName.lower() in audio.get_host_api_info_by_index(i).get('name', '').lower()):
+            return i
+    print(f':: host API {hostApiName} not available, using default')
+    return 0
+
+def findAudioDevice(audio, deviceName, isInput, hostApi=0):
+    # returns (device index or None for the system default, default sample rate of the device)
+    deviceIndex = None
+    defaultSampleRate = None
+    info = audio.get_host_api_info_by_index(hostApi)
+    for i in range(0, info.get('deviceCount')):
+        deviceInfo = audio.get_device_info_by_host_api_device_index(hostApi, i)
+        if((deviceInfo.get('maxInputChannels' if isInput else 'maxOutputChannels')) > 0):
+            if(deviceName != None and deviceName in deviceInfo.get('name')):
+                deviceIndex = deviceInfo.get('index', i) # open() expects the global device index
+                defaultSampleRate = int(deviceInfo.get('defaultSampleRate'))
+    if(deviceIndex == None and hostApi != 0):
+        # the system default device belongs to the default host API, use the selected host API's default instead
+        defaultDevice = info.get('defaultInputDevice' if isInput else 'defaultOutputDevice', -1)
+        if(defaultDevice >= 0):
+            deviceIndex = defaultDevice
+            defaultSampleRate = int(audio.get_device_info_by_index(defaultDevice).get('defaultSampleRate'))
+    if(deviceIndex == None):
+        try:
+            deviceInfo = audio.get_default_input_device_info() if isInput else audio.get_default_output_device_info()
+            defaultSampleRate = int(deviceInfo.get('defaultSampleRate'))
+        except OSError:
+            defaultSampleRate = 48000 # common default
+    return deviceIndex, defaultSampleRate
+
+def chooseSampleRate(audio, deviceIndex, preferredRates, isInput, channels=1):
+    # returns the first of the preferred rates which the device can be opened with, so that
+    # no sample rate conversion is needed in Python (sound servers like PipeWire accept any rate)
+    try:
+        if(deviceIndex == None):
+            deviceInfo = audio.get_default_input_device_info() if isInput else audio.get_default_output_device_info()
+            deviceIndex = deviceInfo.get('index')
+    except OSError:
+        return preferredRates[-1]
+    for rate in preferredRates:
+        try:
+            if(isInput):
+                audio.is_format_supported(rate, input_device=deviceIndex, input_channels=channels, input_format=paInt16)
+            else:
+                audio.is_format_supported(rate, output_device=deviceIndex, output_channels=channels, output_format=paInt16)
+            return rate
+        except ValueError:
+            continue
+    return preferredRates[-1]
+
+def streamBufferSettings(mediaSettings, direction, rate, defaultFrames):
+    # returns (frames per buffer, suggested latency in seconds or None for the device default) of the
+    # 'playback' or 'capture' direction, configured in milliseconds as '<direction>-buffer' and '<direction>-latency'
+    bufferMs = mediaSettings.get(direction + '-buffer')
+    latencyMs = mediaSettings.get(direction + '-latency')
+    framesPerBuffer = max(1, int(rate * bufferMs / 1000)) if bufferMs else defaultFrames
+    return framesPerBuffer, (latencyMs / 1000 if latencyMs else None)
 
 class InputAudioSocket(threading.Thread):
     CHUNK = 1024
+    SAMPLE_WIDTH = 2 # 16 bit
+    BUFFER_SECONDS = 0.5 # max. audio which can be queued between network thread and sound card
 
-    def __init__(self, interface, audio, deviceName=None, ptMap={}, *args, **kwargs):
+    def __init__(self, interface, audio, deviceName=None, ptMap={}, mediaSettings={}, *args, **kwargs):
         self.sock = None
+        self.audio = audio
         self.audioStream = None
-        self.soundcardSampleRate = 48000 # common default
-        self.sampleRateConverterState = None
-        self.outputSocketReference = None
+        self.streamLock = threading.Lock() # the sound card can be switched during the call (see switchAudio)
+        self.playbackBuffer = None
+        self.soundcardSampleRate = None
+        self.resampler = None
+        self.driftCompensator = ClockDriftCompensator() if mediaSettings.get('drift-compensation', True) else None
+        self.mediaSettings = mediaSettings
+        self.schedulingReport = None
         self.stopFlag = False
         self.applyPayloadTypeMap(ptMap)
 
+        # receive DSP stages, working on decoded frames at codec sample rate
+        # the echo suppressor is shared with the OutputAudioSocket of this call, which attenuates the microphone
+        self.echoSuppressor = EchoSuppressor() if mediaSettings.get('echo-suppression', False) else None
+        self.dspPipeline = DspPipeline()
+        if(self.echoSuppressor != None):
+            self.dspPipeline.stages.append(self.echoSuppressor.farEnd)
+        if(mediaSettings.get('receive-agc', False)):
+            self.dspPipeline.stages.append(AutomaticGainControl())
+        # optional call recording, the recorder is shared with the OutputAudioSocket of this call
+        self.recorder = createCallRecorder(mediaSettings)
+
+        # receive statistics for outgoing RTCP reports, shared with the OutputAudioSocket of this call
+        self.statistics = CallStatistics()
+
+        # preallocated receive buffer, RTP packets are parsed in-place via memoryview
+        self.recvBuffer = bytearray(RTP_MAX_DATAGRAM)
+        self.recvView = memoryview(self.recvBuffer)
+
         # open RTP UDP socket for incoming audio data
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_PRIORITY, 6)
@@ -37,116 +130,176 @@ class InputAudioSocket(threading.Thread):
         self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_TOS, 0xb8)
         self.sock.bind((interface, 0))
 
-        # find audio device
-        deviceIndex = None # fallback: system default
-        info = audio.get_host_api_info_by_index(0)
-        for i in range(0, info.get('deviceCount')):
-            deviceInfo = audio.get_device_info_by_host_api_device_index(0, i)
-            if((deviceInfo.get('maxOutputChannels')) > 0):
-                if(deviceName != None and deviceName in deviceInfo.get('name')):
-                    deviceIndex = i
-                    self.soundcardSampleRate = int(deviceInfo.get('defaultSampleRate')) # use specific soundcard sample rate, otherwise error
-        if deviceIndex == None: print(':: using default output device ', deviceName)
-        # open sound card
-        self.audioStream = audio.open(
-            format=pyaudio.paInt16, # conform with alaw2lin second parameter (2 bytes -> 16 bit)
-            channels=1,
-            rate=self.soundcardSampleRate,
-            frames_per_buffer=self.CHUNK,
-            output=True,
-            output_device_index=deviceIndex)
+        # find audio device, the sound card is opened on the first audio packet when the codec rate is known
+        self.findAudioDevice(deviceName)
 
         # call Thread constructor
         super(InputAudioSocket, self).__init__(*args, **kwargs)
         self.daemon = True
 
+    def findAudioDevice(self, deviceName):
+        self.deviceIndex, self.deviceSampleRate = findAudioDevice(self.audio, deviceName, False, findHostApi(self.audio, self.mediaSettings.get('host-api')))
+        if self.deviceIndex == None: print(':: using default output device ', deviceName)
+        # background noise which is played while the remote party sends comfort noise packets (RFC 3389)
+        self.comfortNoise = ComfortNoiseGenerator(self.deviceSampleRate)
+
+    def switchAudio(self, audio, deviceName=None):
+        # continue the playback on another audio backend (e.g. a ConferenceLeg) without interrupting the RTP session;
+        # the old stream is closed right away so that the device is free, the new one is opened with the next packet
+        with self.streamLock:
+            if(self.audioStream != None):
+                self.audioStream.stop_stream()
+                self.audioStream.close()
+                self.audioStream = None
+            self.audio = audio
+            self.resampler = None
+            self.findAudioDevice(deviceName)
+
+    def openAudioStream(self, payloadSampleRate):
+        # open the sound card with the codec rate if it supports it, otherwise with its default rate
+        self.soundcardSampleRate = chooseSampleRate(self.audio, self.deviceIndex, [payloadSampleRate, self.deviceSampleRate], False)
+        print(f':: opening output device with {self.soundcardSampleRate} Hz for {payloadSampleRate} Hz audio'
+            + (' (no resampling)' if self.soundcardSampleRate == payloadSampleRate else ' (resampling)'))
+        # open sound card in callback mode, decoded audio is handed over via lock-free ring buffer
+        # so that a slow sound card never stalls the RTP reception
+        self.playbackBytesPerSecond = self.soundcardSampleRate * self.SAMPLE_WIDTH
+        self.playbackBuffer = RingBuffer(int(self.playbackBytesPerSecond * self.BUFFER_SECONDS))
+        framesPerBuffer, latency = streamBufferSettings(self.mediaSettings, 'playback', self.soundcardSampleRate, self.CHUNK)
+        self.audioStream = self.audio.open(
+            format=paInt16, # G.711 codec works on 16 bit samples
+            channels=1,
+            rate=self.soundcardSampleRate,
+            frames_per_buffer=framesPerBuffer,
+            suggested_latency=latency,
+            output=True,
+            output_device_index=self.deviceIndex,
+            stream_callback=self.audioCallback)
+        print(f':: playback buffer {framesPerBuffer} frames ({framesPerBuffer / self.soundcardSampleRate * 1000:.1f} ms)')
+
+    def getsockname(self):
+        # local RTP address for the SDP body
+        return self.sock.getsockname()
+
     def applyPayloadTypeMap(self, ptMap):
-        # init opuslib if given in payload type map
-        self.opusPayloadType = -1
-        self.g729PayloadType = -1
-        for payloadTypeNumber, payloadTypeDescription in ptMap.items():
-            splitter = payloadTypeDescription.lower().split('/')
-            if(len(splitter) < 2): continue
-            if(splitter[0] == 'opus' and int(splitter[1]) >= 8000):
-                self.opusPayloadType = payloadTypeNumber
-                self.opusSampleRate = int(splitter[1])
-                self.opusDecoder = opuslib.Decoder(int(splitter[1]), 1)
-            elif(splitter[0] == 'g729' and int(splitter[1]) >= 8000):
-                self.g729PayloadType = payloadTypeNumber
-                self.g729SampleRate = int(splitter[1])
-                self.g729Decoder = g729lib.Decoder()
+        # payload type -> codec object, every packet is demultiplexed via this dict
+        # so that e.g. telephone-event packets or a mid-call codec switch never hit the wrong decoder
+        self.codecs = createCodecs(ptMap, settings=self.mediaSettings)
+        self.comfortNoisePayloadType = findPayloadType(ptMap, 'CN')
+        self.unsupportedPayloadTypes = set()
 
     def run(self, *args, **kwargs):
         print(f':: opened UDP socket on port {self.sock.getsockname()[1]} for incoming RTP stream')
+        # optional real-time priority, CPU affinity and niceness (see media settings)
+        self.schedulingReport = applyThreadScheduling(self.mediaSettings)
+        print(f':: receive thread scheduling: {self.schedulingReport}')
 
         try:
-            payloadType = -1
-            counter = 0
+            codec = None
+            clockRate = 8000
+            lastSequenceNumber = None
+            lastUnderruns = 0
+            recvBuffer = self.recvBuffer
+            recvView = self.recvView
             while True:
                 # read from RTP socket
                 if(self.stopFlag): break
-                datagram, address = self.sock.recvfrom(1024)
-
-                if(len(datagram) < 12): continue # ignore invalid RTP packets
-                if(len(datagram) == 20): continue # ignore STUN binding request
-
-                rtpHead = datagram[:12]
-                if(payloadType == -1):
-                    payloadType = rtpHead[1] & 0b01111111
-
-                # store information for outgoing sender report RTCP packets
-                if(self.outputSocketReference != None):
-                    self.outputSocketReference.remoteSsrc = rtpHead[8:12]
-                    self.outputSocketReference.hsnr = rtpHead[2:4]
-
-                # decode payload
-                rtpBody = datagram[12:]
-                audioData = b''
-                payloadSampleRate = 8000 # PCMA and PCMU always uses 8khz
-                if(payloadType == 0):
-                    audioData = audioop.ulaw2lin(rtpBody, 2)
-                elif(payloadType == 8):
-                    audioData = audioop.alaw2lin(rtpBody, 2)
-                elif(payloadType == self.opusPayloadType):
-                    payloadSampleRate = self.opusSampleRate
-                    audioData = self.opusDecoder.decode(rtpBody, 960)
-                elif(payloadType == self.g729PayloadType):
-                    payloadSampleRate = self.g729SampleRate
-                    audioData = self.g729Decoder.decode(rtpBody)
+                size = self.sock.recv_into(recvBuffer)
+
+                # ignore invalid RTP packets and STUN binding requests
+                rtpHead = unpackRtpHeader(recvBuffer, size)
+                if(rtpHead == None): continue
+                rtpBody = recvView[rtpHead[5]:rtpHead[6]]
+
+                # look up the decoder for this packet
+                # (self.codecs is replaced by applyPayloadTypeMap() after this thread was started)
+                packetCodec = self.codecs.get(rtpHead[0])
+                if(packetCodec != None):
+                    if(packetCodec is not codec):
+                        codec = packetCodec
+                        clockRate = codec.clockRate
+                        self.statistics.codecName = codec.name
+                elif(rtpHead[0] not in self.unsupportedPayloadTypes and rtpHead[0] != self.comfortNoisePayloadType):
+                    self.unsupportedPayloadTypes.add(rtpHead[0])
+                    print(f':: ignoring unsupported codec / payload type {rtpHead[0]}')
+
+                # update statistics for RTCP receiver reports (loss, jitter)
+                # also for skipped packets (e.g. telephone-event), they share the sequence number space
+                self.statistics.rtpReceived(rtpHead[2], rtpHead[3], rtpHead[4], len(rtpBody), clockRate)
+                singleLoss = lastSequenceNumber != None and ((rtpHead[2] - lastSequenceNumber) & 0xffff) == 2
+                lastSequenceNumber = rtpHead[2]
+                if(packetCodec == None):
+                    if(rtpHead[0] == self.comfortNoisePayloadType):
+                        # silence period started, play noise instead of nothing until the next audio packet
+                        level = parseComfortNoisePayload(rtpBody)
+                        if(level != None): self.comfortNoise.setLevel(level)
+                    continue
+                self.comfortNoise.active = False
+
+                # decode payload, a single lost packet is recovered from in-band FEC data if available
+                decodeStart = time.perf_counter()
+                if(singleLoss and codec.supportsFec):
+                    audioData = codec.decodeFec(rtpBody) + codec.decode(rtpBody)
                 else:
-                    print(f'Unsupported codec / payload type {payloadType}')
-
-                # sample rate conversion
-                if(self.soundcardSampleRate != payloadSampleRate):
-                    audioData, state = audioop.ratecv(audioData, 2, 1, payloadSampleRate, self.soundcardSampleRate, self.sampleRateConverterState)
-                    self.sampleRateConverterState = state
-
-                # write to soundcard
-                if not self.audioStream.is_active():
-                    # PipeWire can silently suspend the stream or raise OSError on write;
-                    # restart the stream to recover rather than letting the loop exit
-                    try:
-                        self.audioStream.stop_stream()
-                        self.audioStream.start_stream()
-                    except OSError:
-                        pass
-                try:
-                    self.audioStream.write(audioData)
-                except OSError:
-                    try:
-                        self.audioStream.stop_stream()
-                        self.audioStream.start_stream()
-                        self.audioStream.write(audioData)
-                    except OSError:
-                        pass
+                    audioData = codec.decode(rtpBody)
+                self.statistics.decodeTime += time.perf_counter() - decodeStart
+                self.statistics.framesDecoded += 1
+                audioData = self.dspPipeline.process(audioData)
+                payloadSampleRate = codec.sampleRate
+                if(self.recorder != None): self.recorder.receive(audioData, payloadSampleRate)
+                with self.streamLock:
+                    if(self.audioStream == None):
+                        self.openAudioStream(payloadSampleRate)
+                        lastUnderruns = 0
+
+                    # sample rate conversion
+                    if(self.soundcardSampleRate != payloadSampleRate):
+                        if(self.resampler == None or self.resampler.inRate != payloadSampleRate):
+                            self.resampler = Resampler(payloadSampleRate, self.soundcardSampleRate)
+                        audioData = self.resampler.process(audioData)
+
+                    # clock drift compensation (tiny stretching/compressing to keep the buffer level constant)
+                    if(self.driftCompensator != None):
+                        audioData = self.driftCompensator.process(audioData)
+
+                    # hand over to soundcard callback (never blocks, counts overrun if the card does not keep up)
+                    self.playbackBuffer.write(audioData)
+                    if(self.driftCompensator != None and self.playbackBuffer.underruns == lastUnderruns):
+                        # the fill level is meaningless after an underrun (e.g. silence suppression of the sender)
+                        self.driftCompensator.update(self.playbackBuffer.available() / self.playbackBytesPerSecond, time.monotonic())
+                    lastUnderruns = self.playbackBuffer.underruns
+                    if not self.audioStream.is_active():
+                        # PipeWire can silently suspend the stream;
+                        # restart the stream to recover rather than letting the playback die
+                        try:
+                            self.audioStream.stop_stream()
+                            self.audioStream.start_stream()
+                        except OSError:
+                            pass
 
         except OSError:
             pass
 
         self.sock.close()
-        self.audioStream.stop_stream()
-        self.audioStream.close()
-        print(f':: closed UDP socket for incoming RTP stream')
+        if(self.recorder != None): self.recorder.stop()
+        with self.streamLock:
+            if(self.audioStream == None):
+                print(f':: closed UDP socket for incoming RTP stream (no audio received)')
+                return
+            self.audioStream.stop_stream()
+            self.audioStream.close()
+        print(f':: closed UDP socket for incoming RTP stream (playback buffer underruns: {self.playbackBuffer.underruns}, overruns: {self.playbackBuffer.overruns})')
+        if(self.driftCompensator != None):
+            print(f':: estimated clock drift to remote party: {self.driftCompensator.driftPpm():.0f} ppm')
+        if(self.dspPipeline.stages):
+            print(f':: receive DSP timing: {self.dspPipeline.report()}')
+
+    def audioCallback(self, inData, frameCount, timeInfo, status):
+        # called from the PortAudio thread - must never block
+        size = frameCount * self.SAMPLE_WIDTH
+        if(self.comfortNoise.active):
+            available = min(self.playbackBuffer.available(), size)
+            return (self.playbackBuffer.read(available) + self.comfortNoise.generate(size - available), paContinue)
+        return (self.playbackBuffer.read(size), paContinue)
 
     def stop(self):
         self.stopFlag = True
@@ -160,43 +313,51 @@ class InputAudioSocket(threading.Thread):
 
 class OutputAudioSocket(threading.Thread):
     CHUNK = 160
+    SAMPLE_WIDTH = 2 # 16 bit
+    BUFFER_SECONDS = 0.5 # max. captured audio which can be queued for the network thread
+    MAX_BACKLOG_SECONDS = 0.1 # older captured audio is dropped if encoding falls behind, to keep the latency low
 
-    def __init__(self, sock, dstAddress, dstPort, payloadType, audio, deviceName=None, ptMap={}, *args, **kwargs):
+    def __init__(self, sock, dstAddress, dstPort, payloadType, audio, deviceName=None, ptMap={}, statistics=None, fmtpMap={}, mediaAttributes={}, mediaSettings={}, echoSuppressor=None, recorder=None, *args, **kwargs):
         self.dstAddress = None
         self.dstPort = None
         self.dstPortCtrl = None
         self.sock = None
         self.audioStream = None
+        self.streamLock = threading.Lock() # the sound card can be switched during the call (see switchAudio)
+        self.captureBuffer = None
         self.payloadType = payloadType
-        self.ssrc = os.urandom(4)
-        self.remoteSsrc = bytes([0x00, 0x00, 0x00, 0x00])
-        self.hsnr = bytes([0x00, 0x00])
-        self.sampleRateConverterState = None
+        self.packetizer = None
+        self.resampler = None
+        self.vad = None
+        self.mediaSettings = mediaSettings
+        self.recorder = recorder
+        self.schedulingReport = None
         self.stopFlag = False
 
-        # use 8khz as default, so we do not need to convert PCMU and PCMA
-        self.soundcardSampleRate = 8000
-        if(self.payloadType != 0 and self.payloadType != 8 and self.payloadType != 18):
-            self.soundcardSampleRate = 48000
-
-        # init opuslib if given in payload type map
-        self.opusPayloadType = -1
-        self.g729PayloadType = -1
-        for payloadTypeNumber, payloadTypeDescription in ptMap.items():
-            splitter = payloadTypeDescription.lower().split('/')
-            if(len(splitter) < 2): continue
-            if(splitter[0] == 'opus' and int(splitter[1]) >= 8000):
-                self.opusPayloadType = payloadTypeNumber
-                self.opusSampleRate = int(splitter[1])
-                self.opusEncoder = opuslib.Encoder(int(splitter[1]), 1, 'voip')
-            elif(splitter[0] == 'g729' and int(splitter[1]) >= 8000):
-                self.g729PayloadType = payloadTypeNumber
-                self.g729SampleRate = int(splitter[1])
-                self.g729Encoder = g729lib.Encoder(0)
-        if(self.payloadType == self.opusPayloadType):
-            self.CHUNK = 960
-        elif(self.payloadType == self.g729PayloadType):
-            self.CHUNK = 160
+        # statistics
+        self.inputOverflows = 0 # reported by PortAudio: the sound card delivered audio faster than the callback was called
+        self.droppedFrames = 0 # captured frames discarded because the encode stage fell behind
+
+        # get encoder for the negotiated payload type, use PCMU as fallback
+        self.codec = createCodecs(ptMap, fmtpMap, mediaSettings).get(self.payloadType)
+        if(self.codec == None):
+            self.codec = PcmuCodec(self.payloadType)
+        # packet time: as requested by the remote party, otherwise from settings
+        self.codec.setPacketTime(mediaAttributes.get('ptime', mediaSettings.get('ptime', 20)), mediaAttributes.get('maxptime'))
+        self.CHUNK = self.codec.frameSamples
+
+        # suppress silent frames and send comfort noise instead if the remote party supports it (RFC 3389),
+        # unless the codec has its own mechanism (Opus DTX, G.729 Annex B)
+        self.comfortNoisePayloadType = findPayloadType(ptMap, 'CN')
+        if(mediaSettings.get('vad', False) and self.comfortNoisePayloadType != None and not self.codec.suppressesSilence):
+            self.vad = VoiceActivityDetector(self.codec.frameDuration)
+
+        # send DSP stages, working on captured frames at codec sample rate (before VAD and encoding)
+        self.dspPipeline = DspPipeline()
+        if(echoSuppressor != None):
+            self.dspPipeline.stages.append(echoSuppressor)
+        if(mediaSettings.get('agc', False)):
+            self.dspPipeline.stages.append(AutomaticGainControl())
 
         # prepare UDP socket for outgoing audio data
         self.dstAddress = dstAddress
@@ -211,31 +372,57 @@ class OutputAudioSocket(threading.Thread):
         self.sockCtrl.bind(('0.0.0.0', self.sock.getsockname()[1] + 1))
         time.sleep(0.1)
 
-        # find audio device
-        deviceIndex = None # fallback: system default
-        info = audio.get_host_api_info_by_index(0)
-        for i in range(0, info.get('deviceCount')):
-            deviceInfo = audio.get_device_info_by_host_api_device_index(0, i)
-            if((deviceInfo.get('maxInputChannels')) > 0):
-                if(deviceName != None and deviceName in deviceInfo.get('name')):
-                    deviceIndex = i
-                    self.soundcardSampleRate = int(deviceInfo.get('defaultSampleRate')) # use specific soundcard sample rate, otherwise error
+        self.payloadSampleRate = self.codec.sampleRate
+        self.packetizer = RtpPacketizer(self.payloadType, self.codec.clockRate, self.payloadSampleRate)
+        self.statistics = statistics if statistics != None else CallStatistics()
+        self.statistics.packetizer = self.packetizer
+        self.rtcp = RtcpSocket(self.sockCtrl, self.dstAddress, self.dstPortCtrl, self.statistics, self.packetizer)
+        self.openAudioStream(audio, deviceName)
+
+        # call Thread constructor
+        super(OutputAudioSocket, self).__init__(*args, **kwargs)
+        self.daemon = True
+
+    def openAudioStream(self, audio, deviceName):
+        # find audio device, use the codec rate if possible so we do not need to convert e.g. PCMU and PCMA
+        deviceIndex, deviceSampleRate = findAudioDevice(audio, deviceName, True, findHostApi(audio, self.mediaSettings.get('host-api')))
         if deviceIndex == None: print(':: using default input device ', deviceName)
-        # open sound card
+        self.soundcardSampleRate = chooseSampleRate(audio, deviceIndex, [self.codec.sampleRate, deviceSampleRate], True)
+        print(f':: opening input device with {self.soundcardSampleRate} Hz for {self.codec.sampleRate} Hz audio'
+            + (' (no resampling)' if self.soundcardSampleRate == self.codec.sampleRate else ' (resampling)'))
+        # number of sound card frames which make up one codec frame (CHUNK is given in codec samples)
+        self.soundcardChunk = int(self.CHUNK * self.soundcardSampleRate / self.payloadSampleRate)
+        self.resampler = None
+        if(self.soundcardSampleRate != self.payloadSampleRate):
+            self.resampler = Resampler(self.soundcardSampleRate, self.payloadSampleRate)
+        # open sound card in callback mode, captured audio is handed over via lock-free ring buffer
+        # so that a full socket buffer never stalls the capture
+        # by default, the sound card delivers one codec frame per callback
+        framesPerBuffer, latency = streamBufferSettings(self.mediaSettings, 'capture', self.soundcardSampleRate, self.soundcardChunk)
+        self.captureBuffer = RingBuffer(int(self.soundcardSampleRate * self.SAMPLE_WIDTH * self.BUFFER_SECONDS))
+        self.maxBacklog = max(2 * max(self.soundcardChunk, framesPerBuffer) * self.SAMPLE_WIDTH, int(self.soundcardSampleRate * self.SAMPLE_WIDTH * self.MAX_BACKLOG_SECONDS))
         self.audioStream = audio.open(
-            format=pyaudio.paInt16, # conform with lin2alaw second parameter (2 bytes -> 16 bit)
+            format=paInt16, # G.711 codec works on 16 bit samples
             channels=1,
             rate=self.soundcardSampleRate,
-            frames_per_buffer=self.CHUNK,
+            frames_per_buffer=framesPerBuffer,
+            suggested_latency=latency,
             input=True,
-            input_device_index=deviceIndex)
+            input_device_index=deviceIndex,
+            stream_callback=self.audioCallback)
+        print(f':: capture buffer {framesPerBuffer} frames ({framesPerBuffer / self.soundcardSampleRate * 1000:.1f} ms)')
 
-        # call Thread constructor
-        super(OutputAudioSocket, self).__init__(*args, **kwargs)
-        self.daemon = True
+    def switchAudio(self, audio, deviceName=None):
+        # continue the capture on another audio backend (e.g. a ConferenceLeg) without interrupting the RTP session
+        with self.streamLock:
+            self.audioStream.stop_stream()
+            self.audioStream.close()
+            self.openAudioStream(audio, deviceName)
 
     def run(self, *args, **kwargs):
-        print(f':: starting outgoing UDP RTP stream to {self.dstAddress}:{self.dstPort}')
+        print(f':: starting outgoing UDP RTP stream to {self.dstAddress}:{self.dstPort} ({self.codec.name}, {self.codec.packetTime} ms packets)')
+        self.schedulingReport = applyThreadScheduling(self.mediaSettings)
+        print(f':: send thread scheduling: {self.schedulingReport}')
 
         # STUN binding indication
         stunInitPacket = bytes([
@@ -246,64 +433,75 @@ class OutputAudioSocket(threading.Thread):
         ])
         self.sock.sendto(stunInitPacket, (self.dstAddress, self.dstPort))
         self.sockCtrl.sendto(stunInitPacket, (self.dstAddress, self.dstPortCtrl))
+        self.rtcp.start()
 
         try:
-            timestamp = self.CHUNK
-            sequenceNumber = 1
-            marker = 0x80
+            codec = self.codec
+            vad = self.vad
+            dspPipeline = self.dspPipeline
+            dstAddress = (self.dstAddress, self.dstPort)
             while True:
                 if(self.stopFlag): break
 
-                # compile RTP head
-                sequenceNumberBytes = struct.pack('>H', sequenceNumber)
-                timestampBytes = struct.pack('>I', timestamp)
-                rtpHead = bytes([
-                    0x80, # RTP version = 2; no padding; no extension
-                    self.payloadType + marker, # payload type with marker bit
-                    sequenceNumberBytes[0], sequenceNumberBytes[1],
-                    timestampBytes[0], timestampBytes[1], timestampBytes[2], timestampBytes[3],
-                    self.ssrc[0], self.ssrc[1], self.ssrc[2], self.ssrc[3],
-                ])
-
-                # read from soundcard
-                audioData = self.audioStream.read(self.CHUNK)
-
-                # sample rate conversion
-                payloadSampleRate = 8000 # PCMA and PCMU always uses 8khz
-                if(self.payloadType == self.opusPayloadType):
-                    payloadSampleRate = self.opusSampleRate
-                elif(self.payloadType == self.g729PayloadType):
-                    payloadSampleRate = self.g729SampleRate
-                if(self.soundcardSampleRate != payloadSampleRate):
-                    audioData, state = audioop.ratecv(audioData, 2, 1, self.soundcardSampleRate, payloadSampleRate, self.sampleRateConverterState)
-                    self.sampleRateConverterState = state
+                # read from soundcard ring buffer (filled by audioCallback)
+                chunkBytes = self.soundcardChunk * self.SAMPLE_WIDTH
+                if(not self.captureBuffer.wait(chunkBytes, 0.5)): continue
+                with self.streamLock:
+                    # switchAudio() may have replaced the sound card while waiting
+                    chunkBytes = self.soundcardChunk * self.SAMPLE_WIDTH
+                    if(self.captureBuffer.available() < chunkBytes): continue
+                    # after a CPU spike, drop the oldest frames instead of sending stale audio with growing delay;
+                    # the RTP timestamp still advances so that the receiver sees a gap, not a time shift
+                    while(self.captureBuffer.available() > self.maxBacklog):
+                        self.captureBuffer.discard(chunkBytes)
+                        self.packetizer.skip(self.CHUNK)
+                        self.droppedFrames += 1
+                    audioData = self.captureBuffer.read(chunkBytes)
+
+                    # sample rate conversion
+                    if(self.resampler != None):
+                        audioData = self.resampler.process(audioData)
+
+                # gain control, echo suppression
+                audioData = dspPipeline.process(audioData)
+                if(self.recorder != None): self.recorder.send(audioData, self.payloadSampleRate)
+
+                # silence: skip encoding, only send a comfort noise update now and then
+                if(vad != None and not vad.process(audioData)):
+                    if(vad.comfortNoiseDue()):
+                        self.packetizer.send(self.sock, dstAddress, vad.comfortNoisePayload(), self.CHUNK, self.comfortNoisePayloadType)
+                    else:
+                        self.packetizer.skip(self.CHUNK)
+                    continue
 
                 # encode payload
-                if(self.payloadType == 0x08):
-                    rtpBody = audioop.lin2alaw(audioData, 2)
-                elif(self.payloadType == self.opusPayloadType):
-                    rtpBody = self.opusEncoder.encode(audioData, self.CHUNK)
-                elif(self.payloadType == self.g729PayloadType):
-                    rtpBody = self.g729Encoder.encode(audioData)
-                else: # use PCMU as fallback
-                    rtpBody = audioop.lin2ulaw(audioData, 2)
-
-                # write to RTP socket
-                self.sock.sendto(rtpHead+rtpBody, (self.dstAddress, self.dstPort))
-
-                marker = 0
-                timestamp += self.CHUNK
-                sequenceNumber += 1
-                if(sequenceNumber > 65535): sequenceNumber = 0
+                rtpBody = codec.encode(audioData)
+
+                # write to RTP socket (header and payload via scatter/gather, no concatenation)
+                if(rtpBody == None): # silence suppressed by the encoder (DTX)
+                    self.packetizer.skip(self.CHUNK)
+                else:
+                    self.packetizer.send(self.sock, dstAddress, rtpBody, self.CHUNK)
 
         except OSError:
             pass
 
         self.sock.close()
-        self.sockCtrl.close()
-        self.audioStream.stop_stream()
-        self.audioStream.close()
-        print(f':: stopped outgoing UDP RTP stream')
+        with self.streamLock:
+            self.audioStream.stop_stream()
+            self.audioStream.close()
+        print(f':: stopped outgoing UDP RTP stream (capture buffer underruns: {self.captureBuffer.underruns}, overruns: {self.captureBuffer.overruns}, '
+            + f'input overflows: {self.inputOverflows}, dropped frames: {self.droppedFrames})')
+        if(self.vad != None):
+            print(f':: voice activity detection suppressed {self.vad.suppressedFrames} of {self.vad.suppressedFrames+self.vad.speechFrames} frames')
+        if(self.dspPipeline.stages):
+            print(f':: send DSP timing: {self.dspPipeline.report()}')
+
+    def audioCallback(self, inData, frameCount, timeInfo, status):
+        # called from the PortAudio thread - must never block
+        if(status & paInputOverflow): self.inputOverflows += 1
+        self.captureBuffer.write(inData)
+        return (None, paContinue)
 
     def stop(self):
         self.stopFlag = True
@@ -314,74 +512,139 @@ class OutputAudioSocket(threading.Thread):
             #self.sock.close()
             #self.audioStream.stop_stream()
             #self.audioStream.close()
-        try:
-            self.sockCtrl.shutdown(socket.SHUT_RDWR)
-        except OSError: pass # Errno 107 is OK, may already closed by InputAudioSocket
-            #self.sockCtrl.close()
-
-
-class AudioPlayer(threading.Thread):
-    CHUNK = 4098
-
-    def __init__(self, waveFile, audio, deviceNames=[], *args, **kwargs):
-        #audio = pyaudio.PyAudio()
-        self.audioStreams = []
-        self.audioFileSampleRate = 44100
+        # sends RTCP BYE, the RTCP thread closes sockCtrl
+        self.rtcp.stop()
+
+
+class RingtoneOutput():
+    # one output device of an AudioPlayer: a callback stream which loops the cached PCM,
+    # so that every device is fed by its own sound card thread and a slow device can not delay the others
+    def __init__(self, audio, deviceIndex, pcm, rate, channels, framesPerBuffer):
+        self.audio = audio
+        self.deviceIndex = deviceIndex
+        self.pcm = pcm
+        self.rate = rate
+        self.channels = channels
+        self.frameBytes = channels * 2
+        self.framesPerBuffer = framesPerBuffer
+        self.position = 0 # bytes
+        self.stream = None
         self.stopFlag = False
 
-        # open wave file
-        self.wf = wave.open(waveFile, 'rb')
-        self.audioFileSampleRate = self.wf.getframerate()
-
-        # open sound card
-        info = audio.get_host_api_info_by_index(0)
+    def open(self):
+        self.stream = self.audio.open(
+            format=paInt16,
+            channels=self.channels,
+            rate=self.rate,
+            frames_per_buffer=self.framesPerBuffer,
+            output=True,
+            output_device_index=self.deviceIndex,
+            stream_callback=self.audioCallback,
+            start=False)
+
+    def start(self, offset=0.0):
+        # offset: seconds since the other devices started ringing, to stay in sync with them
+        self.position = int(offset * self.rate) * self.frameBytes % len(self.pcm)
+        self.stream.start_stream()
+
+    def audioCallback(self, inData, frameCount, timeInfo, status):
+        size = frameCount * self.frameBytes
+        if(self.stopFlag): return bytes(size), paComplete
+        data = b''
+        while(len(data) < size):
+            chunk = self.pcm[self.position:self.position + size - len(data)]
+            data += chunk
+            self.position = (self.position + len(chunk)) % len(self.pcm)
+        return data, paContinue
+
+    def close(self):
+        self.stopFlag = True
+        if(self.stream == None): return
+        if(self.stream.is_active()): self.stream.stop_stream()
+        self.stream.close()
+
+class AudioPlayer():
+    # Plays a ringtone in an endless loop on one or more devices until stop() is called. The PCM comes
+    # from a cache shared by all players, so only the output streams have to be opened per call.
+    # Every device is opened, started and closed by its own worker thread. Devices which are ready within
+    # START_WINDOW start ringing together, a slower device joins later at the same position of the ringtone.
+    CHUNK_SECONDS = 0.05
+    START_WINDOW = 0.2 # seconds
+    STOP_TIMEOUT = 1.0 # seconds
+    cache = RingtoneCache()
+    deviceRates = {} # (backend, device index, file rate, channels) -> sample rate, probing a device is slow
+
+    def __init__(self, waveFile, audio, deviceNames=[], hostApi=0):
+        self.outputs = []
+        self.workers = []
+        self.startTime = None
+        self.lock = threading.Lock()
+        self.stopEvent = threading.Event()
+
+        # ringtone resampled to the rate of each device
+        for deviceIndex, rate in self.findDevices(waveFile, audio, deviceNames, hostApi):
+            pcm, rate, channels = self.cache.get(waveFile, rate)
+            if(len(pcm) == 0): continue
+            self.outputs.append(RingtoneOutput(audio, deviceIndex, pcm, rate, channels, int(rate * self.CHUNK_SECONDS)))
+
+    @classmethod
+    def findDevices(cls, waveFile, audio, deviceNames=[], hostApi=0):
+        # returns [(device index or None for the default device, sample rate)] of the selected ringtone devices
+        _, fileRate, channels = cls.cache.get(waveFile)
+        devices = []
+        info = audio.get_host_api_info_by_index(hostApi)
         for i in range(0, info.get('deviceCount')):
-            deviceInfo = audio.get_device_info_by_host_api_device_index(0, i)
+            deviceInfo = audio.get_device_info_by_host_api_device_index(hostApi, i)
+            deviceIndex = deviceInfo.get('index', i)
             if((deviceInfo.get('maxOutputChannels')) > 0
             and re.sub('[\\(\\[].*?[\\)\\]]', '', deviceInfo.get('name')).strip() in deviceNames):
-                self.audioStreams.append({
-                    'stream': audio.open(
-                        format=audio.get_format_from_width(self.wf.getsampwidth()),
-                        channels=self.wf.getnchannels(),
-                        rate=int(deviceInfo.get('defaultSampleRate')),
-                        frames_per_buffer=self.CHUNK,
-                        output=True,
-                        output_device_index=i),
-                    'rate': int(deviceInfo.get('defaultSampleRate')),
-                    'state': None
-                })
-        if(len(self.audioStreams) == 0): # fallback: system default
+                key = (id(audio), deviceIndex, fileRate, channels)
+                if(key not in cls.deviceRates):
+                    # play the file with its own rate if the device supports it
+                    cls.deviceRates[key] = chooseSampleRate(audio, deviceIndex, [fileRate, int(deviceInfo.get('defaultSampleRate'))], False, channels)
+                devices.append((deviceIndex, cls.deviceRates[key]))
+        if(len(devices) == 0): # fallback: system default (or default of the selected host API)
             print(':: using default ringtone output device ', deviceNames)
-            self.audioStreams.append({
-                'stream':audio.open(
-                    format=audio.get_format_from_width(self.wf.getsampwidth()),
-                    channels=self.wf.getnchannels(),
-                    rate=self.audioFileSampleRate,
-                    frames_per_buffer=self.CHUNK,
-                    output=True),
-                'rate': self.audioFileSampleRate,
-                'state': None
-            })
-
-        # call Thread constructor
-        super(AudioPlayer, self).__init__(*args, **kwargs)
-        self.daemon = True
-
-    def run(self, *args, **kwargs):
-        data = self.wf.readframes(self.CHUNK)
-        while data != b'':
-            if(self.stopFlag): break
-            for s in self.audioStreams:
-                audioData = data
-                if(self.audioFileSampleRate != s['rate']):
-                    audioData, state = audioop.ratecv(audioData, 2, 1, self.audioFileSampleRate, s['rate'], s['state'])
-                    s['state'] = state
-                s['stream'].write(audioData)
-            data = self.wf.readframes(self.CHUNK)
-        for s in self.audioStreams:
-            s['stream'].stop_stream()
-            s['stream'].close()
+            deviceIndex, _ = findAudioDevice(audio, None, False, hostApi)
+            devices.append((deviceIndex, fileRate))
+        return devices
+
+    @classmethod
+    def preload(cls, waveFile, audio, deviceNames=[], hostApi=0):
+        # decode and resample the ringtone before the first call
+        for deviceIndex, rate in cls.findDevices(waveFile, audio, deviceNames, hostApi):
+            cls.cache.get(waveFile, rate)
+
+    def start(self):
+        if(len(self.outputs) == 0): return
+        barrier = threading.Barrier(len(self.outputs))
+        for output in self.outputs:
+            worker = threading.Thread(target=self.runOutput, args=(output, barrier), daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def runOutput(self, output, barrier):
+        try:
+            output.open()
+        except Exception:
+            traceback.print_exc()
+            barrier.abort() # do not let the other devices wait for this one
+            return
+        try:
+            barrier.wait(self.START_WINDOW)
+        except threading.BrokenBarrierError:
+            pass # another device is slow or failed to open
+        with self.lock:
+            if(not self.stopEvent.is_set()):
+                if(self.startTime == None): self.startTime = time.monotonic()
+                output.start(time.monotonic() - self.startTime)
+        self.stopEvent.wait()
+        output.close()
 
     def stop(self):
-        self.stopFlag = True
-        time.sleep(0.1) # wait one moment to finish playback of current chunk, otherwise InputAudioSocket will throw "device unavailable" when trying to write on the same device
+        # all devices are closed in parallel, so stopping takes as long as the slowest device instead of the sum;
+        # returns when the devices are released, otherwise InputAudioSocket could not open the same device
+        self.stopEvent.set()
+        deadline = time.monotonic() + self.STOP_TIMEOUT
+        for worker in self.workers:
+            worker.join(max(0, deadline - time.monotonic()))
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+# Micro benchmarks for the media path. They do not need a sound card or a SIP server:
+# python3 -m jabber4linux.Benchmark rtp-receive
+
+import socket
+import struct
+import time
+import tracemalloc
+
+import os
+import math
+import numpy
+
+from .Rtp import RTP_MAX_DATAGRAM, unpackRtpHeader, RtpPacketizer
+from .Resampler import Resampler
+from . import G711
+from . import G722
+from .Dsp import DspPipeline, AutomaticGainControl, EchoSuppressor
+
+# reference implementation for comparisons, removed in Python 3.13
+try:
+    import warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        import audioop
+except ImportError:
+    audioop = None
+try:
+    import opuslib
+except ImportError:
+    opuslib = None
+
+
+def measureAllocations(func, count):
+    # returns (bytes allocated per call, microseconds per call)
+    # tracemalloc peak is reset before every call, so the peak is the temporary memory of one call
+    tracemalloc.start()
+    peakSum = 0
+    for i in range(count):
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        peakSum += peak - current
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for i in range(count): func()
+    duration = time.perf_counter() - start
+    return peakSum / count, duration / count * 1_000_000
+
+def benchmarkRtpReceive(count):
+    sender, receiver = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+    packet = bytes([0x80, 0x08, 0x00, 0x01, 0x00, 0x00, 0x00, 0xa0, 0x12, 0x34, 0x56, 0x78]) + bytes(160)
+    state = {}
+
+    def legacy():
+        # receive path before user-027: recvfrom() + slicing
+        sender.send(packet)
+        datagram = receiver.recv(1024)
+        rtpHead = datagram[:12]
+        state['payloadType'] = rtpHead[1] & 0b01111111
+        state['remoteSsrc'] = rtpHead[8:12]
+        state['hsnr'] = rtpHead[2:4]
+        state['body'] = datagram[12:]
+
+    recvBuffer = bytearray(RTP_MAX_DATAGRAM)
+    recvView = memoryview(recvBuffer)
+    def zeroCopy():
+        sender.send(packet)
+        size = receiver.recv_into(recvBuffer)
+        rtpHead = unpackRtpHeader(recvBuffer, size)
+        state['payloadType'] = rtpHead[0]
+        state['remoteSsrc'] = rtpHead[4]
+        state['hsnr'] = rtpHead[2]
+        state['body'] = recvView[rtpHead[5]:rtpHead[6]]
+
+    for name, func in [('recvfrom + slicing', legacy), ('recv_into + struct', zeroCopy)]:
+        allocated, micros = measureAllocations(func, count)
+        print(f'{name:24} {allocated:8.1f} bytes allocated/packet {micros:8.2f} us/packet')
+    sender.close()
+    receiver.close()
+
+def benchmarkRtpSend(count):
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.setblocking(False)
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    address = receiver.getsockname()
+    payload = bytes(160)
+
+    def legacy():
+        # send path before user-028: struct.pack + 12 element list + concatenation
+        ssrc = os.urandom(4)
+        timestamp = 160; sequenceNumber = 1; marker = 0x80
+        for i in range(count):
+            sequenceNumberBytes = struct.pack('>H', sequenceNumber)
+            timestampBytes = struct.pack('>I', timestamp)
+            rtpHead = bytes([
+                0x80, 8 + marker,
+                sequenceNumberBytes[0], sequenceNumberBytes[1],
+                timestampBytes[0], timestampBytes[1], timestampBytes[2], timestampBytes[3],
+                ssrc[0], ssrc[1], ssrc[2], ssrc[3],
+            ])
+            sender.sendto(rtpHead+payload, address)
+            marker = 0
+            timestamp += 160
+            sequenceNumber += 1
+            if(sequenceNumber > 65535): sequenceNumber = 0
+
+    def packetizer():
+        packetizer = RtpPacketizer(8, 8000)
+        for i in range(count):
+            packetizer.send(sender, address, payload, 160)
+
+    for name, func in [('struct.pack + sendto', legacy), ('pack_into + sendmsg', packetizer)]:
+        start = time.perf_counter()
+        func()
+        duration = time.perf_counter() - start
+        print(f'{name:24} {count/duration:12.0f} packets/s')
+    sender.close()
+    receiver.close()
+
+def testSignal(rate, seconds, frequency=1000, amplitude=10000):
+    t = numpy.arange(int(rate * seconds)) / rate
+    return (numpy.sin(2 * math.pi * frequency * t) * amplitude).astype(numpy.int16)
+
+def benchmarkResampler(count):
+    seconds = max(1, count // 1000)
+    for inRate, outRate in [(48000, 8000), (8000, 48000), (44100, 48000), (48000, 44100)]:
+        chunks = [c.tobytes() for c in numpy.array_split(testSignal(inRate, seconds), seconds * 50)] # 20 ms chunks
+        results = []
+        if(audioop):
+            state = None
+            start = time.process_time()
+            for chunk in chunks:
+                _, state = audioop.ratecv(chunk, 2, 1, inRate, outRate, state)
+            results.append(('audioop.ratecv', time.process_time() - start))
+        resampler = Resampler(inRate, outRate)
+        start = time.process_time()
+        for chunk in chunks:
+            resampler.process(chunk)
+        results.append(('polyphase', time.process_time() - start))
+        for name, duration in results:
+            print(f'{inRate:5} -> {outRate:5} Hz {name:16} {duration/seconds*1000:8.3f} ms CPU per second of audio')
+
+def benchmarkG711(count):
+    allSamples = numpy.arange(65536, dtype=numpy.uint16).tobytes()
+    allCodes = bytes(range(256))
+    if(audioop):
+        # conformance: every possible input must produce the same output as audioop
+        conformance = {
+            'ulaw encode': G711.ulawEncode(allSamples) == audioop.lin2ulaw(allSamples, 2),
+            'alaw encode': G711.alawEncode(allSamples) == audioop.lin2alaw(allSamples, 2),
+            'ulaw decode': G711.ulawDecode(allCodes) == audioop.ulaw2lin(allCodes, 2),
+            'alaw decode': G711.alawDecode(allCodes) == audioop.alaw2lin(allCodes, 2),
+        }
+        for name, ok in conformance.items():
+            print(f'{name:24} bit-exact with audioop: {"yes" if ok else "NO"}')
+    else:
+        print('audioop not available, skipping conformance check')
+
+    frame = testSignal(8000, 0.02).tobytes() # one 20 ms frame
+    encoded = G711.alawEncode(frame)
+    candidates = [
+        ('G711.alawEncode', G711.alawEncode, frame),
+        ('G711.alawDecode', G711.alawDecode, encoded),
+        ('G711.ulawEncode', G711.ulawEncode, frame),
+        ('G711.ulawDecode', G711.ulawDecode, encoded),
+    ]
+    if(audioop):
+        candidates += [
+            ('audioop.lin2alaw', lambda d: audioop.lin2alaw(d, 2), frame),
+            ('audioop.alaw2lin', lambda d: audioop.alaw2lin(d, 2), encoded),
+        ]
+    for name, func, data in candidates:
+        start = time.perf_counter()
+        for i in range(count): func(data)
+        duration = time.perf_counter() - start
+        print(f'{name:24} {count/duration:12.0f} frames/s')
+
+def createOpusCodec():
+    encoder = opuslib.Encoder(48000, 1, 'voip')
+    decoder = opuslib.Decoder(48000, 1)
+    return (lambda pcm: encoder.encode(pcm, 960)), (lambda payload: decoder.decode(payload, 960))
+
+def createG722Codec():
+    return G722.G722Encoder().encode, G722.G722Decoder().decode
+
+def createG711Codec():
+    return G711.alawEncode, G711.alawDecode
+
+def benchmarkCodecs(count):
+    # encode and decode CPU time of 20 ms frames for every codec, in the codec's own sample rate
+    candidates = [('G.711 A-law', 8000, createG711Codec)]
+    if(G722.available()):
+        candidates.append(('G.722', 16000, createG722Codec))
+    else:
+        print('spandsp not available, skipping G.722')
+    if(opuslib):
+        candidates.append(('Opus', 48000, createOpusCodec))
+    else:
+        print('opuslib not available, skipping Opus')
+    frameCount = max(50, count // 100)
+    seconds = frameCount / 50
+    for name, rate, factory in candidates:
+        frames = [c.tobytes() for c in numpy.array_split(testSignal(rate, seconds), frameCount)]
+        encode, decode = factory()
+        start = time.process_time()
+        encoded = [encode(frame) for frame in frames]
+        encodeTime = time.process_time() - start
+        start = time.process_time()
+        for payload in encoded: decode(payload)
+        decodeTime = time.process_time() - start
+        print(f'{name:12} encode {encodeTime/seconds*1000:8.2f} ms  decode {decodeTime/seconds*1000:8.2f} ms CPU per second of audio')
+
+def benchmarkDsp(count):
+    # per stage timing of the send and receive DSP pipelines, 20 ms frames at 48 kHz (worst case: Opus)
+    frames = [c.tobytes() for c in numpy.array_split(testSignal(48000, max(1, count // 1000)), max(50, count // 20))]
+    echoSuppressor = EchoSuppressor()
+    sendPipeline = DspPipeline([echoSuppressor, AutomaticGainControl()])
+    receivePipeline = DspPipeline([echoSuppressor.farEnd, AutomaticGainControl()])
+    for frame in frames:
+        receivePipeline.process(frame)
+        sendPipeline.process(frame)
+    print(f'send:    {sendPipeline.report()}')
+    print(f'receive: {receivePipeline.report()}')
+
+BENCHMARKS = {
+    'rtp-receive': benchmarkRtpReceive,
+    'rtp-send': benchmarkRtpSend,
+    'resampler': benchmarkResampler,
+    'g711': benchmarkG711,
+    'codecs': benchmarkCodecs,
+    'dsp': benchmarkDsp,
+}
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('benchmark', nargs='*', help='benchmarks to run: '+', '.join(BENCHMARKS.keys())+' (default: all)')
+    parser.add_argument('-n', '--count', type=int, default=10000, help='iterations per benchmark')
+    args = parser.parse_args()
+
+    for name in (args.benchmark or BENCHMARKS.keys()):
+        if(name not in BENCHMARKS): parser.error(f'unknown benchmark {name}')
+        print(f'=== {name} ===')
+        BENCHMARKS[name](args.count)
+
+if __name__ == '__main__':
+    main()
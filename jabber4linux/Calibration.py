@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+# Sound card buffer calibration: plays and records silence with decreasing buffer sizes, while a background
+# thread encodes and decodes audio like during a call, and finds the smallest buffer per direction which
+# runs without under-/overflows on this machine. Uses audio backend, host API and devices from settings.json:
+# python3 -m jabber4linux.Calibration --save
+
+import threading
+import json
+import time
+import numpy
+
+from .__init__ import CFG_PATH
+from .AudioBackend import createAudioBackend, paInt16, paContinue, paInputOverflow, paOutputUnderflow
+from .AudioSocket import findHostApi, findAudioDevice, chooseSampleRate
+from .Codecs import createCodecs, codecAvailable
+
+
+CANDIDATE_BUFFERS = (80, 40, 20, 10, 5, 2.5) # milliseconds, largest first
+TEST_SECONDS = 5
+
+class GlitchCounter():
+    # stream callback which plays/discards silence and counts the under-/overflows reported by the sound card
+    def __init__(self, isInput):
+        self.isInput = isInput
+        self.callbacks = 0
+        self.glitches = 0
+
+    def __call__(self, inData, frameCount, timeInfo, status):
+        self.callbacks += 1
+        if(status & (paInputOverflow | paOutputUnderflow)): self.glitches += 1
+        return (None if self.isInput else bytes(frameCount * 2)), paContinue
+
+class CodecLoad(threading.Thread):
+    # encodes and decodes one G.722 frame (PCMU without spandsp) every 20 ms, so that the audio callbacks
+    # compete for the GIL and the CPU like during a call
+    def __init__(self, *args, **kwargs):
+        if(codecAvailable('g722')): self.codec = createCodecs({9: 'G722/8000'})[9]
+        else: self.codec = createCodecs({0: 'PCMU/8000'})[0]
+        self.frame = (numpy.random.default_rng(0).normal(0, 3000, self.codec.frameSamples)).astype(numpy.int16).tobytes()
+        self.stopFlag = False
+
+        # call Thread constructor
+        super(CodecLoad, self).__init__(*args, **kwargs)
+        self.daemon = True
+
+    def run(self, *args, **kwargs):
+        nextTime = time.monotonic()
+        while(not self.stopFlag):
+            self.codec.decode(self.codec.encode(self.frame))
+            nextTime += self.codec.frameDuration
+            time.sleep(max(0, nextTime - time.monotonic()))
+
+    def stop(self):
+        self.stopFlag = True
+
+def testBuffer(audio, deviceIndex, rate, isInput, bufferMs, seconds=TEST_SECONDS):
+    # returns (glitches, callbacks, latency reported by the stream in seconds)
+    counter = GlitchCounter(isInput)
+    framesPerBuffer = max(1, int(rate * bufferMs / 1000))
+    stream = audio.open(
+        format=paInt16,
+        channels=1,
+        rate=rate,
+        frames_per_buffer=framesPerBuffer,
+        input=isInput,
+        output=not isInput,
+        input_device_index=deviceIndex if isInput else None,
+        output_device_index=None if isInput else deviceIndex,
+        stream_callback=counter)
+    time.sleep(seconds)
+    latency = stream.get_input_latency() if isInput else stream.get_output_latency()
+    stream.stop_stream()
+    stream.close()
+    return counter.glitches, counter.callbacks, latency
+
+def calibrateDirection(audio, deviceIndex, rate, isInput, seconds=TEST_SECONDS, candidates=CANDIDATE_BUFFERS):
+    # returns the smallest glitch-free buffer in milliseconds, None if even the largest buffer glitches;
+    # stops at the first glitching size since smaller buffers will not do better
+    best = None
+    for bufferMs in candidates:
+        try:
+            glitches, callbacks, latency = testBuffer(audio, deviceIndex, rate, isInput, bufferMs, seconds)
+        except (OSError, ValueError) as e:
+            print(f'   {bufferMs:5} ms: can not open stream ({e})')
+            break
+        print(f'   {bufferMs:5} ms: {glitches} glitches in {callbacks} callbacks, stream latency {latency * 1000:.1f} ms')
+        if(glitches > 0 or callbacks == 0): break
+        best = bufferMs
+    return best
+
+def calibrate(audio, mediaSettings={}, inputDeviceName=None, outputDeviceName=None, seconds=TEST_SECONDS):
+    # returns the recommended 'playback-buffer' and 'capture-buffer' media settings
+    hostApi = findHostApi(audio, mediaSettings.get('host-api'))
+    print(f":: calibrating host API {audio.get_host_api_info_by_index(hostApi).get('name')}")
+    result = {}
+    for direction, isInput, deviceName in (('playback', False, outputDeviceName), ('capture', True, inputDeviceName)):
+        deviceIndex, deviceSampleRate = findAudioDevice(audio, deviceName, isInput, hostApi)
+        rate = chooseSampleRate(audio, deviceIndex, [deviceSampleRate, 48000], isInput)
+        print(f":: {direction} device {deviceName or 'default'} with {rate} Hz")
+        best = calibrateDirection(audio, deviceIndex, rate, isInput, seconds)
+        if(best == None):
+            print(f':: no glitch-free {direction} buffer found, keeping the default')
+        else:
+            result[direction + '-buffer'] = best
+    return result
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Find the smallest glitch-free sound card buffer sizes on this machine')
+    parser.add_argument('--seconds', type=float, default=TEST_SECONDS, help='test duration per buffer size')
+    parser.add_argument('--no-load', action='store_true', help='do not simulate the CPU load of a call')
+    parser.add_argument('--save', action='store_true', help='store the result in the media settings (Jabber4Linux must not be running)')
+    args = parser.parse_args()
+
+    try:
+        with open(CFG_PATH) as f:
+            settings = json.load(f)
+    except (OSError, ValueError):
+        settings = {}
+    mediaSettings = settings.get('media', {})
+
+    audio = createAudioBackend(mediaSettings)
+    load = None
+    if(not args.no_load):
+        load = CodecLoad()
+        load.start()
+    try:
+        result = calibrate(audio, mediaSettings, settings.get('input-device'), settings.get('output-device'), args.seconds)
+    finally:
+        if(load != None): load.stop()
+        audio.terminate()
+    print(json.dumps(result, indent=4))
+
+    if(args.save and result):
+        settings['media'] = {**mediaSettings, **result}
+        with open(CFG_PATH, 'w') as f:
+            json.dump(settings, f, indent=4)
+        print(f':: saved to {CFG_PATH}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+
+# Optional call recording. The media threads only hand decoded (remote) and captured (local) frames
+# to a bounded queue; resampling, mixing, encoding and file I/O happen in a background writer thread,
+# so a slow disk or network home directory can never stall the call. If the writer falls behind
+# by more than MAX_QUEUED_FRAMES, further frames are dropped and counted instead of using more memory.
+
+import threading
+import traceback
+import datetime
+import random
+import struct
+import queue
+import wave
+import time
+import os
+import numpy
+
+from .__init__ import RECORDINGS_DIR
+from .Resampler import Resampler
+from .Codecs import loadLibrary
+
+
+RATE = 16000 # recording sample rate, wideband covers G.711 and G.722 completely
+
+class RecordingChannel():
+    # audio of one direction at the recording rate, placed on the call timeline by arrival time
+    GAP_TOLERANCE = 0.1 # seconds; later frames are jitter, even later ones follow a gap (silence suppression, loss)
+
+    def __init__(self):
+        self.resampler = None
+        self.chunks = []
+        self.end = 0 # timeline position (samples) after the last buffered sample
+        self.written = 0 # timeline position up to which the audio was handed to the file writer
+
+    def add(self, samples, rate, position):
+        # `position`: timeline position at which the frame ended (arrival time)
+        if(rate != RATE):
+            if(self.resampler == None or self.resampler.inRate != rate):
+                self.resampler = Resampler(rate, RATE)
+            samples = self.resampler.processArray(samples)
+        start = position - len(samples)
+        if(start - self.end > self.GAP_TOLERANCE * RATE):
+            self.pad(start)
+        self.chunks.append(samples)
+        self.end += len(samples)
+
+    def pad(self, position):
+        if(position > self.end):
+            self.chunks.append(numpy.zeros(position - self.end, dtype=numpy.int16))
+            self.end = position
+
+    def take(self, position):
+        # returns the samples up to the timeline position (padded with silence), keeps the rest
+        self.pad(position)
+        samples = numpy.concatenate(self.chunks) if self.chunks else numpy.zeros(0, dtype=numpy.int16)
+        count = position - self.written
+        self.chunks = [samples[count:]] if count < len(samples) else []
+        self.written = position
+        return samples[:count]
+
+class WaveWriter():
+    def __init__(self, path, channels):
+        self.wf = wave.open(path, 'wb')
+        self.wf.setnchannels(channels)
+        self.wf.setsampwidth(2)
+        self.wf.setframerate(RATE)
+
+    def write(self, samples):
+        self.wf.writeframes(samples.tobytes())
+
+    def close(self):
+        self.wf.close()
+
+def oggCrcTable():
+    # CRC-32 as used by Ogg: polynomial 0x04c11db7, not bit-reflected (unlike zlib.crc32)
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04c11db7) if crc & 0x80000000 else (crc << 1)
+        table.append(crc & 0xffffffff)
+    return table
+
+OGG_CRC_TABLE = oggCrcTable()
+
+def oggCrc(data):
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xffffffff) ^ OGG_CRC_TABLE[(crc >> 24) ^ byte]
+    return crc
+
+class OggOpusWriter():
+    # Ogg/Opus file (RFC 7845), about 10 times smaller than WAV
+    FRAME_DURATION = 0.02 # seconds
+    PACKETS_PER_PAGE = 50
+    VENDOR = b'Jabber4Linux'
+
+    def __init__(self, path, channels):
+        self.file = open(path, 'wb')
+        self.channels = channels
+        self.frameSamples = int(RATE * self.FRAME_DURATION)
+        self.encoder = loadLibrary('opuslib').Encoder(RATE, channels, 'voip')
+        self.serial = random.getrandbits(32)
+        self.sequence = 0
+        self.granule = 0 # position in 48 kHz samples, as required by Ogg/Opus regardless of the input rate
+        self.packets = []
+        self.buffer = numpy.zeros((0, channels), dtype=numpy.int16)
+        # encoder delay which players skip at the start, in 48 kHz samples
+        preSkip = 312
+        try:
+            preSkip = int(self.encoder.lookahead) * 48000 // RATE
+        except Exception: pass
+        self.writePage([b'OpusHead' + struct.pack('<BBHIhB', 1, channels, preSkip, RATE, 0, 0)], 0, 0x02)
+        self.writePage([b'OpusTags' + struct.pack('<I', len(self.VENDOR)) + self.VENDOR + struct.pack('<I', 0)], 0)
+
+    def writePage(self, packets, granule, flags=0):
+        lacing = b''
+        for packet in packets:
+            lacing += b'\xff' * (len(packet) // 255) + bytes([len(packet) % 255])
+        header = struct.pack('<4sBBqIIIB', b'OggS', 0, flags, granule, self.serial, self.sequence, 0, len(lacing)) + lacing
+        page = header + b''.join(packets)
+        page = page[:22] + struct.pack('<I', oggCrc(page)) + page[26:]
+        self.file.write(page)
+        self.sequence += 1
+
+    def write(self, samples):
+        self.buffer = numpy.concatenate((self.buffer, samples.reshape(-1, self.channels)))
+        while(len(self.buffer) >= self.frameSamples):
+            self.encodeFrame(self.buffer[:self.frameSamples])
+            self.buffer = self.buffer[self.frameSamples:]
+
+    def encodeFrame(self, frame):
+        self.packets.append(self.encoder.encode(frame.tobytes(), self.frameSamples))
+        self.granule += self.frameSamples * 48000 // RATE
+        # a page holds at most 255 lacing values, 50 voice packets stay far below
+        if(len(self.packets) >= self.PACKETS_PER_PAGE):
+            self.writePage(self.packets, self.granule)
+            self.packets = []
+
+    def close(self):
+        if(len(self.buffer)):
+            padding = numpy.zeros((self.frameSamples - len(self.buffer), self.channels), dtype=numpy.int16)
+            self.encodeFrame(numpy.concatenate((self.buffer, padding)))
+        self.writePage(self.packets, self.granule, 0x04)
+        self.file.close()
+
+RECORDING_WRITERS = {
+    'wav': WaveWriter,
+    'opus': OggOpusWriter,
+}
+
+class CallRecorder(threading.Thread):
+    # Local and remote audio are either mixed (mono) or kept as separate channels (stereo, left: local, right: remote).
+    LOCAL = 0
+    REMOTE = 1
+    MAX_QUEUED_FRAMES = 500 # about 5 seconds of 20 ms frames of both directions
+    FLUSH_INTERVAL = 0.5 # seconds
+    MAX_LAG = 0.5 # seconds a direction may fall behind before its missing audio is written as silence
+
+    def __init__(self, path, format='wav', separateChannels=False, *args, **kwargs):
+        self.path = path
+        self.format = format
+        self.separateChannels = separateChannels
+        self.queue = queue.Queue(self.MAX_QUEUED_FRAMES)
+        self.channels = [RecordingChannel(), RecordingChannel()]
+        self.writer = None # the file is created when there is audio to write
+        self.startTime = time.monotonic()
+        self.stopFlag = False
+
+        # statistics
+        self.droppedFrames = 0
+        self.writtenSamples = 0
+
+        # call Thread constructor
+        super(CallRecorder, self).__init__(*args, **kwargs)
+        self.daemon = True
+
+    def send(self, data, rate):
+        self.put(self.LOCAL, data, rate)
+
+    def receive(self, data, rate):
+        self.put(self.REMOTE, data, rate)
+
+    def put(self, direction, data, rate):
+        # called from the media threads - must never block
+        try:
+            self.queue.put_nowait((direction, time.monotonic(), bytes(data), rate))
+        except queue.Full:
+            self.droppedFrames += 1
+
+    def run(self, *args, **kwargs):
+        lastFlush = time.monotonic()
+        try:
+            while(not (self.stopFlag and self.queue.empty())):
+                try:
+                    direction, arrival, data, rate = self.queue.get(timeout=0.1)
+                    position = int((arrival - self.startTime) * RATE)
+                    self.channels[direction].add(numpy.frombuffer(data, dtype=numpy.int16), rate, position)
+                except queue.Empty: pass
+                if(time.monotonic() - lastFlush >= self.FLUSH_INTERVAL):
+                    # write what both directions have delivered, a silent direction only delays the file by MAX_LAG
+                    liveHorizon = int((time.monotonic() - self.startTime - self.MAX_LAG) * RATE)
+                    self.flush(max(min(channel.end for channel in self.channels), liveHorizon))
+                    lastFlush = time.monotonic()
+            self.flush(max(channel.end for channel in self.channels))
+        except Exception:
+            traceback.print_exc()
+        if(self.writer != None):
+            self.writer.close()
+            print(f':: recorded {self.writtenSamples / RATE:.1f} s to {self.path} (dropped frames: {self.droppedFrames})')
+
+    def flush(self, position):
+        if(position <= self.channels[0].written): return
+        local, remote = (channel.take(position) for channel in self.channels)
+        if(self.separateChannels):
+            samples = numpy.stack((local, remote), axis=1)
+        else:
+            samples = numpy.clip(local.astype(numpy.int32) + remote, -32768, 32767).astype(numpy.int16)
+        if(self.writer == None):
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self.writer = RECORDING_WRITERS[self.format](self.path, 2 if self.separateChannels else 1)
+        self.writer.write(samples)
+        self.writtenSamples += len(local)
+
+    def stop(self):
+        # the remaining queued audio is still written
+        self.stopFlag = True
+
+def createCallRecorder(mediaSettings={}):
+    # returns a started CallRecorder if recording is enabled in the media settings, otherwise None
+    if(not mediaSettings.get('recording', False)): return None
+    format = mediaSettings.get('recording-format', 'wav')
+    if(format not in RECORDING_WRITERS):
+        print(f':: unknown recording format {format}, using wav')
+        format = 'wav'
+    if(format == 'opus' and loadLibrary('opuslib') == None):
+        print(f':: opus recording needs opuslib, using wav')
+        format = 'wav'
+    fileName = datetime.datetime.now().strftime('call-%Y%m%d-%H%M%S') + ('.opus' if format == 'opus' else '.wav')
+    recorder = CallRecorder(
+        os.path.join(os.path.expanduser(mediaSettings.get('recording-dir', RECORDINGS_DIR)), fileName),
+        format, mediaSettings.get('recording-channels', 'mixed') == 'separate'
+    )
+    recorder.start()
+    return recorder
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+from .Resampler import AdaptiveResampler
+
+
+class ClockDriftCompensator():
+    # The remote sender and the local sound card run on different clocks, so over a long call the
+    # playback buffer slowly fills up (growing latency) or runs dry (underruns). This controller watches
+    # the average buffer fill level and stretches or compresses the received audio by a tiny amount
+    # (PI controller on the fill level error), keeping the latency at the level the call started with.
+    SMOOTHING_SECONDS = 2.0 # time constant of the fill level average, hides network jitter
+    SETTLE_SECONDS = 5.0 # the target fill level is learned during the first seconds of the call
+    PROPORTIONAL = 0.05 # ratio correction per second of fill level error
+    INTEGRAL = 0.0005 # ratio correction per second of fill level error and second of time
+    MAX_CORRECTION = 0.005 # +/- 0.5 %, not audible in speech
+
+    def __init__(self):
+        self.resampler = AdaptiveResampler()
+        self.averageFill = None
+        self.targetFill = None
+        self.startTime = None
+        self.lastUpdate = None
+        self.integral = 0.0 # converges to the relative clock difference
+
+    def update(self, fillSeconds, now):
+        # to be called after every write into the playback buffer
+        if(self.lastUpdate == None):
+            self.startTime = self.lastUpdate = now
+            self.averageFill = fillSeconds
+            return
+        elapsed = now - self.lastUpdate
+        self.lastUpdate = now
+        self.averageFill += min(1.0, elapsed / self.SMOOTHING_SECONDS) * (fillSeconds - self.averageFill)
+        if(self.targetFill == None):
+            if(now - self.startTime >= self.SETTLE_SECONDS): self.targetFill = self.averageFill
+            return
+
+        error = self.averageFill - self.targetFill
+        self.integral = max(-self.MAX_CORRECTION, min(self.MAX_CORRECTION, self.integral + self.INTEGRAL * error * elapsed))
+        correction = max(-self.MAX_CORRECTION, min(self.MAX_CORRECTION, self.PROPORTIONAL * error + self.integral))
+        # buffer above target: consume input faster than real time
+        self.resampler.ratio = 1.0 + correction
+
+    def driftPpm(self):
+        # estimated clock difference, positive if the remote clock is faster than the sound card
+        return self.integral * 1_000_000
+
+    def process(self, data):
+        # bytes in, bytes out (16 bit native endian mono PCM at sound card rate)
+        return self.resampler.process(data)
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+# Codec registry shared by the send and receive path.
+# Each codec object holds its own (stateful) encoder/decoder and describes itself with
+# sample rate, RTP clock rate and frame size, so media code never has to branch on codec names.
+
+import importlib
+
+from . import G711
+from . import G722
+
+
+# external codec libraries, imported on first use so that the media code also runs without them
+# (e.g. headless in Loopback); codecs whose library is missing are neither offered nor decoded
+LIBRARIES = {}
+
+def loadLibrary(name):
+    if(name not in LIBRARIES):
+        try:
+            LIBRARIES[name] = importlib.import_module(name)
+        except Exception as e: # opuslib raises on import if libopus is missing
+            print(f':: codec library {name} not available: {e}')
+            LIBRARIES[name] = None
+    return LIBRARIES[name]
+
+
+class Codec():
+    # subclasses implement encode(pcm) -> payload and decode(payload) -> pcm
+    name = None
+    sampleRate = 8000 # rate of the PCM audio the codec consumes/produces
+    clockRate = 8000 # RTP timestamp clock rate as announced in SDP
+    packetTime = 20 # milliseconds of audio per RTP packet (SDP ptime)
+    PACKET_TIMES = (10, 20, 30, 40, 60) # supported packet times for sending
+    supportsFec = False # decodeFec() can reconstruct a lost frame from the following packet
+    suppressesSilence = False # encoder has its own silence suppression (encode() returns None for suppressed frames)
+    LIBRARY = None # Python module of the external codec library, if any
+
+    @classmethod
+    def available(cls):
+        return cls.LIBRARY == None or loadLibrary(cls.LIBRARY) != None
+
+    def __init__(self, payloadType, clockRate=None, parameters=None, settings=None):
+        self.payloadType = payloadType
+        if(clockRate): self.clockRate = clockRate
+        self.parameters = parameters or {} # fmtp parameters of the remote party, e.g. {'useinbandfec': '1'}
+        self.settings = settings or {} # media settings from settings.json
+
+    @property
+    def frameDuration(self):
+        return self.packetTime / 1000
+
+    @property
+    def frameSamples(self):
+        return self.sampleRate * self.packetTime // 1000
+
+    def setPacketTime(self, packetTime, maxPacketTime=None):
+        # use the largest supported packet time which does not exceed the requested ptime and maxptime
+        if(maxPacketTime): packetTime = min(packetTime, maxPacketTime)
+        candidates = [t for t in self.PACKET_TIMES if t <= packetTime]
+        self.packetTime = max(candidates) if candidates else min(self.PACKET_TIMES)
+
+class PcmuCodec(Codec):
+    name = 'pcmu'
+
+    def encode(self, pcm):
+        return G711.ulawEncode(pcm)
+
+    def decode(self, payload):
+        return G711.ulawDecode(payload)
+
+class PcmaCodec(Codec):
+    name = 'pcma'
+
+    def encode(self, pcm):
+        return G711.alawEncode(pcm)
+
+    def decode(self, payload):
+        return G711.alawDecode(payload)
+
+class G722Codec(Codec):
+    name = 'g722'
+    sampleRate = 16000
+    clockRate = 8000 # wrong in RFC 1890 for historical reasons, kept by RFC 3551
+
+    def __init__(self, *args, **kwargs):
+        super(G722Codec, self).__init__(*args, **kwargs)
+        self.encoder = None
+        self.decoder = None
+
+    @classmethod
+    def available(cls):
+        # needs the spandsp C library
+        return G722.available()
+
+    def encode(self, pcm):
+        if(self.encoder == None): self.encoder = G722.G722Encoder()
+        return self.encoder.encode(pcm)
+
+    def decode(self, payload):
+        if(self.decoder == None): self.decoder = G722.G722Decoder()
+        return self.decoder.decode(payload)
+
+class G729Codec(Codec):
+    name = 'g729'
+    LIBRARY = 'g729lib'
+
+    def __init__(self, *args, **kwargs):
+        super(G729Codec, self).__init__(*args, **kwargs)
+        self.encoder = None
+        self.decoder = None
+        # Annex B (VAD/DTX with SID frames) is on by default according to RFC 4856, but we only use it if configured
+        self.suppressesSilence = bool(self.settings.get('g729-annexb', False)) and self.parameters.get('annexb', 'yes') != 'no'
+
+    def encode(self, pcm):
+        if(self.encoder == None): self.encoder = loadLibrary(self.LIBRARY).Encoder(1 if self.suppressesSilence else 0)
+        payload = self.encoder.encode(pcm)
+        # with Annex B, the encoder returns 2 byte SID frames or nothing at all during silence
+        if(len(payload) == 0): return None
+        return payload
+
+    def decode(self, payload):
+        if(self.decoder == None): self.decoder = loadLibrary(self.LIBRARY).Decoder()
+        return self.decoder.decode(bytes(payload)) # ctypes wrappers need a bytes object
+
+class OpusCodec(Codec):
+    name = 'opus'
+    sampleRate = 48000
+    clockRate = 48000 # always 48000 according to RFC 7587, regardless of the actual audio bandwidth
+    supportsFec = True
+    LIBRARY = 'opuslib'
+
+    # maxplaybackrate fmtp parameter -> OPUS_BANDWIDTH_* constant
+    BANDWIDTHS = [(8000, 1101), (12000, 1102), (16000, 1103), (24000, 1104)]
+    BANDWIDTH_FULLBAND = 1105
+    PACKET_TIMES = (10, 20, 40, 60) # Opus frame sizes, 30 ms is not possible with a single frame
+    MAX_FRAME_SAMPLES = 5760 # 120 ms at 48 kHz, the largest packet a decoder may receive
+    DEFAULT_PACKET_LOSS = 10 # expected loss in percent if FEC is enabled without explicit setting
+
+    def __init__(self, *args, **kwargs):
+        super(OpusCodec, self).__init__(*args, **kwargs)
+        self.sampleRate = self.clockRate
+        self.encoder = None
+        self.decoder = None
+        self.lastDecodedSamples = self.frameSamples
+
+        # settings override the remote preferences, except for the bitrate limit
+        self.fec = bool(self.settings.get('opus-fec', True)) and self.parameters.get('useinbandfec') == '1'
+        self.dtx = bool(self.settings.get('opus-dtx', self.parameters.get('usedtx') == '1'))
+        self.suppressesSilence = self.dtx
+        self.bitrate = self.settings.get('opus-bitrate')
+        if(self.parameters.get('maxaveragebitrate', '').isdigit()):
+            self.bitrate = min(self.bitrate or 510000, int(self.parameters['maxaveragebitrate']))
+        self.complexity = self.settings.get('opus-complexity')
+        self.packetLoss = self.settings.get('opus-packet-loss', self.DEFAULT_PACKET_LOSS if self.fec else 0)
+        self.maxBandwidth = self.BANDWIDTH_FULLBAND
+        if(self.parameters.get('maxplaybackrate', '').isdigit()):
+            for playbackRate, bandwidth in self.BANDWIDTHS:
+                if(int(self.parameters['maxplaybackrate']) <= playbackRate):
+                    self.maxBandwidth = bandwidth
+                    break
+
+    def createEncoder(self):
+        import opuslib.api.ctl
+        import opuslib.api.encoder
+        encoder = opuslib.Encoder(self.sampleRate, 1, 'voip')
+        if(self.bitrate): encoder.bitrate = int(self.bitrate)
+        if(self.complexity != None): encoder.complexity = int(self.complexity)
+        if(self.parameters.get('cbr') == '1'): encoder.vbr = 0
+        encoder.max_bandwidth = self.maxBandwidth
+        encoder.inband_fec = 1 if self.fec else 0
+        encoder.packet_loss_perc = int(self.packetLoss)
+        if(self.dtx):
+            opuslib.api.encoder.encoder_ctl(encoder.encoder_state, opuslib.api.ctl.set_dtx, 1)
+        return encoder
+
+    def encode(self, pcm):
+        if(self.encoder == None): self.encoder = self.createEncoder()
+        payload = self.encoder.encode(pcm, self.frameSamples)
+        # with DTX, the encoder emits 1-2 byte frames during silence which should not be transmitted (RFC 7587 section 3.1.3)
+        if(self.dtx and len(payload) <= 2): return None
+        return payload
+
+    def decode(self, payload):
+        # the remote party may use any packet time, so always provide space for the largest possible packet
+        if(self.decoder == None): self.decoder = loadLibrary(self.LIBRARY).Decoder(self.sampleRate, 1)
+        pcm = self.decoder.decode(bytes(payload), self.MAX_FRAME_SAMPLES * self.sampleRate // 48000) # ctypes wrappers need a bytes object
+        self.lastDecodedSamples = len(pcm) // 2
+        return pcm
+
+    def decodeFec(self, payload):
+        # reconstruct the previous (lost) frame from the in-band FEC data of this packet,
+        # the frame size must match exactly, so assume the lost packet was as long as the last one
+        if(self.decoder == None): self.decoder = loadLibrary(self.LIBRARY).Decoder(self.sampleRate, 1)
+        return self.decoder.decode(bytes(payload), self.lastDecodedSamples, decode_fec=True)
+
+# rtpmap encoding name (lower case) -> codec class
+CODECS = {
+    'pcmu': PcmuCodec,
+    'pcma': PcmaCodec,
+    'g722': G722Codec,
+    'g729': G729Codec,
+    'opus': OpusCodec,
+}
+
+# static payload types (RFC 3551) which may be used without rtpmap attribute
+STATIC_PAYLOAD_TYPES = {
+    0: 'PCMU/8000',
+    8: 'PCMA/8000',
+    18: 'G729/8000',
+}
+
+# static payload types which are only decoded if the codec is enabled in the media settings
+OPTIONAL_STATIC_PAYLOAD_TYPES = {
+    9: ('G722/8000', 'g722'),
+}
+
+def findPayloadType(ptMap, name, clockRate=8000):
+    # find the (dynamic or static) payload type number of a non-audio format like 'CN' or 'telephone-event'
+    for payloadTypeNumber, payloadTypeDescription in ptMap.items():
+        if(payloadTypeDescription.lower().split('/')[:2] == [name.lower(), str(clockRate)]):
+            return int(payloadTypeNumber)
+    return None
+
+def codecAvailable(name):
+    return CODECS[name].available()
+
+def createCodecs(ptMap, fmtpMap={}, settings={}):
+    # build a payload type -> codec object dict from an SDP payload type map like {114: 'opus/48000/2'}
+    # and the fmtp parameters like {114: {'useinbandfec': '1'}}
+    # unknown encodings (e.g. telephone-event) are not included, so their packets are simply skipped
+    codecs = {}
+    staticPayloadTypes = dict(STATIC_PAYLOAD_TYPES)
+    for payloadTypeNumber, (payloadTypeDescription, setting) in OPTIONAL_STATIC_PAYLOAD_TYPES.items():
+        if(settings.get(setting, False)): staticPayloadTypes[payloadTypeNumber] = payloadTypeDescription
+    for payloadTypeNumber, payloadTypeDescription in {**staticPayloadTypes, **ptMap}.items():
+        splitter = payloadTypeDescription.lower().split('/')
+        if(len(splitter) < 2 or splitter[0] not in CODECS or not CODECS[splitter[0]].available()): continue
+        try:
+            clockRate = int(splitter[1])
+        except ValueError: continue
+        if(clockRate < 8000): continue
+        codecs[int(payloadTypeNumber)] = CODECS[splitter[0]](
+            int(payloadTypeNumber), clockRate, fmtpMap.get(int(payloadTypeNumber)), settings
+        )
+    return codecs
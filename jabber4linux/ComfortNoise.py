@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+# Voice activity detection and RFC 3389 comfort noise.
+# During silence, the sender only transmits a small CN packet with the background noise level now and then,
+# and the receiver plays generated noise of that level, so that the line does not sound dead.
+
+import math
+import numpy
+
+
+# RFC 3389: the first payload byte is the noise level in -dBov (0..127), spectral coefficients are optional
+def compileComfortNoisePayload(level):
+    return bytes([max(0, min(127, int(round(-level))))])
+
+def parseComfortNoisePayload(payload):
+    if(len(payload) < 1): return None
+    return -(payload[0] & 0x7f)
+
+class VoiceActivityDetector():
+    # Energy based VAD with adaptive noise floor and hangover, working on 16 bit PCM frames
+    THRESHOLD = 9.0 # dB above noise floor which counts as speech
+    MIN_SPEECH_LEVEL = -55.0 # dBov, quieter frames are always silence
+    NOISE_FLOOR_RISE = 0.05 # dB per frame, the floor follows rising background noise slowly
+    HANGOVER_SECONDS = 0.2 # keep sending audio after speech ends, so that word endings are not cut
+    CN_REFRESH_SECONDS = 1.0 # resend the comfort noise level during long silence periods
+    CN_LEVEL_CHANGE = 3.0 # dB, resend the comfort noise level immediately on larger changes
+
+    def __init__(self, frameDuration=0.02):
+        self.hangoverFrames = max(1, int(self.HANGOVER_SECONDS / frameDuration))
+        self.refreshFrames = max(1, int(self.CN_REFRESH_SECONDS / frameDuration))
+        self.noiseFloor = -70.0
+        self.level = -127.0
+        self.hangover = 0
+        self.silentFrames = 0
+        self.sentNoiseLevel = None
+
+        # statistics
+        self.speechFrames = 0
+        self.suppressedFrames = 0
+
+    def process(self, data):
+        # returns True if the frame should be transmitted as audio
+        samples = numpy.frombuffer(data, dtype=numpy.int16).astype(numpy.float32)
+        energy = float(numpy.dot(samples, samples)) / max(1, len(samples))
+        self.level = 10 * math.log10(energy / (32768.0 * 32768.0)) if energy > 0 else -127.0
+
+        if(self.level < self.noiseFloor):
+            self.noiseFloor = self.level
+        else:
+            self.noiseFloor += self.NOISE_FLOOR_RISE
+
+        if(self.level > max(self.noiseFloor + self.THRESHOLD, self.MIN_SPEECH_LEVEL)):
+            self.hangover = self.hangoverFrames
+        elif(self.hangover > 0):
+            self.hangover -= 1
+
+        if(self.hangover > 0):
+            self.silentFrames = 0
+            self.sentNoiseLevel = None
+            self.speechFrames += 1
+            return True
+        self.silentFrames += 1
+        self.suppressedFrames += 1
+        return False
+
+    def comfortNoiseDue(self):
+        # True if a CN packet should be sent for the current silent frame
+        if(self.sentNoiseLevel == None
+        or abs(self.noiseFloor - self.sentNoiseLevel) >= self.CN_LEVEL_CHANGE
+        or self.silentFrames % self.refreshFrames == 0):
+            self.sentNoiseLevel = self.noiseFloor
+            return True
+        return False
+
+    def comfortNoisePayload(self):
+        return compileComfortNoisePayload(self.noiseFloor)
+
+class ComfortNoiseGenerator():
+    # White noise of the level announced by the remote party, generated from a precomputed
+    # unit noise table so that it is cheap enough for the PortAudio callback
+    TABLE_SECONDS = 1
+
+    def __init__(self, sampleRate):
+        self.table = numpy.random.default_rng().standard_normal(sampleRate * self.TABLE_SECONDS).astype(numpy.float32)
+        self.offset = 0
+        self.amplitude = 0.0
+        self.active = False
+
+    def setLevel(self, level):
+        # level in dBov as received in a CN packet
+        self.amplitude = 32768.0 * 10 ** (level / 20)
+        self.active = True
+
+    def generate(self, size):
+        # returns `size` bytes of 16 bit noise
+        count = size // 2
+        if(self.offset + count > len(self.table)): self.offset = 0
+        samples = self.table[self.offset:self.offset+count] * self.amplitude
+        self.offset += count
+        return numpy.clip(samples, -32768, 32767).astype(numpy.int16).tobytes()
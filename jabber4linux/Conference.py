@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+# Local three-way conference. The ConferenceMixer owns the sound card and mixes the microphone with the
+# decoded audio of all participants. Every participant is a ConferenceLeg, a virtual audio backend on which
+# the usual InputAudioSocket/OutputAudioSocket of that call run (RTP, codecs, jitter handling, RTCP), so
+# their stream callbacks are driven by the mixer thread, i.e. by the sound card clock. The loudspeaker plays
+# all participants, every participant gets the microphone and all other participants (mix-minus).
+
+import threading
+import traceback
+import numpy
+
+from .RingBuffer import RingBuffer
+from .Resampler import Resampler
+from .AudioBackend import AudioBackend, paInt16, paContinue, paInputOverflow
+from .AudioSocket import findHostApi, findAudioDevice, chooseSampleRate, streamBufferSettings
+from .Scheduling import applyThreadScheduling
+
+
+class ConferenceStream():
+    # stream opened by an audio socket on a ConferenceLeg, the callback is called by the mixer thread
+    def __init__(self, leg, rate, channels=1, format=paInt16, frames_per_buffer=None,
+        input=False, output=False, input_device_index=None, output_device_index=None,
+        stream_callback=None, start=True, suggested_latency=None):
+        if(stream_callback == None): raise ValueError('Conference streams only support callback mode')
+        self.leg = leg
+        self.rate = rate
+        self.isInput = input
+        self.callback = stream_callback
+        self.active = start
+        self.closed = False
+
+    def start_stream(self):
+        self.active = not self.closed
+
+    def stop_stream(self):
+        self.active = False
+
+    def close(self):
+        self.active = False
+        self.closed = True
+        self.leg.detach(self)
+
+    def is_active(self):
+        return self.active
+
+    def get_input_latency(self):
+        return self.leg.mixer.FRAME_DURATION if self.isInput else 0.0
+
+    def get_output_latency(self):
+        return 0.0 if self.isInput else self.leg.mixer.FRAME_DURATION
+
+class ConferenceLeg(AudioBackend):
+    # one participant: the InputAudioSocket plays the participant's audio into the mixer,
+    # the OutputAudioSocket captures the participant's mix-minus from the mixer
+    name = 'Conference'
+
+    def __init__(self, mixer):
+        self.mixer = mixer
+        self.defaultSampleRate = mixer.RATE
+        self.devices = [{'name': 'Conference', 'maxInputChannels': 1, 'maxOutputChannels': 1}]
+        self.playbackStream = None
+        self.captureStream = None
+
+    def is_format_supported(self, rate, input_device=None, input_channels=None, input_format=None,
+        output_device=None, output_channels=None, output_format=None):
+        # the sockets resample to the mixer rate
+        if(rate != self.mixer.RATE): raise ValueError('Invalid sample rate')
+        return True
+
+    def open(self, *args, **kwargs):
+        stream = ConferenceStream(self, *args, **kwargs)
+        if(stream.isInput): self.captureStream = stream
+        else: self.playbackStream = stream
+        return stream
+
+    def detach(self, stream):
+        if(self.captureStream is stream): self.captureStream = None
+        if(self.playbackStream is stream): self.playbackStream = None
+
+    def pull(self, frameCount):
+        # decoded audio of the participant, None before the first packet
+        stream = self.playbackStream
+        if(stream == None or not stream.active): return None
+        data, flag = stream.callback(None, frameCount, {}, 0)
+        return data
+
+    def push(self, data, frameCount):
+        stream = self.captureStream
+        if(stream != None and stream.active): stream.callback(data, frameCount, {}, 0)
+
+class ConferenceMixer(threading.Thread):
+    RATE = 16000 # wideband, covers G.711 and G.722 participants completely
+    FRAME_DURATION = 0.02 # seconds
+    SAMPLE_WIDTH = 2 # 16 bit
+    BUFFER_SECONDS = 0.5
+    MAX_BACKLOG_SECONDS = 0.1 # older captured audio is dropped if the mixer falls behind, to keep the latency low
+    RELEASE = 0.1 # fraction by which a limiter gain recovers towards 1 per frame
+
+    def __init__(self, audio, inputDeviceName=None, outputDeviceName=None, mediaSettings={}, *args, **kwargs):
+        self.audio = audio
+        self.inputDeviceName = inputDeviceName
+        self.outputDeviceName = outputDeviceName
+        self.mediaSettings = mediaSettings
+        self.frameSamples = int(self.RATE * self.FRAME_DURATION)
+        self.legs = []
+        self.legsLock = threading.Lock()
+        self.captureStream = None
+        self.playbackStream = None
+        self.captureResampler = None
+        self.playbackResampler = None
+        self.gains = numpy.ones(1) # limiter gain of every output at the end of the previous frame
+        self.ramp = numpy.arange(1, self.frameSamples + 1) / self.frameSamples
+        self.schedulingReport = None
+        self.stopFlag = False
+
+        # statistics
+        self.inputOverflows = 0
+        self.droppedFrames = 0
+        self.mixedFrames = 0
+        self.limitedFrames = 0 # output frames which had to be attenuated to avoid clipping
+
+        # call Thread constructor
+        super(ConferenceMixer, self).__init__(*args, **kwargs)
+        self.daemon = True
+
+    def openAudioStreams(self):
+        # called after the sockets of the first call were moved onto a leg, so that the sound card is free again
+        hostApi = findHostApi(self.audio, self.mediaSettings.get('host-api'))
+        deviceIndex, deviceSampleRate = findAudioDevice(self.audio, self.inputDeviceName, True, hostApi)
+        self.captureRate = chooseSampleRate(self.audio, deviceIndex, [self.RATE, deviceSampleRate], True)
+        self.captureChunk = int(self.frameSamples * self.captureRate / self.RATE)
+        if(self.captureRate != self.RATE):
+            self.captureResampler = Resampler(self.captureRate, self.RATE)
+        framesPerBuffer, latency = streamBufferSettings(self.mediaSettings, 'capture', self.captureRate, self.captureChunk)
+        self.captureBuffer = RingBuffer(int(self.captureRate * self.SAMPLE_WIDTH * self.BUFFER_SECONDS))
+        self.maxBacklog = max(2 * max(self.captureChunk, framesPerBuffer) * self.SAMPLE_WIDTH, int(self.captureRate * self.SAMPLE_WIDTH * self.MAX_BACKLOG_SECONDS))
+        self.captureStream = self.audio.open(
+            format=paInt16,
+            channels=1,
+            rate=self.captureRate,
+            frames_per_buffer=framesPerBuffer,
+            suggested_latency=latency,
+            input=True,
+            input_device_index=deviceIndex,
+            stream_callback=self.captureCallback)
+
+        deviceIndex, deviceSampleRate = findAudioDevice(self.audio, self.outputDeviceName, False, hostApi)
+        self.playbackRate = chooseSampleRate(self.audio, deviceIndex, [self.RATE, deviceSampleRate], False)
+        if(self.playbackRate != self.RATE):
+            self.playbackResampler = Resampler(self.RATE, self.playbackRate)
+        framesPerBuffer, latency = streamBufferSettings(self.mediaSettings, 'playback', self.playbackRate, int(self.frameSamples * self.playbackRate / self.RATE))
+        self.playbackBuffer = RingBuffer(int(self.playbackRate * self.SAMPLE_WIDTH * self.BUFFER_SECONDS))
+        self.playbackStream = self.audio.open(
+            format=paInt16,
+            channels=1,
+            rate=self.playbackRate,
+            frames_per_buffer=framesPerBuffer,
+            suggested_latency=latency,
+            output=True,
+            output_device_index=deviceIndex,
+            stream_callback=self.playbackCallback)
+        print(f':: conference mixer capturing with {self.captureRate} Hz, playing with {self.playbackRate} Hz')
+
+    def addLeg(self):
+        leg = ConferenceLeg(self)
+        with self.legsLock:
+            self.legs.append(leg)
+        return leg
+
+    def removeLeg(self, leg):
+        with self.legsLock:
+            if(leg in self.legs): self.legs.remove(leg)
+
+    def captureCallback(self, inData, frameCount, timeInfo, status):
+        # called from the PortAudio thread - must never block
+        if(status & paInputOverflow): self.inputOverflows += 1
+        self.captureBuffer.write(inData)
+        return (None, paContinue)
+
+    def playbackCallback(self, inData, frameCount, timeInfo, status):
+        # called from the PortAudio thread - must never block
+        return (self.playbackBuffer.read(frameCount * self.SAMPLE_WIDTH), paContinue)
+
+    def run(self, *args, **kwargs):
+        self.schedulingReport = applyThreadScheduling(self.mediaSettings)
+        print(f':: conference mixer thread scheduling: {self.schedulingReport}')
+        try:
+            # one frame per captured microphone frame, so the mixer runs with the sound card clock
+            chunkBytes = self.captureChunk * self.SAMPLE_WIDTH
+            while(not self.stopFlag):
+                if(not self.captureBuffer.wait(chunkBytes, 0.5)): continue
+                while(self.captureBuffer.available() > self.maxBacklog):
+                    self.captureBuffer.discard(chunkBytes)
+                    self.droppedFrames += 1
+                microphone = self.captureBuffer.read(chunkBytes)
+                if(self.captureResampler != None):
+                    microphone = self.captureResampler.process(microphone)
+
+                with self.legsLock:
+                    legs = list(self.legs)
+                outputs = self.mix(microphone, [leg.pull(self.frameSamples) for leg in legs])
+
+                speaker = outputs[0].tobytes()
+                if(self.playbackResampler != None):
+                    speaker = self.playbackResampler.process(speaker)
+                self.playbackBuffer.write(speaker)
+                for leg, output in zip(legs, outputs[1:]):
+                    leg.push(output.tobytes(), self.frameSamples)
+                self.mixedFrames += 1
+        except Exception:
+            traceback.print_exc()
+
+        for stream in (self.captureStream, self.playbackStream):
+            if(stream == None): continue
+            stream.stop_stream()
+            stream.close()
+        print(f':: stopped conference mixer (mixed frames: {self.mixedFrames}, limited frames: {self.limitedFrames}, '
+            + f'input overflows: {self.inputOverflows}, dropped frames: {self.droppedFrames})')
+
+    def mix(self, microphone, legAudio):
+        # row 0 is the microphone, row i the participant of leg i; every output is the sum of all rows
+        # except its own, so output 0 is the loudspeaker and output i the mix-minus for participant i
+        frames = numpy.zeros((1 + len(legAudio), self.frameSamples), dtype=numpy.int32)
+        samples = numpy.frombuffer(microphone, dtype=numpy.int16)[:self.frameSamples]
+        frames[0, :len(samples)] = samples
+        for i, data in enumerate(legAudio):
+            if(data == None): continue
+            samples = numpy.frombuffer(data, dtype=numpy.int16)[:self.frameSamples]
+            frames[i + 1, :len(samples)] = samples
+        return self.limit(frames.sum(axis=0) - frames)
+
+    def limit(self, outputs):
+        # clipping protection: an output whose peak would exceed 16 bit is attenuated immediately, the gain
+        # recovers slowly afterwards; the gain is ramped over the frame so that there are no steps
+        peaks = numpy.abs(outputs).max(axis=1)
+        targets = numpy.minimum(1.0, 32767 / numpy.maximum(peaks, 1))
+        if(len(self.gains) != len(targets)):
+            self.gains = numpy.ones(len(targets))
+        gains = numpy.where(targets < self.gains, targets, self.gains + (targets - self.gains) * self.RELEASE)
+        curves = self.gains[:, None] + (gains - self.gains)[:, None] * self.ramp
+        self.limitedFrames += int(numpy.count_nonzero(gains < 1.0))
+        self.gains = gains
+        # samples at the start of the ramp may still exceed the range while the gain is falling
+        return numpy.clip(numpy.rint(outputs * curves), -32768, 32767).astype(numpy.int16)
+
+    def stop(self):
+        self.stopFlag = True
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+# Audio processing stages for the send and receive path.
+# Each stage works on one frame as NumPy int16 array; the pipeline measures the time spent in every
+# stage so that new processing can be checked against the frame budget (e.g. 20 ms).
+
+import math
+import time
+import numpy
+
+
+def frameLevel(samples):
+    # RMS level of a 16 bit frame in dBov
+    if(len(samples) == 0): return -127.0
+    floatSamples = samples.astype(numpy.float32)
+    energy = float(numpy.dot(floatSamples, floatSamples)) / len(samples)
+    return 10 * math.log10(energy / (32768.0 * 32768.0)) if energy > 0 else -127.0
+
+def applyGainRamp(samples, startFactor, endFactor):
+    # change the gain linearly over the frame, a sudden jump would be audible as click
+    if(startFactor == 1.0 and endFactor == 1.0): return samples
+    ramp = numpy.linspace(startFactor, endFactor, len(samples), dtype=numpy.float32)
+    return numpy.clip(numpy.rint(samples * ramp), -32768, 32767).astype(numpy.int16)
+
+class DspStage():
+    name = None
+
+    def __init__(self):
+        # timing statistics, maintained by DspPipeline
+        self.calls = 0
+        self.totalTime = 0.0
+        self.maxTime = 0.0
+
+    def process(self, samples):
+        return samples
+
+class DspPipeline():
+    def __init__(self, stages=[]):
+        self.stages = list(stages)
+
+    def process(self, data):
+        # bytes in, bytes out (16 bit native endian mono PCM)
+        if(len(self.stages) == 0): return data
+        samples = numpy.frombuffer(data, dtype=numpy.int16)
+        for stage in self.stages:
+            start = time.perf_counter()
+            samples = stage.process(samples)
+            elapsed = time.perf_counter() - start
+            stage.calls += 1
+            stage.totalTime += elapsed
+            if(elapsed > stage.maxTime): stage.maxTime = elapsed
+        return samples.tobytes()
+
+    def report(self):
+        # per stage average and maximum processing time in microseconds
+        return ', '.join(
+            f'{stage.name} {stage.totalTime / max(1, stage.calls) * 1_000_000:.0f} us avg / {stage.maxTime * 1_000_000:.0f} us max'
+            for stage in self.stages
+        )
+
+class AutomaticGainControl(DspStage):
+    # Brings speech to a constant level, only frames which contain speech are used for adaptation
+    # so that background noise is not amplified during pauses. A peak limiter prevents clipping.
+    name = 'agc'
+    TARGET_LEVEL = -20.0 # dBov
+    SPEECH_LEVEL = -50.0 # dBov, quieter frames do not change the gain
+    MAX_GAIN = 12.0 # dB
+    MIN_GAIN = -12.0 # dB
+    ATTACK = 0.3 # fraction of the gain error corrected per frame if the gain has to decrease
+    RELEASE = 0.05 # fraction of the gain error corrected per frame if the gain has to increase
+
+    def __init__(self):
+        super(AutomaticGainControl, self).__init__()
+        self.gain = 0.0 # dB
+        self.factor = 1.0
+
+    def process(self, samples):
+        level = frameLevel(samples)
+        if(level > self.SPEECH_LEVEL):
+            desired = max(self.MIN_GAIN, min(self.MAX_GAIN, self.TARGET_LEVEL - level))
+            self.gain += (self.ATTACK if desired < self.gain else self.RELEASE) * (desired - self.gain)
+        factor = 10 ** (self.gain / 20)
+        peak = int(numpy.abs(samples.astype(numpy.int32)).max()) if len(samples) else 0
+        if(peak * factor > 32767): factor = 32767 / peak
+        output = applyGainRamp(samples, self.factor, factor)
+        self.factor = factor
+        return output
+
+class EchoSuppressor(DspStage):
+    # Simple echo suppression for loudspeaker use: while the remote party talks (and shortly after,
+    # for the echo tail), the microphone is attenuated unless the local user is clearly louder (double talk).
+    # The far end level is measured by the `farEnd` stage in the receive pipeline.
+    name = 'echo-suppression'
+    FAR_END_THRESHOLD = -45.0 # dBov, quieter far end audio does not cause audible echo
+    HANGOVER_SECONDS = 0.25 # echo tail after far end speech
+    DOUBLE_TALK_MARGIN = 6.0 # dB the near end must be above the far end level to pass unattenuated
+    ATTENUATION = -24.0 # dB
+
+    def __init__(self):
+        super(EchoSuppressor, self).__init__()
+        self.farEndLevel = -127.0
+        self.farEndActiveUntil = 0.0
+        self.factor = 1.0
+        self.attenuationFactor = 10 ** (self.ATTENUATION / 20)
+        self.suppressedFrames = 0
+        self.farEnd = FarEndMonitor(self)
+
+    def process(self, samples):
+        suppress = (time.monotonic() < self.farEndActiveUntil
+            and frameLevel(samples) < self.farEndLevel + self.DOUBLE_TALK_MARGIN)
+        factor = self.attenuationFactor if suppress else 1.0
+        if(suppress): self.suppressedFrames += 1
+        output = applyGainRamp(samples, self.factor, factor)
+        self.factor = factor
+        return output
+
+class FarEndMonitor(DspStage):
+    # receive path part of the EchoSuppressor, passes the audio through unchanged
+    name = 'far-end-monitor'
+
+    def __init__(self, suppressor):
+        super(FarEndMonitor, self).__init__()
+        self.suppressor = suppressor
+
+    def process(self, samples):
+        level = frameLevel(samples)
+        if(level > self.suppressor.FAR_END_THRESHOLD):
+            self.suppressor.farEndLevel = level
+            self.suppressor.farEndActiveUntil = time.monotonic() + self.suppressor.HANGOVER_SECONDS
+        return samples
+
+class LevelMeter(DspStage):
+    # passes the audio through unchanged, remembers the level of the last frame in dBov
+    name = 'level-meter'
+
+    def __init__(self):
+        super(LevelMeter, self).__init__()
+        self.level = -127.0
+
+    def process(self, samples):
+        self.level = frameLevel(samples)
+        return samples
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+# G.711 μ-law (PCMU) and A-law (PCMA) codec, bit-exact with the former audioop implementation
+# (audioop is removed in Python 3.13). All conversions are table lookups applied with NumPy.
+
+import numpy
+
+
+def _searchSegment(value, segmentEnds):
+    for i in range(len(segmentEnds)):
+        if(value <= segmentEnds[i]): return i
+    return len(segmentEnds)
+
+def _linear14ToUlaw(sample):
+    if(sample < 0):
+        sample = -sample
+        mask = 0x7F
+    else:
+        mask = 0xFF
+    sample = min(sample, 8159) + (0x84 >> 2)
+    segment = _searchSegment(sample, [0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF, 0x1FFF])
+    if(segment >= 8): return 0x7F ^ mask
+    return ((segment << 4) | ((sample >> (segment + 1)) & 0xF)) ^ mask
+
+def _linear13ToAlaw(sample):
+    if(sample >= 0):
+        mask = 0xD5
+    else:
+        mask = 0x55
+        sample = -sample - 1
+    segment = _searchSegment(sample, [0x1F, 0x3F, 0x7F, 0xFF, 0x1FF, 0x3FF, 0x7FF, 0xFFF])
+    if(segment >= 8): return 0x7F ^ mask
+    value = segment << 4
+    if(segment < 2): value |= (sample >> 1) & 0xF
+    else: value |= (sample >> segment) & 0xF
+    return value ^ mask
+
+def _ulawToLinear(code):
+    code = ~code & 0xFF
+    value = (((code & 0xF) << 3) + 0x84) << ((code & 0x70) >> 4)
+    return 0x84 - value if code & 0x80 else value - 0x84
+
+def _alawToLinear(code):
+    code ^= 0x55
+    value = (code & 0xF) << 4
+    segment = (code & 0x70) >> 4
+    if(segment == 0): value += 8
+    else: value = (value + 0x108) << (segment - 1)
+    return value if code & 0x80 else -value
+
+# 256 entry decode tables (code -> int16) and 65536 entry encode tables (int16 viewed as uint16 -> code)
+ULAW_DECODE = numpy.array([_ulawToLinear(c) for c in range(256)], dtype=numpy.int16)
+ALAW_DECODE = numpy.array([_alawToLinear(c) for c in range(256)], dtype=numpy.int16)
+_ALL_SAMPLES = numpy.arange(65536, dtype=numpy.uint16).view(numpy.int16)
+ULAW_ENCODE = numpy.array([_linear14ToUlaw(int(s) >> 2) for s in _ALL_SAMPLES], dtype=numpy.uint8)
+ALAW_ENCODE = numpy.array([_linear13ToAlaw(int(s) >> 3) for s in _ALL_SAMPLES], dtype=numpy.uint8)
+
+# bytes in, bytes out; same semantics as audioop.ulaw2lin(data, 2) etc.
+def ulawDecode(data):
+    return ULAW_DECODE[numpy.frombuffer(data, dtype=numpy.uint8)].tobytes()
+
+def alawDecode(data):
+    return ALAW_DECODE[numpy.frombuffer(data, dtype=numpy.uint8)].tobytes()
+
+def ulawEncode(data):
+    return ULAW_ENCODE[numpy.frombuffer(data, dtype=numpy.uint16)].tobytes()
+
+def alawEncode(data):
+    return ALAW_ENCODE[numpy.frombuffer(data, dtype=numpy.uint16)].tobytes()
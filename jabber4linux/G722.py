@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+# G.722 wideband codec (SB-ADPCM, 64 kbit/s mode) from the spandsp C library via ctypes, like Opus and
+# G.729 use libopus and bcg729 (Ubuntu/Debian package: libspandsp2). Every pair of 16 kHz input samples
+# becomes one byte. If spandsp is not installed, G.722 is neither offered nor decoded (see Codecs.py).
+# Note: the RTP clock rate of G.722 is 8000 although the audio is sampled at 16 kHz (RFC 3551).
+
+import ctypes
+import ctypes.util
+
+
+BIT_RATE = 64000
+OPTIONS = 0 # 16 kHz audio, one code word per byte (no G722_SAMPLE_RATE_8000, no G722_PACKED)
+
+_spandsp = None
+_spandspError = None # reason why spandsp could not be loaded, reported only once
+
+def loadSpandsp():
+    # returns the spandsp library, raises OSError if it is not installed
+    global _spandsp
+    if(_spandsp == None):
+        path = ctypes.util.find_library('spandsp')
+        if(path == None): raise OSError('spandsp library not found')
+        library = ctypes.CDLL(path)
+        library.g722_encode_init.restype = ctypes.c_void_p
+        library.g722_encode_init.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int]
+        library.g722_encode.restype = ctypes.c_int
+        library.g722_encode.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int]
+        library.g722_encode_free.argtypes = [ctypes.c_void_p]
+        library.g722_decode_init.restype = ctypes.c_void_p
+        library.g722_decode_init.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int]
+        library.g722_decode.restype = ctypes.c_int
+        library.g722_decode.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p, ctypes.c_int]
+        library.g722_decode_free.argtypes = [ctypes.c_void_p]
+        _spandsp = library
+    return _spandsp
+
+def available():
+    global _spandspError
+    if(_spandspError != None): return False
+    try:
+        loadSpandsp()
+        return True
+    except (OSError, AttributeError) as e: # AttributeError: spandsp version without G.722
+        _spandspError = e
+        print(f':: G.722 not available: {e}')
+        return False
+
+class G722Encoder():
+    def __init__(self):
+        self.spandsp = loadSpandsp()
+        self.state = self.spandsp.g722_encode_init(None, BIT_RATE, OPTIONS)
+        if(not self.state): raise MemoryError('g722_encode_init failed')
+
+    def encode(self, pcm):
+        # 16 bit PCM at 16 kHz -> G.722 payload
+        pcm = bytes(pcm) # ctypes needs a bytes object
+        samples = len(pcm) // 2
+        payload = ctypes.create_string_buffer(samples // 2)
+        length = self.spandsp.g722_encode(self.state, payload, pcm, samples)
+        return payload.raw[:length]
+
+    def __del__(self):
+        if(getattr(self, 'state', None)): self.spandsp.g722_encode_free(self.state)
+
+class G722Decoder():
+    def __init__(self):
+        self.spandsp = loadSpandsp()
+        self.state = self.spandsp.g722_decode_init(None, BIT_RATE, OPTIONS)
+        if(not self.state): raise MemoryError('g722_decode_init failed')
+
+    def decode(self, payload):
+        # G.722 payload -> 16 bit PCM at 16 kHz
+        payload = bytes(payload)
+        pcm = ctypes.create_string_buffer(len(payload) * 2 * 2)
+        samples = self.spandsp.g722_decode(self.state, pcm, payload, len(payload))
+        return pcm.raw[:samples * 2]
+
+    def __del__(self):
+        if(getattr(self, 'state', None)): self.spandsp.g722_decode_free(self.state)
@@ -7,8 +7,9 @@ from .__init__ import CFG_DIR, CFG_PATH, HISTORY_PATH, PHONEBOOK_PATH, CLIENT_CE
 from .CapfWrapper import CapfWrapper
 from .UdsWrapper import UdsWrapper
 from .SipHandler import SipHandler
-from .AudioSocket import AudioPlayer
-from .Tools import ignoreStderr, niceTime, getFiles
+from .AudioSocket import AudioPlayer, findHostApi
+from .AudioBackend import createAudioBackend
+from .Tools import niceTime, getFiles
 
 from cryptography.x509 import load_pem_x509_certificate
 from cryptography.hazmat.primitives import hashes
@@ -20,7 +21,6 @@ import watchdog.events
 import watchdog.observers
 import filelock
 import datetime
-import pyaudio
 import time
 import argparse
 import json
@@ -328,8 +328,9 @@ class OutgoingCallWindow(QtWidgets.QDialog):
         self.move(qr.topLeft())
 
 class CallWindow(QtWidgets.QDialog):
-    def __init__(self, remotePartyName, isOutgoingCall, *args, **kwargs):
+    def __init__(self, remotePartyName, isOutgoingCall, statistics=None, *args, **kwargs):
         self.isOutgoingCall = isOutgoingCall
+        self.statistics = statistics
         self.startTime = time.time()
         super(CallWindow, self).__init__(*args, **kwargs)
 
@@ -338,6 +339,7 @@ class CallWindow(QtWidgets.QDialog):
         self.buttonBox.button(QtWidgets.QDialogButtonBox.StandardButton.Cancel).setText(translate('Hang Up'))
         self.buttonBox.button(QtWidgets.QDialogButtonBox.StandardButton.Cancel).setObjectName('destructive')
         self.buttonBox.rejected.connect(self.cancelCall)
+        self.btnConference = self.buttonBox.addButton(translate('Add Participant'), QtWidgets.QDialogButtonBox.ButtonRole.ActionRole)
 
         self.layout = QtWidgets.QGridLayout(self)
 
@@ -348,7 +350,14 @@ class CallWindow(QtWidgets.QDialog):
         self.lblCallTimer = QtWidgets.QLabel(niceTime(0))
         self.layout.addWidget(self.lblCallTimer, 1, 0)
 
-        self.layout.addWidget(self.buttonBox, 2, 0)
+        self.lblCallQuality = QtWidgets.QLabel()
+        self.layout.addWidget(self.lblCallQuality, 2, 0)
+
+        self.lblConference = QtWidgets.QLabel()
+        self.lblConference.setVisible(False)
+        self.layout.addWidget(self.lblConference, 3, 0)
+
+        self.layout.addWidget(self.buttonBox, 4, 0)
         self.setLayout(self.layout)
 
         # window properties
@@ -380,10 +389,30 @@ class CallWindow(QtWidgets.QDialog):
 
     def refreshCallTimer(self):
         self.lblCallTimer.setText(niceTime(time.time() - self.startTime))
+        self.refreshCallQuality()
         self.callTimeInterval = Timer(1, self.refreshCallTimer)
         self.callTimeInterval.daemon = True
         self.callTimeInterval.start()
 
+    def refreshCallQuality(self):
+        if(self.statistics == None or self.statistics.packetsReceived == 0): return
+        mos = self.statistics.mos()
+        bars = int(round(mos))
+        color = '#239B2A' if mos >= 4 else ('#E0A000' if mos >= 3.1 else '#FF5C48')
+        self.lblCallQuality.setText(
+            translate('Quality')+': <span style="color:'+color+'">'+('●'*bars)+'</span>'+('○'*(5-bars))
+            +' (MOS {:.1f})'.format(mos)
+        )
+        rtt = self.statistics.roundTripTime
+        self.lblCallQuality.setToolTip(
+            translate('Packet loss')+': {:.1f} % ({} / {})'.format(self.statistics.lossPercent(), self.statistics.cumulativeLost(), self.statistics.packetsExpected())+"\n"
+            +translate('Late packets')+': {}'.format(self.statistics.latePackets)+"\n"
+            +translate('Jitter')+': {:.1f} ms'.format(self.statistics.jitterSeconds()*1000)+"\n"
+            +translate('Round trip time')+': '+('{:.0f} ms'.format(rtt*1000) if rtt != None else '-')+"\n"
+            +translate('Decode time')+': {:.0f} µs'.format(self.statistics.averageDecodeTime()*1_000_000)+"\n"
+            +'R-Factor: {:.0f}'.format(self.statistics.rFactor())
+        )
+
 class PhoneBookEntryWindow(QtWidgets.QDialog):
     def __init__(self, mainWindow, number=None, entry=None, *args, **kwargs):
         super(PhoneBookEntryWindow, self).__init__(*args, **kwargs)
@@ -679,6 +708,7 @@ class MainWindow(QtWidgets.QMainWindow):
     evtIncomingCall = QtCore.pyqtSignal(int)
     evtOutgoingCall = QtCore.pyqtSignal(int, str)
     evtCallClosed = QtCore.pyqtSignal()
+    evtConference = QtCore.pyqtSignal(int, str)
     evtIpcMessageReceived = QtCore.pyqtSignal(str)
     evtNetworkStateChanged = QtCore.pyqtSignal(int)
 
@@ -692,6 +722,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.outputDeviceName = settings.get('output-device', None)
         self.defaultRingtoneFile = os.path.dirname(os.path.realpath(__file__))+'/assets/ringelingeling.wav'
         self.ringtoneFile = settings.get('ringtone', self.defaultRingtoneFile)
+        self.mediaSettings = settings.get('media', {})
         super(MainWindow, self).__init__(*args, **kwargs)
         self.callHistory = loadCallHistory(True)
         self.phoneBook = loadPhoneBook(True)
@@ -807,6 +838,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.evtIncomingCall.connect(self.evtIncomingCallHandler)
         self.evtOutgoingCall.connect(self.evtOutgoingCallHandler)
         self.evtCallClosed.connect(self.evtCallClosedHandler)
+        self.evtConference.connect(self.evtConferenceHandler)
         self.evtIpcMessageReceived.connect(self.evtIpcMessageReceivedHandler)
         self.evtNetworkStateChanged.connect(self.evtNetworkStateChangedHandler)
         self.startNetworkMonitor()
@@ -863,20 +895,21 @@ class MainWindow(QtWidgets.QMainWindow):
         chooseRingtoneAction.triggered.connect(self.clickChooseRingtone)
         audioMenu.addAction(chooseRingtoneAction)
 
-        with ignoreStderr(): audio = pyaudio.PyAudio()
-        info = audio.get_host_api_info_by_index(0)
+        audio = createAudioBackend(self.mediaSettings)
+        hostApi = findHostApi(audio, self.mediaSettings.get('host-api'))
+        info = audio.get_host_api_info_by_index(hostApi)
         inputDevicesGroup = QtGui.QActionGroup(self)
         inputDevicesGroup.setExclusive(True)
         outputDevicesGroup = QtGui.QActionGroup(self)
         outputDevicesGroup.setExclusive(True)
         for i in range(0, info.get('deviceCount')):
-            deviceName = re.sub('[\\(\\[].*?[\\)\\]]', '', audio.get_device_info_by_host_api_device_index(0, i).get('name')).strip()
-            if(audio.get_device_info_by_host_api_device_index(0, i).get('maxInputChannels')) > 0:
+            deviceName = re.sub('[\\(\\[].*?[\\)\\]]', '', audio.get_device_info_by_host_api_device_index(hostApi, i).get('name')).strip()
+            if(audio.get_device_info_by_host_api_device_index(hostApi, i).get('maxInputChannels')) > 0:
                 inputDeviceAction = inputDevicesGroup.addAction(QtGui.QAction(deviceName, self, checkable=True))
                 if(deviceName == self.inputDeviceName): inputDeviceAction.setChecked(True)
                 inputDeviceAction.triggered.connect(partial(self.clickSetInput, deviceName, inputDeviceAction))
                 inputDevicesMenu.addAction(inputDeviceAction)
-            if(audio.get_device_info_by_host_api_device_index(0, i).get('maxOutputChannels')) > 0:
+            if(audio.get_device_info_by_host_api_device_index(hostApi, i).get('maxOutputChannels')) > 0:
                 outputDeviceAction = outputDevicesGroup.addAction(QtGui.QAction(deviceName, outputDevicesGroup, checkable=True))
                 if(deviceName == self.outputDeviceName): outputDeviceAction.setChecked(True)
                 outputDeviceAction.triggered.connect(partial(self.clickSetOutput, deviceName, outputDeviceAction))
@@ -943,6 +976,7 @@ class MainWindow(QtWidgets.QMainWindow):
             'ringtone-devices': self.ringtoneOutputDeviceNames,
             'output-device': self.outputDeviceName,
             'input-device': self.inputDeviceName,
+            'media': self.mediaSettings,
         })
         if(self.debug):
             QtCore.QCoreApplication.exit()
@@ -1265,11 +1299,14 @@ class MainWindow(QtWidgets.QMainWindow):
                 return
             self.sipHandler.inputDeviceName = self.inputDeviceName
             self.sipHandler.outputDeviceName = self.outputDeviceName
+            self.sipHandler.mediaSettings = self.mediaSettings
             self.sipHandler.evtRegistrationStatusChanged = self.evtRegistrationStatusChanged
             self.sipHandler.evtIncomingCall = self.evtIncomingCall
             self.sipHandler.evtOutgoingCall = self.evtOutgoingCall
             self.sipHandler.evtCallClosed = self.evtCallClosed
+            self.sipHandler.evtConference = self.evtConference
             self.sipHandler.start()
+            Thread(target=self.preloadRingtone, daemon=True).start()
             self.registerSipSession(force)
         except Exception as e:
             traceback.print_exc()
@@ -1367,8 +1404,9 @@ class MainWindow(QtWidgets.QMainWindow):
         elif(status == SipHandler.INCOMING_CALL_ACCEPTED):
             self.addCallToHistory(self.sipHandler.currentCall['headers']['From_parsed_text'], self.sipHandler.currentCall['headers']['From_parsed_number'], MainWindow.CALL_HISTORY_INCOMING, self.getSubjectText())
             self.closeIncomingCallWindow()
-            self.callWindow = CallWindow(self.getRemotePartyText('From_parsed_text'), False)
+            self.callWindow = CallWindow(self.getRemotePartyText('From_parsed_text'), False, self.getCallStatistics())
             self.callWindow.finished.connect(self.callWindowFinished)
+            self.callWindow.btnConference.clicked.connect(self.clickAddConferenceParticipant)
             self.callWindow.show()
 
         else:
@@ -1431,8 +1469,9 @@ class MainWindow(QtWidgets.QMainWindow):
 
         elif(status == SipHandler.OUTGOING_CALL_ACCEPTED):
             self.closeOutgoingCallWindow()
-            self.callWindow = CallWindow(self.getRemotePartyText('To_parsed_text'), True)
+            self.callWindow = CallWindow(self.getRemotePartyText('To_parsed_text'), True, self.getCallStatistics())
             self.callWindow.finished.connect(self.callWindowFinished)
+            self.callWindow.btnConference.clicked.connect(self.clickAddConferenceParticipant)
             self.callWindow.show()
 
         else:
@@ -1458,6 +1497,52 @@ class MainWindow(QtWidgets.QMainWindow):
     def evtCallClosedHandler(self):
         self.callWindow.close()
 
+    def clickAddConferenceParticipant(self, sender):
+        dialog = QtWidgets.QInputDialog(self.callWindow)
+        dialog.setWindowTitle(translate('Add Participant'))
+        dialog.setLabelText(translate('Please enter the number of the participant to add to this call.'))
+        dialog.setCancelButtonText(translate('Cancel'))
+        if(dialog.exec() != QtWidgets.QDialog.DialogCode.Accepted): return
+        number = dialog.textValue().strip()
+        if(number == ''): return
+        try:
+            self.sipHandler.addConferenceParticipant(number)
+        except Exception as e:
+            traceback.print_exc()
+            showErrorDialog(translate('Conference Failed'), str(e))
+
+    def evtConferenceHandler(self, status, text):
+        if(self.callWindow == None): return
+        if(status == SipHandler.CONFERENCE_TRYING or status == SipHandler.CONFERENCE_RINGING):
+            self.callWindow.btnConference.setEnabled(False)
+            self.callWindow.lblConference.setText(translate('Calling')+' '+text+' ...')
+            self.callWindow.lblConference.setVisible(True)
+            conferenceCall = self.sipHandler.conferenceCall
+            if(status == SipHandler.CONFERENCE_RINGING and conferenceCall != None and not conferenceCall['addedToHistory']):
+                conferenceCall['addedToHistory'] = True
+                self.addCallToHistory(conferenceCall['headers']['To_parsed_text'], conferenceCall['headers']['To_parsed_number'], MainWindow.CALL_HISTORY_OUTGOING, '')
+
+        elif(status == SipHandler.CONFERENCE_JOINED):
+            self.callWindow.lblConference.setText(translate('Conference with')+' '+text)
+
+        elif(status == SipHandler.CONFERENCE_CONTINUED):
+            # the first party hung up, the window now shows the call with the added participant
+            self.callWindow.lblRemotePartyName.setText(text)
+            self.callWindow.isOutgoingCall = True
+            self.callWindow.statistics = self.getCallStatistics()
+            self.callWindow.lblConference.setVisible(False)
+            self.callWindow.btnConference.setEnabled(True)
+
+        else:
+            self.callWindow.lblConference.setVisible(False)
+            self.callWindow.btnConference.setEnabled(True)
+            if(status == SipHandler.CONFERENCE_FAILED):
+                showErrorDialog(translate('Conference Failed'), str(text))
+
+    def getCallStatistics(self):
+        if(self.sipHandler.audioIn == None): return None
+        return self.sipHandler.audioIn.statistics
+
     def getRemotePartyText(self, headerField):
         remotePartyText = self.sipHandler.currentCall.get('headers',{}).get(headerField,'')
         if(remotePartyText and remotePartyText != self.sipHandler.currentCall['number']):
@@ -1490,18 +1575,29 @@ class MainWindow(QtWidgets.QMainWindow):
             if(entry.get('number','').strip().replace('+', '00') == number.strip().replace('+', '00')):
                 return entry
 
-    def startRingtone(self, number):
+    def getRingtoneFile(self, number=None):
         soundFilePath = self.defaultRingtoneFile
         if(os.path.isfile(self.ringtoneFile)):
             soundFilePath = self.ringtoneFile
         phoneBookEntry = self.getLocalPhoneBookEntry(number)
         if(phoneBookEntry and os.path.isfile(phoneBookEntry.get('ringtone',''))):
             soundFilePath = phoneBookEntry['ringtone']
+        return soundFilePath
 
+    def preloadRingtone(self):
+        # decode and resample the default ringtone in the background, so that the first call rings immediately
+        try:
+            audio = self.sipHandler.getAudio()
+            AudioPlayer.preload(self.getRingtoneFile(), audio, self.ringtoneOutputDeviceNames, findHostApi(audio, self.mediaSettings.get('host-api')))
+        except Exception:
+            traceback.print_exc()
+
+    def startRingtone(self, number):
         self.ringtonePlayer = AudioPlayer(
-            soundFilePath,
-            self.sipHandler.audio,
-            self.ringtoneOutputDeviceNames
+            self.getRingtoneFile(number),
+            self.sipHandler.getAudio(),
+            self.ringtoneOutputDeviceNames,
+            findHostApi(self.sipHandler.getAudio(), self.mediaSettings.get('host-api'))
         )
         self.ringtonePlayer.start()
 
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+# Headless media loopback test: an OutputAudioSocket sends a test signal through an impaired UDP relay
+# (delay, jitter, loss) on localhost to an InputAudioSocket. Both use NullAudio instead of a sound card,
+# so this runs on CI machines without audio hardware:
+# python3 -m jabber4linux.Loopback --codecs pcmu opus --delay 30 --jitter 20 --loss 2
+
+import contextlib
+import threading
+import socket
+import random
+import heapq
+import json
+import time
+import io
+import numpy
+
+from .AudioBackend import NullAudio
+from .AudioSocket import InputAudioSocket, OutputAudioSocket
+from .Codecs import codecAvailable
+
+
+CODEC_PAYLOAD_TYPES = {
+    'pcmu': (0, 'PCMU/8000'),
+    'pcma': (8, 'PCMA/8000'),
+    'g722': (9, 'G722/8000'),
+    'g729': (18, 'G729/8000'),
+    'opus': (114, 'opus/48000/2'),
+}
+
+class ImpairedRelay(threading.Thread):
+    # forwards UDP datagrams to `dstAddress` with a fixed delay, random jitter and random loss
+    # (jitter larger than the packet time also reorders packets, like on a real network)
+    def __init__(self, dstAddress, delay=0.0, jitter=0.0, loss=0.0, seed=None, *args, **kwargs):
+        self.dstAddress = dstAddress
+        self.delay = delay # seconds
+        self.jitter = jitter # seconds, uniformly distributed additional delay
+        self.loss = loss # fraction of dropped packets
+        self.random = random.Random(seed)
+        self.queue = [] # heap of (due time, counter, datagram)
+        self.counter = 0
+        self.condition = threading.Condition()
+        self.stopFlag = False
+
+        # statistics
+        self.forwarded = 0
+        self.dropped = 0
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(0.2)
+        self.sender = threading.Thread(target=self.sendLoop, daemon=True)
+
+        # call Thread constructor
+        super(ImpairedRelay, self).__init__(*args, **kwargs)
+        self.daemon = True
+
+    def getsockname(self):
+        return self.sock.getsockname()
+
+    def run(self, *args, **kwargs):
+        self.sender.start()
+        while(not self.stopFlag):
+            try:
+                datagram = self.sock.recv(2048)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            if(self.random.random() < self.loss):
+                self.dropped += 1
+                continue
+            due = time.monotonic() + self.delay + self.random.uniform(0, self.jitter)
+            with self.condition:
+                heapq.heappush(self.queue, (due, self.counter, datagram))
+                self.counter += 1
+                self.condition.notify()
+
+    def sendLoop(self):
+        while(not self.stopFlag):
+            with self.condition:
+                if(not self.queue):
+                    self.condition.wait(0.2)
+                    continue
+                due, _, datagram = self.queue[0]
+                delay = due - time.monotonic()
+                if(delay > 0):
+                    self.condition.wait(delay)
+                    continue
+                heapq.heappop(self.queue)
+            try:
+                self.sock.sendto(datagram, self.dstAddress)
+                self.forwarded += 1
+            except OSError: pass
+
+    def stop(self):
+        self.stopFlag = True
+        with self.condition:
+            self.condition.notify()
+
+class BurstSource():
+    # test signal for the sending side: 1 kHz tone bursts at a fixed interval,
+    # remembers the time at which every burst onset was "captured"
+    INTERVAL = 0.5 # seconds, the measurable latency is limited to this value
+    LENGTH = 0.04 # seconds
+    FREQUENCY = 1000
+    AMPLITUDE = 8000
+
+    def __init__(self):
+        self.position = 0 # samples
+        self.onsets = [] # monotonic time
+
+    def __call__(self, frameCount, rate):
+        now = time.monotonic()
+        n = numpy.arange(self.position, self.position + frameCount)
+        phase = n % int(rate * self.INTERVAL)
+        samples = numpy.where(phase < rate * self.LENGTH, numpy.sin(2 * numpy.pi * self.FREQUENCY * n / rate) * self.AMPLITUDE, 0)
+        # a sound card delivers a buffer after it has been recorded, so its last sample belongs to `now`
+        for index in numpy.flatnonzero(phase == 0):
+            self.onsets.append(now - (frameCount - index) / rate)
+        self.position += frameCount
+        return samples.astype(numpy.int16).tobytes()
+
+class OnsetDetector():
+    # sink for the receiving side: remembers the time at which every burst onset was "played"
+    THRESHOLD = 2000
+    HOLDOFF = BurstSource.INTERVAL / 2 # seconds, ignore the rest of a detected burst
+
+    def __init__(self):
+        self.position = 0 # samples
+        self.holdoff = 0 # sample position until which no onset is detected
+        self.onsets = [] # monotonic time
+
+    def __call__(self, data, rate):
+        # a sound card starts playing a buffer when it is handed over, so its first sample belongs to `now`
+        now = time.monotonic()
+        samples = numpy.abs(numpy.frombuffer(data, dtype=numpy.int16).astype(numpy.int32))
+        start = max(0, self.holdoff - self.position)
+        while(start < len(samples)):
+            loud = numpy.flatnonzero(samples[start:] > self.THRESHOLD)
+            if(len(loud) == 0): break
+            index = start + int(loud[0])
+            self.onsets.append(now + index / rate)
+            self.holdoff = self.position + index + int(rate * self.HOLDOFF)
+            start = self.holdoff - self.position
+        self.position += len(samples)
+
+def matchLatencies(sentOnsets, playedOnsets):
+    # latency of every played burst to the latest burst sent before it
+    latencies = []
+    for played in playedOnsets:
+        candidates = [sent for sent in sentOnsets if sent <= played]
+        if(candidates and played - candidates[-1] < BurstSource.INTERVAL):
+            latencies.append(played - candidates[-1])
+    return latencies
+
+def threadCpuTime(thread):
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+    except (AttributeError, OSError):
+        return 0.0 # not supported on this platform or thread already gone
+
+def runLoopback(codecName, duration=10, delay=0.0, jitter=0.0, loss=0.0, deviceRate=None, seed=None, mediaSettings={}):
+    payloadType, payloadTypeDescription = CODEC_PAYLOAD_TYPES[codecName]
+    ptMap = {payloadType: payloadTypeDescription}
+    # deterministic signal path: no silence suppression, no gain control
+    mediaSettings = {'vad': False, 'agc': False, **mediaSettings}
+    source = BurstSource()
+    sink = OnsetDetector()
+
+    receiver = InputAudioSocket('127.0.0.1', NullAudio(sink=sink, sampleRate=deviceRate), ptMap=ptMap, mediaSettings=mediaSettings)
+    relay = ImpairedRelay(receiver.getsockname(), delay, jitter, loss, seed)
+    senderSock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    senderSock.bind(('127.0.0.1', 0))
+    sender = OutputAudioSocket(senderSock, '127.0.0.1', relay.getsockname()[1], payloadType, NullAudio(source=source, sampleRate=deviceRate),
+        ptMap=ptMap, statistics=receiver.statistics, mediaSettings=mediaSettings)
+
+    relay.start()
+    receiver.start()
+    sender.start()
+    start = time.monotonic()
+    time.sleep(duration)
+    elapsed = time.monotonic() - start
+    sendCpu = threadCpuTime(sender)
+    receiveCpu = threadCpuTime(receiver)
+    statistics = receiver.statistics
+    playbackBuffer = receiver.playbackBuffer
+    result = {
+        'codec': codecName,
+        'sentBursts': len(source.onsets),
+        'playedBursts': len(sink.onsets),
+        'latencies': matchLatencies(source.onsets, sink.onsets),
+        'glitches': (sender.captureBuffer.overruns + sender.inputOverflows + sender.droppedFrames
+            + (playbackBuffer.underruns + playbackBuffer.overruns if playbackBuffer != None else 0)),
+        'sendCpu': sendCpu / elapsed,
+        'receiveCpu': receiveCpu / elapsed,
+        'packetsLost': statistics.cumulativeLost(),
+        'framesDecoded': statistics.framesDecoded,
+        'decodeTime': statistics.averageDecodeTime(),
+        'frameDuration': sender.codec.frameDuration,
+    }
+
+    sender.stop()
+    receiver.stop()
+    relay.stop()
+    sender.join(2)
+    receiver.join(2)
+    return result
+
+def formatResult(result):
+    latencies = result['latencies']
+    latencyText = 'latency n/a'
+    if(latencies):
+        latencyText = f'latency {numpy.mean(latencies)*1000:6.1f} ms (min {min(latencies)*1000:.1f}, max {max(latencies)*1000:.1f})'
+    decodeText = 'decode n/a'
+    if(result['decodeTime'] > 0):
+        decodeText = f"decode {result['decodeTime']*1_000_000:5.0f} µs/frame ({result['frameDuration']/result['decodeTime']:.0f}x real time)"
+    return (f"{result['codec']:5} {latencyText}  bursts {result['playedBursts']}/{result['sentBursts']}  "
+        + f"glitches {result['glitches']}  lost {result['packetsLost']}  "
+        + f"CPU send {result['sendCpu']*100:.1f} % receive {result['receiveCpu']*100:.1f} %  {decodeText}")
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description='Measure latency, glitches and CPU usage of the media path without sound card')
+    parser.add_argument('--codecs', nargs='*', default=list(CODEC_PAYLOAD_TYPES.keys()), choices=CODEC_PAYLOAD_TYPES.keys())
+    parser.add_argument('--duration', type=float, default=10, help='seconds per codec')
+    parser.add_argument('--delay', type=float, default=0, help='network delay in ms')
+    parser.add_argument('--jitter', type=float, default=0, help='random additional network delay in ms')
+    parser.add_argument('--loss', type=float, default=0, help='packet loss in percent')
+    parser.add_argument('--device-rate', type=int, help='only allow this sound card sample rate (tests the resampling path)')
+    parser.add_argument('--seed', type=int, help='random seed for reproducible jitter and loss')
+    parser.add_argument('--json', action='store_true', help='print results as JSON')
+    parser.add_argument('--verbose', action='store_true', help='show the debug output of the audio sockets')
+    args = parser.parse_args()
+
+    results = []
+    for codecName in args.codecs:
+        if(not codecAvailable(codecName)):
+            if(not args.json): print(f'{codecName:5} skipped, codec library not installed')
+            continue
+        with (contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())):
+            result = runLoopback(codecName, args.duration, args.delay / 1000, args.jitter / 1000, args.loss / 100, args.device_rate, args.seed)
+        results.append(result)
+        if(not args.json): print(formatResult(result))
+    if(args.json): print(json.dumps(results, indent=4))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+# Optional media worker process. RTP reception, decoding, encoding and sound card I/O run in a
+# separate process so that GUI work (phone book parsing, dialogs, table rebuilds) can not steal
+# the GIL from the real-time audio threads. SipHandler controls the worker via a command pipe,
+# call statistics and audio levels come back through a shared memory ring.
+
+import multiprocessing
+import threading
+import traceback
+import signal
+import struct
+import math
+import time
+
+from .RingBuffer import SharedRecordRing
+from .Rtcp import CallStatistics
+from .Dsp import LevelMeter
+from .AudioSocket import InputAudioSocket, OutputAudioSocket
+from .AudioBackend import createAudioBackend
+
+
+# CallStatistics attributes which are mirrored into the GUI process
+STATISTICS_INTEGER_FIELDS = (
+    'packetsReceived', 'octetsReceived', 'latePackets', 'framesDecoded',
+    'baseSequenceNumber', 'maxSequenceNumber', 'sequenceCycles', 'clockRate',
+    'remoteFractionLost', 'remoteCumulativeLost', 'remoteJitter', 'rtcpPacketsSent', 'rtcpPacketsReceived',
+)
+STATISTICS_FLOAT_FIELDS = ('decodeTime', 'jitter', 'roundTripTime')
+# remoteSsrc decides whether packetsExpected() counts at all, -1 stands for None (SSRCs are unsigned 32 bit)
+STATISTICS_OPTIONAL_INTEGER_FIELDS = ('remoteSsrc',)
+# receive level, send level, statistics, packets sent, octets sent, codec name
+STATUS_RECORD = struct.Struct('<2d' + 'q' * len(STATISTICS_INTEGER_FIELDS) + 'd' * len(STATISTICS_FLOAT_FIELDS)
+    + 'q' * len(STATISTICS_OPTIONAL_INTEGER_FIELDS) + '2q16s')
+STATUS_INTERVAL = 0.2 # seconds
+STATUS_RING_SLOTS = 64
+
+def packStatus(statistics, receiveLevel, sendLevel):
+    return STATUS_RECORD.pack(
+        receiveLevel, sendLevel,
+        *(int(getattr(statistics, field)) for field in STATISTICS_INTEGER_FIELDS),
+        *(math.nan if getattr(statistics, field) == None else getattr(statistics, field) for field in STATISTICS_FLOAT_FIELDS),
+        *(-1 if getattr(statistics, field) == None else int(getattr(statistics, field)) for field in STATISTICS_OPTIONAL_INTEGER_FIELDS),
+        statistics.packetsSent(), statistics.octetsSent(),
+        (statistics.codecName or '').encode('ascii')
+    )
+
+def unpackStatus(record, statistics):
+    # applies the record to the given CallStatistics object, returns the audio levels
+    values = STATUS_RECORD.unpack(record)
+    integerValues = values[2:2+len(STATISTICS_INTEGER_FIELDS)]
+    floatValues = values[2+len(STATISTICS_INTEGER_FIELDS):2+len(STATISTICS_INTEGER_FIELDS)+len(STATISTICS_FLOAT_FIELDS)]
+    optionalIntegerValues = values[-3-len(STATISTICS_OPTIONAL_INTEGER_FIELDS):-3]
+    for field, value in zip(STATISTICS_INTEGER_FIELDS, integerValues):
+        setattr(statistics, field, value)
+    for field, value in zip(STATISTICS_FLOAT_FIELDS, floatValues):
+        setattr(statistics, field, None if math.isnan(value) else value)
+    for field, value in zip(STATISTICS_OPTIONAL_INTEGER_FIELDS, optionalIntegerValues):
+        setattr(statistics, field, None if value == -1 else value)
+    statistics.packetizer.packetCount = values[-3]
+    statistics.packetizer.octetCount = values[-2]
+    statistics.codecName = values[-1].rstrip(b'\0').decode('ascii') or None
+    return values[0], values[1]
+
+class SentCounters():
+    # replaces the RtpPacketizer as source of the sent packet/octet counters in the GUI process
+    packetCount = 0
+    octetCount = 0
+
+class MediaEngine():
+    # runs in the worker process and owns the audio sockets of the current call
+    def __init__(self, connection, ring):
+        self.connection = connection
+        self.ring = ring
+        self.audio = None # created with the media settings of the first call
+        self.audioIn = None
+        self.audioOut = None
+        self.receiveLevel = LevelMeter()
+        self.sendLevel = LevelMeter()
+        self.commands = {
+            'open-input': self.openInput,
+            'start-input': self.startInput,
+            'payload-types': self.applyPayloadTypeMap,
+            'start-output': self.startOutput,
+            'stop-output': self.stopOutput,
+            'stop-input': self.stopInput,
+        }
+
+    def run(self):
+        lastStatus = 0
+        while True:
+            if(self.connection.poll(STATUS_INTERVAL)):
+                try:
+                    command, args = self.connection.recv()
+                except EOFError:
+                    break # GUI process has gone
+                if(command == 'quit'): break
+                try:
+                    self.connection.send((True, self.commands[command](*args)))
+                except Exception as e:
+                    traceback.print_exc()
+                    self.connection.send((False, str(e)))
+            now = time.monotonic()
+            if(self.audioIn != None and now - lastStatus >= STATUS_INTERVAL):
+                self.ring.write(self.status())
+                lastStatus = now
+        self.stopOutput()
+        self.stopInput()
+        if(self.audio != None): self.audio.terminate()
+
+    def status(self):
+        return packStatus(self.audioIn.statistics, self.receiveLevel.level, self.sendLevel.level)
+
+    def openInput(self, interface, deviceName, mediaSettings):
+        self.stopInput()
+        if(self.audio == None): self.audio = createAudioBackend(mediaSettings)
+        self.audioIn = InputAudioSocket(interface, self.audio, deviceName, mediaSettings=mediaSettings)
+        self.receiveLevel = LevelMeter()
+        self.audioIn.dspPipeline.stages.append(self.receiveLevel)
+        return self.audioIn.getsockname()
+
+    def startInput(self):
+        self.audioIn.start()
+
+    def applyPayloadTypeMap(self, ptMap):
+        self.audioIn.applyPayloadTypeMap(ptMap)
+
+    def startOutput(self, dstAddress, dstPort, payloadType, deviceName, ptMap, fmtpMap, mediaAttributes, mediaSettings):
+        self.stopOutput()
+        self.audioOut = OutputAudioSocket(self.audioIn.sock, dstAddress, dstPort, payloadType, self.audio, deviceName, ptMap,
+            statistics=self.audioIn.statistics, fmtpMap=fmtpMap, mediaAttributes=mediaAttributes, mediaSettings=mediaSettings,
+            echoSuppressor=self.audioIn.echoSuppressor, recorder=self.audioIn.recorder)
+        self.sendLevel = LevelMeter()
+        self.audioOut.dspPipeline.stages.append(self.sendLevel)
+        self.audioOut.start()
+
+    def stopOutput(self):
+        if(self.audioOut == None): return
+        self.audioOut.stop()
+        self.audioOut = None
+
+    def stopInput(self):
+        # returns the final status record, so that the BYE statistic headers are exact
+        if(self.audioIn == None): return None
+        self.audioIn.stop()
+        record = self.status()
+        self.audioIn = None
+        return record
+
+def mediaWorkerMain(connection, ringName):
+    # entry point of the worker process; Ctrl+C is handled by the GUI process, which then stops the worker
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    ring = SharedRecordRing(STATUS_RECORD.size, STATUS_RING_SLOTS, name=ringName)
+    MediaEngine(connection, ring).run()
+    ring.close()
+
+class MediaWorker(threading.Thread):
+    # GUI process side: starts the worker process, sends commands and mirrors the status records
+    # into the CallStatistics object of the current call
+    def __init__(self, *args, **kwargs):
+        self.ring = SharedRecordRing(STATUS_RECORD.size, STATUS_RING_SLOTS)
+        # do not fork the GUI process with its Qt threads, start a fresh interpreter instead
+        context = multiprocessing.get_context('spawn')
+        self.connection, workerConnection = context.Pipe()
+        self.process = context.Process(target=mediaWorkerMain, args=(workerConnection, self.ring.name), name='jabber4linux-media', daemon=True)
+        self.process.start()
+        workerConnection.close()
+        self.requestLock = threading.Lock()
+        self.statusLock = threading.Lock()
+        self.statistics = None
+        self.receiveLevel = -127.0 # dBov
+        self.sendLevel = -127.0 # dBov
+        self.stopFlag = False
+
+        # call Thread constructor
+        super(MediaWorker, self).__init__(*args, **kwargs)
+        self.daemon = True
+
+    def request(self, command, *args):
+        # commands are executed synchronously, SIP thread and GUI thread may both send commands
+        with self.requestLock:
+            self.connection.send((command, args))
+            success, result = self.connection.recv()
+        if(not success): raise Exception(f'Media worker failed to execute {command}: {result}')
+        return result
+
+    def attach(self, statistics):
+        with self.statusLock:
+            self.statistics = statistics
+
+    def detach(self, finalRecord):
+        with self.statusLock:
+            if(finalRecord != None and self.statistics != None):
+                self.receiveLevel, self.sendLevel = unpackStatus(finalRecord, self.statistics)
+            self.statistics = None
+
+    def run(self, *args, **kwargs):
+        while(not self.stopFlag):
+            record = self.ring.readLatest()
+            if(record != None):
+                with self.statusLock:
+                    if(self.statistics != None):
+                        self.receiveLevel, self.sendLevel = unpackStatus(record, self.statistics)
+            time.sleep(STATUS_INTERVAL)
+
+    def stop(self):
+        self.stopFlag = True
+        try:
+            with self.requestLock:
+                self.connection.send(('quit', ()))
+        except OSError: pass # worker already died
+        self.process.join(2)
+        if(self.process.is_alive()): self.process.terminate()
+        self.ring.close()
+
+class RemoteInputAudioSocket():
+    # stands in for InputAudioSocket in SipHandler, the socket itself lives in the worker process
+    echoSuppressor = None # the echo suppressor and the recorder are shared inside the worker process
+    recorder = None
+
+    def __init__(self, worker, interface, deviceName=None, mediaSettings={}):
+        self.worker = worker
+        self.statistics = CallStatistics()
+        self.statistics.packetizer = SentCounters()
+        self.address = tuple(worker.request('open-input', interface, deviceName, mediaSettings))
+        worker.attach(self.statistics)
+
+    def getsockname(self):
+        return self.address
+
+    def start(self):
+        self.worker.request('start-input')
+
+    def applyPayloadTypeMap(self, ptMap):
+        self.worker.request('payload-types', ptMap)
+
+    def stop(self):
+        self.worker.detach(self.worker.request('stop-input'))
+
+class RemoteOutputAudioSocket():
+    # stands in for OutputAudioSocket in SipHandler
+    def __init__(self, worker, dstAddress, dstPort, payloadType, deviceName=None, ptMap={}, fmtpMap={}, mediaAttributes={}, mediaSettings={}):
+        self.worker = worker
+        self.arguments = (dstAddress, dstPort, payloadType, deviceName, ptMap, fmtpMap, mediaAttributes, mediaSettings)
+
+    def start(self):
+        self.worker.request('start-output', *self.arguments)
+
+    def stop(self):
+        self.worker.request('stop-output')
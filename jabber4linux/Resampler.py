@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+import functools
+import math
+import numpy
+
+
+@functools.lru_cache(maxsize=32)
+def getFilterBank(upFactor, downFactor, tapsPerPhase):
+    # Windowed-sinc (Kaiser) low pass prototype for the upsampled rate, split into `upFactor` phases.
+    # bank[p, k] = h[p + k*upFactor], so that y = sum_k bank[p, k] * x[i-k].
+    tapCount = upFactor * tapsPerPhase
+    cutoff = 0.5 / max(upFactor, downFactor) * 0.9 # cycles per upsampled sample, incl. transition band
+    n = numpy.arange(tapCount) - (tapCount - 1) / 2
+    prototype = 2 * cutoff * numpy.sinc(2 * cutoff * n) * numpy.kaiser(tapCount, 7.0)
+    prototype *= upFactor / prototype.sum() # unity gain after zero stuffing
+    return numpy.ascontiguousarray(prototype.reshape(tapsPerPhase, upFactor).T)
+
+@functools.lru_cache(maxsize=4)
+def getFractionalKernels(taps, phases, beta):
+    # kernels[p, k]: weight of input tap k for an output at fractional position p/phases after the tap `taps/2 - 1`
+    half = taps // 2
+    distance = numpy.arange(1 - half, half + 1)[None, :] - (numpy.arange(phases) / phases)[:, None]
+    kernels = numpy.sinc(distance) * numpy.i0(beta * numpy.sqrt(numpy.clip(1 - (distance / half) ** 2, 0, 1)))
+    return kernels / kernels.sum(axis=1, keepdims=True) # unity gain regardless of the fraction
+
+class Resampler():
+    # Polyphase resampler for 16 bit PCM, replacement for audioop.ratecv.
+    # The filter history and the fractional output position are kept between chunks,
+    # so a stream can be resampled chunk by chunk without discontinuities.
+    TAPS_PER_PHASE = 32 # filter length in samples of the lower rate
+
+    def __init__(self, inRate, outRate, channels=1):
+        divisor = math.gcd(inRate, outRate)
+        self.inRate = inRate
+        self.outRate = outRate
+        self.channels = channels
+        self.upFactor = outRate // divisor
+        self.downFactor = inRate // divisor
+        # when decimating, the filter has to span the same time at the (higher) input rate
+        self.tapsPerPhase = self.TAPS_PER_PHASE * max(1, math.ceil(self.downFactor / self.upFactor))
+        self.bank = getFilterBank(self.upFactor, self.downFactor, self.tapsPerPhase)
+        self.history = numpy.zeros((self.tapsPerPhase - 1, channels))
+        self.nextPosition = 0 # position of the next output sample in upsampled units, relative to the chunk start
+        self.tapOffsets = numpy.arange(self.tapsPerPhase - 1, -1, -1)
+        # chunks usually have a constant size, so the gather indices and coefficient rows repeat
+        self.plans = {}
+
+    def getPlan(self, frameCount):
+        key = (self.nextPosition, frameCount)
+        plan = self.plans.get(key)
+        if(plan == None):
+            if(len(self.plans) > 256): self.plans.clear()
+            positions = numpy.arange(self.nextPosition, frameCount * self.upFactor, self.downFactor)
+            inputIndex = positions // self.upFactor
+            phase = positions % self.upFactor
+            plan = (
+                inputIndex[:, None] + self.tapOffsets[None, :], # window indices (outputs, taps)
+                self.bank[phase], # coefficients (outputs, taps)
+                self.nextPosition + len(positions) * self.downFactor - frameCount * self.upFactor
+            )
+            self.plans[key] = plan
+        return plan
+
+    def processArray(self, samples):
+        # samples: int16 array of shape (frames,) or (frames, channels); returns an int16 array of the same layout
+        frames = samples.reshape(-1, self.channels)
+        extended = numpy.concatenate((self.history, frames))
+        windowIndex, coefficients, self.nextPosition = self.getPlan(len(frames))
+
+        # gather the input windows of all output samples at once and apply the filter phases
+        if(self.channels == 1):
+            output = numpy.einsum('ok,ok->o', coefficients, extended[windowIndex, 0])[:, None]
+        else:
+            output = numpy.einsum('ok,okc->oc', coefficients, extended[windowIndex])
+
+        self.history = extended[len(extended) - (self.tapsPerPhase - 1):]
+        output = numpy.clip(numpy.rint(output), -32768, 32767).astype(numpy.int16)
+        return output.reshape(-1) if samples.ndim == 1 else output
+
+    def process(self, data):
+        # bytes in, bytes out (interleaved 16 bit native endian PCM)
+        return self.processArray(numpy.frombuffer(data, dtype=numpy.int16)).tobytes()
+
+class AdaptiveResampler():
+    # Resampler for ratios very close to 1 which may change from chunk to chunk, used to compensate the
+    # clock drift between the remote sender and the local sound card. Every output sample is interpolated
+    # at its fractional input position with a short Kaiser windowed sinc kernel, which is taken from a
+    # precomputed table of PHASES fractional positions.
+    TAPS = 16
+    PHASES = 512
+    KAISER_BETA = 6.0
+
+    def __init__(self):
+        self.ratio = 1.0 # input samples consumed per output sample
+        half = self.TAPS // 2
+        self.offsets = numpy.arange(1 - half, half + 1) # kernel taps relative to the integer input position
+        self.kernels = getFractionalKernels(self.TAPS, self.PHASES, self.KAISER_BETA)
+        self.history = numpy.zeros(half - 1)
+        self.position = float(half - 1) # input position of the next output sample, relative to the history start
+
+    def processArray(self, samples):
+        # samples: mono int16 array; returns an int16 array with about len(samples) / ratio samples
+        half = self.TAPS // 2
+        extended = numpy.concatenate((self.history, samples))
+        limit = len(extended) - half # the kernel of the last output must not exceed the available input
+        count = max(0, math.ceil((limit - self.position) / self.ratio))
+        positions = self.position + numpy.arange(count) * self.ratio
+        positions = positions[positions < limit]
+
+        base = numpy.floor(positions).astype(numpy.int64)
+        phase = numpy.rint((positions - base) * self.PHASES).astype(numpy.int64)
+        base += phase // self.PHASES # fraction rounded up to the next integer position
+        output = numpy.einsum('ok,ok->o', self.kernels[phase % self.PHASES], extended[base[:, None] + self.offsets[None, :]])
+
+        nextPosition = positions[-1] + self.ratio if len(positions) else self.position
+        drop = min(len(extended), max(0, int(math.floor(nextPosition)) - half + 1))
+        self.history = extended[drop:]
+        self.position = nextPosition - drop
+        return numpy.clip(numpy.rint(output), -32768, 32767).astype(numpy.int16)
+
+    def process(self, data):
+        # bytes in, bytes out (16 bit native endian mono PCM)
+        return self.processArray(numpy.frombuffer(data, dtype=numpy.int16)).tobytes()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+import threading
+from multiprocessing import shared_memory
+
+
+class RingBuffer():
+    # Single-producer/single-consumer byte ring buffer.
+    # The producer only ever advances writePos and the consumer only ever advances readPos,
+    # so no lock is needed between e.g. a network thread and a PortAudio callback.
+    # Positions are monotonic counters; the physical offset is position % capacity.
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.readPos = 0
+        self.writePos = 0
+        self.dataEvent = threading.Event()
+
+        # statistics
+        self.underruns = 0 # consumer wanted more data than available
+        self.overruns = 0 # producer had to discard data because the buffer was full
+        self.primed = False # do not count underruns before the first write
+
+    def available(self):
+        return self.writePos - self.readPos
+
+    def free(self):
+        return self.capacity - (self.writePos - self.readPos)
+
+    def write(self, data):
+        size = len(data)
+        if(size > self.free()):
+            self.overruns += 1
+            return False
+        offset = self.writePos % self.capacity
+        firstPart = min(size, self.capacity - offset)
+        self.view[offset:offset+firstPart] = data[:firstPart]
+        if(firstPart < size):
+            self.view[0:size-firstPart] = data[firstPart:]
+        self.writePos += size
+        self.primed = True
+        self.dataEvent.set()
+        return True
+
+    def read(self, size, padSilence=True):
+        # returns exactly `size` bytes (padded with zero samples on underrun) if padSilence is set,
+        # otherwise only the bytes which are currently available
+        available = self.available()
+        if(available < size):
+            if(self.primed): self.underruns += 1
+            if(not padSilence): size = available
+        count = min(size, available)
+        offset = self.readPos % self.capacity
+        firstPart = min(count, self.capacity - offset)
+        data = bytes(self.view[offset:offset+firstPart])
+        if(firstPart < count):
+            data += self.view[0:count-firstPart]
+        self.readPos += count
+        if(count < size):
+            data += bytes(size - count)
+        return data
+
+    def wait(self, size, timeout=None):
+        # block the consumer until `size` bytes are available; returns False on timeout
+        while(self.available() < size):
+            self.dataEvent.clear()
+            if(self.available() >= size): break
+            if(not self.dataEvent.wait(timeout)): return False
+        return True
+
+    def clear(self):
+        # consumer side: drop everything which is currently buffered
+        self.readPos = self.writePos
+
+    def discard(self, size):
+        # consumer side: drop the oldest `size` bytes (or less, if less are buffered)
+        self.readPos += min(size, self.available())
+
+class SharedRecordRing():
+    # Single-producer/single-consumer ring of fixed size records in shared memory, for passing
+    # status records from the media worker process to the GUI process without pipe round trips.
+    # The first 16 bytes hold the write and read counters, followed by `slots` records.
+    HEADER_SIZE = 16
+
+    def __init__(self, recordSize, slots, name=None):
+        self.recordSize = recordSize
+        self.slots = slots
+        self.owner = (name == None)
+        if(self.owner):
+            self.memory = shared_memory.SharedMemory(create=True, size=self.HEADER_SIZE + recordSize * slots)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.name = self.memory.name
+        self.counters = self.memory.buf[:self.HEADER_SIZE].cast('Q') # [writeCount, readCount]
+
+        # statistics
+        self.overruns = 0 # records discarded because the consumer did not keep up
+
+    def write(self, record):
+        writeCount = self.counters[0]
+        if(writeCount - self.counters[1] >= self.slots):
+            self.overruns += 1
+            return False
+        offset = self.HEADER_SIZE + (writeCount % self.slots) * self.recordSize
+        self.memory.buf[offset:offset+self.recordSize] = record
+        self.counters[0] = writeCount + 1 # publish only after the record is complete
+        return True
+
+    def readLatest(self):
+        # returns the newest record (older ones are skipped) or None if there is nothing new
+        writeCount = self.counters[0]
+        if(writeCount == self.counters[1]): return None
+        offset = self.HEADER_SIZE + ((writeCount - 1) % self.slots) * self.recordSize
+        record = bytes(self.memory.buf[offset:offset+self.recordSize])
+        self.counters[1] = writeCount
+        return record
+
+    def close(self):
+        self.counters.release()
+        self.memory.close()
+        if(self.owner): self.memory.unlink()
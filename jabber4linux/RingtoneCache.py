@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+# Ringtones decoded to 16 bit PCM and resampled once per device sample rate, so that an incoming call
+# only has to open the output streams and can start playing from memory right away.
+
+import collections
+import threading
+import wave
+import os
+import numpy
+
+from .Resampler import Resampler
+
+
+RESAMPLE_CHUNK = 4096 # frames
+
+def readWaveFile(path):
+    # returns (16 bit PCM as int16 array of shape (frames, channels), sample rate)
+    with wave.open(path, 'rb') as wf:
+        width = wf.getsampwidth()
+        channels = wf.getnchannels()
+        rate = wf.getframerate()
+        data = wf.readframes(wf.getnframes())
+    if(width == 1): # unsigned 8 bit
+        samples = (numpy.frombuffer(data, dtype=numpy.uint8).astype(numpy.int16) - 128) << 8
+    elif(width == 2):
+        samples = numpy.frombuffer(data, dtype='<i2').astype(numpy.int16)
+    elif(width == 3): # keep the upper two bytes of every little endian sample
+        samples = numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1, 3)[:, 1:].copy().view('<i2').astype(numpy.int16)
+    elif(width == 4):
+        samples = (numpy.frombuffer(data, dtype='<i4') >> 16).astype(numpy.int16)
+    else:
+        raise ValueError(f'{path}: unsupported sample width {width}')
+    return samples.reshape(-1, channels), rate
+
+def resampleLoop(samples, inRate, outRate):
+    # resamples a looped sound: the filter history is primed with the end of the sound,
+    # so that there is no click when playback wraps around
+    resampler = Resampler(inRate, outRate, samples.shape[1])
+    resampler.processArray(samples[-resampler.tapsPerPhase:])
+    chunks = []
+    for start in range(0, len(samples), RESAMPLE_CHUNK): # limits the size of the resampler's gather arrays
+        chunks.append(resampler.processArray(samples[start:start + RESAMPLE_CHUNK]))
+    return numpy.concatenate(chunks).reshape(-1, samples.shape[1])
+
+class RingtoneCache():
+    # Least recently used entries are dropped if the cached PCM exceeds MAX_BYTES
+    # (one minute of 48 kHz stereo audio needs 11 MB).
+    MAX_BYTES = 32 * 1024 * 1024
+
+    def __init__(self, maxBytes=None):
+        self.maxBytes = maxBytes or self.MAX_BYTES
+        self.entries = collections.OrderedDict() # (path, mtime, size, rate or None for the file rate) -> (pcm bytes, rate, channels)
+        self.size = 0
+        self.lock = threading.Lock()
+
+        # statistics
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path, rate=None):
+        # returns (interleaved 16 bit PCM bytes, sample rate, channels) of the ringtone at the given rate
+        # (None: the file's own rate); a changed file is decoded again
+        stat = os.stat(path)
+        fileKey = (os.path.realpath(path), stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            entry = self.lookup(fileKey + (rate,)) if rate != None else None
+            if(entry != None):
+                self.hits += 1
+                return entry
+            source = self.lookup(fileKey + (None,))
+            cached = source != None
+            if(source == None):
+                samples, fileRate = readWaveFile(path)
+                source = self.insert(fileKey + (None,), (samples.tobytes(), fileRate, samples.shape[1]))
+            pcm, fileRate, channels = source
+            entry = source
+            if(rate != None and rate != fileRate):
+                cached = False
+                samples = numpy.frombuffer(pcm, dtype=numpy.int16).reshape(-1, channels)
+                entry = self.insert(fileKey + (rate,), (resampleLoop(samples, fileRate, rate).tobytes(), rate, channels))
+            if(cached): self.hits += 1
+            else: self.misses += 1
+            return entry
+
+    def lookup(self, key):
+        entry = self.entries.get(key)
+        if(entry != None): self.entries.move_to_end(key)
+        return entry
+
+    def insert(self, key, entry):
+        # a single entry larger than the limit is returned without being cached
+        if(len(entry[0]) > self.maxBytes): return entry
+        self.entries[key] = entry
+        self.size += len(entry[0])
+        while(self.size > self.maxBytes):
+            _, (pcm, _, _) = self.entries.popitem(last=False)
+            self.size -= len(pcm)
+        return entry
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
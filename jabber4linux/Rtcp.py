@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+
+import socket
+import threading
+import struct
+import random
+import time
+
+
+# seconds between 1900-01-01 (NTP epoch) and 1970-01-01 (unix epoch)
+NTP_EPOCH_OFFSET = 2208988800
+
+RTCP_SR = 200
+RTCP_RR = 201
+RTCP_SDES = 202
+RTCP_BYE = 203
+
+RTCP_HEADER = struct.Struct('!BBHI') # V/P/count, packet type, length in 32 bit words - 1, SSRC
+RTCP_SENDER_INFO = struct.Struct('!IIIII') # NTP seconds, NTP fraction, RTP timestamp, packet count, octet count
+RTCP_REPORT_BLOCK = struct.Struct('!IIIIII') # SSRC, fraction+cumulative lost, ext. highest seq, jitter, LSR, DLSR
+
+def ntpTimestamp(unixTime):
+    seconds = int(unixTime) + NTP_EPOCH_OFFSET
+    fraction = int((unixTime % 1) * 0x100000000) & 0xffffffff
+    return seconds & 0xffffffff, fraction
+
+def ntpMiddle32(seconds, fraction):
+    # "compact" NTP format used by LSR/DLSR, 1/65536 seconds resolution
+    return ((seconds & 0xffff) << 16) | (fraction >> 16)
+
+class CallStatistics():
+    # Media statistics of one call, filled by the RTP receiver and the RTCP handler.
+    # Receiver state follows RFC 3550 appendix A.1 (sequence numbers), A.3 (loss) and A.8 (jitter).
+
+    # ITU-T G.113 equipment impairment factor (Ie) and packet loss robustness (Bpl) per codec,
+    # used for the E-model (ITU-T G.107) MOS estimation
+    E_MODEL_CODECS = {
+        'pcmu': (0, 4.3), # G.711 without packet loss concealment
+        'pcma': (0, 4.3),
+        'g722': (0, 4.3), # wideband, rated like G.711 on the narrowband scale
+        'g729': (11, 19.0),
+        'opus': (0, 10.0), # no ITU value available, rough estimate
+    }
+    E_MODEL_DEFAULT_CODEC = (0, 4.3)
+    CODEC_DELAY = 0.025 # seconds, packetization + look-ahead + playout buffer
+
+    def __init__(self):
+        self.startTime = time.time()
+        self.packetizer = None # RtpPacketizer of the outgoing stream, source of packet/octet sent counters
+        self.codecName = None
+
+        # receive side
+        self.remoteSsrc = None
+        self.clockRate = 8000
+        self.packetsReceived = 0
+        self.octetsReceived = 0
+        self.latePackets = 0 # duplicate or out of order packets
+        self.decodeTime = 0.0 # seconds spent in decoders
+        self.framesDecoded = 0
+        self.baseSequenceNumber = 0
+        self.maxSequenceNumber = 0
+        self.sequenceCycles = 0
+        self.jitter = 0.0 # in RTP timestamp units
+        self.lastTransitTimestamp = None
+        self.lastTransitArrival = None
+        self.expectedPrior = 0
+        self.receivedPrior = 0
+        self.fractionLost = 0 # fixed point fraction (x/256) of the last reporting interval
+
+        # RTCP derived values
+        self.lastSrNtp = 0 # middle 32 bits of the NTP timestamp of the last received SR
+        self.lastSrArrival = None
+        self.roundTripTime = None # seconds
+        self.remoteFractionLost = 0 # as reported by the remote party about our stream
+        self.remoteCumulativeLost = 0
+        self.remoteJitter = 0 # in RTP timestamp units, as reported by the remote party
+        self.rtcpPacketsSent = 0
+        self.rtcpPacketsReceived = 0
+
+    def rtpReceived(self, sequenceNumber, timestamp, ssrc, octets, clockRate):
+        arrival = time.monotonic()
+        if(self.remoteSsrc != ssrc):
+            # first packet or SSRC change (e.g. after transfer), reset receiver state
+            self.remoteSsrc = ssrc
+            self.clockRate = clockRate
+            self.baseSequenceNumber = sequenceNumber
+            self.maxSequenceNumber = sequenceNumber
+            self.sequenceCycles = 0
+            self.packetsReceived = 0
+            self.expectedPrior = 0
+            self.receivedPrior = 0
+            self.lastTransitTimestamp = None
+        else:
+            delta = (sequenceNumber - self.maxSequenceNumber) & 0xffff
+            if(delta == 0 or delta >= 0x8000):
+                self.latePackets += 1
+            else: # in order, possibly with a gap
+                if(sequenceNumber < self.maxSequenceNumber):
+                    self.sequenceCycles += 0x10000
+                self.maxSequenceNumber = sequenceNumber
+        self.packetsReceived += 1
+        self.octetsReceived += octets
+
+        # interarrival jitter
+        if(self.lastTransitTimestamp != None):
+            arrivalDelta = (arrival - self.lastTransitArrival) * clockRate
+            timestampDelta = ((timestamp - self.lastTransitTimestamp + 0x80000000) & 0xffffffff) - 0x80000000
+            self.jitter += (abs(arrivalDelta - timestampDelta) - self.jitter) / 16
+        self.lastTransitTimestamp = timestamp
+        self.lastTransitArrival = arrival
+
+    def extendedMaxSequenceNumber(self):
+        return self.sequenceCycles + self.maxSequenceNumber
+
+    def packetsExpected(self):
+        if(self.remoteSsrc == None): return 0
+        return self.extendedMaxSequenceNumber() - self.baseSequenceNumber + 1
+
+    def cumulativeLost(self):
+        return max(0, self.packetsExpected() - self.packetsReceived)
+
+    def jitterSeconds(self):
+        return self.jitter / self.clockRate
+
+    def lossPercent(self):
+        expected = self.packetsExpected()
+        if(expected <= 0): return 0.0
+        return self.cumulativeLost() * 100 / expected
+
+    def averageDecodeTime(self):
+        if(self.framesDecoded == 0): return 0.0
+        return self.decodeTime / self.framesDecoded
+
+    def rFactor(self):
+        # simplified E-model: R = R0 - Is - Id - Ie,eff + A with default R0 - Is = 93.2 and A = 0
+        oneWayDelay = (self.roundTripTime or 0) / 2 + 2 * self.jitterSeconds() + self.CODEC_DELAY
+        delayMs = oneWayDelay * 1000
+        delayImpairment = 0.024 * delayMs
+        if(delayMs > 177.3): delayImpairment += 0.11 * (delayMs - 177.3)
+        ie, bpl = self.E_MODEL_CODECS.get(self.codecName, self.E_MODEL_DEFAULT_CODEC)
+        loss = self.lossPercent()
+        equipmentImpairment = ie + (95 - ie) * loss / (loss + bpl)
+        return 93.2 - delayImpairment - equipmentImpairment
+
+    def mos(self):
+        r = self.rFactor()
+        if(r <= 0): return 1.0
+        if(r >= 100): return 4.5
+        return 1 + 0.035 * r + r * (r - 60) * (100 - r) * 7e-6
+
+    def packetsSent(self):
+        return self.packetizer.packetCount if self.packetizer else 0
+
+    def octetsSent(self):
+        return self.packetizer.octetCount if self.packetizer else 0
+
+    def compileReportBlock(self):
+        # called once per outgoing RTCP report, updates the interval loss fraction
+        expected = self.packetsExpected()
+        expectedInterval = expected - self.expectedPrior
+        receivedInterval = self.packetsReceived - self.receivedPrior
+        self.expectedPrior = expected
+        self.receivedPrior = self.packetsReceived
+        lostInterval = expectedInterval - receivedInterval
+        if(expectedInterval == 0 or lostInterval <= 0): self.fractionLost = 0
+        else: self.fractionLost = min(255, (lostInterval << 8) // expectedInterval)
+
+        delaySinceLastSr = 0
+        if(self.lastSrArrival != None):
+            delaySinceLastSr = int((time.monotonic() - self.lastSrArrival) * 65536)
+        return RTCP_REPORT_BLOCK.pack(
+            self.remoteSsrc,
+            (self.fractionLost << 24) | (min(self.cumulativeLost(), 0x7fffff)),
+            self.extendedMaxSequenceNumber() & 0xffffffff,
+            int(self.jitter) & 0xffffffff,
+            self.lastSrNtp,
+            delaySinceLastSr & 0xffffffff
+        )
+
+    def reportBlockReceived(self, fractionAndLost, jitter, lastSr, delaySinceLastSr):
+        # the remote party reports about our outgoing stream
+        self.remoteFractionLost = fractionAndLost >> 24
+        self.remoteCumulativeLost = fractionAndLost & 0xffffff
+        if(self.remoteCumulativeLost & 0x800000): self.remoteCumulativeLost -= 0x1000000 # 24 bit signed
+        self.remoteJitter = jitter
+        if(lastSr != 0):
+            seconds, fraction = ntpTimestamp(time.time())
+            rtt = (ntpMiddle32(seconds, fraction) - lastSr - delaySinceLastSr) & 0xffffffff
+            if(rtt < 0x80000000): self.roundTripTime = rtt / 65536
+
+    def summary(self):
+        return {
+            'duration': time.time() - self.startTime,
+            'packetsReceived': self.packetsReceived,
+            'octetsReceived': self.octetsReceived,
+            'packetsLost': self.cumulativeLost(),
+            'latePackets': self.latePackets,
+            'jitter': self.jitterSeconds(),
+            'decodeTime': self.averageDecodeTime(),
+            'packetsSent': self.packetsSent(),
+            'octetsSent': self.octetsSent(),
+            'remotePacketsLost': self.remoteCumulativeLost,
+            'remoteJitter': self.remoteJitter / self.clockRate,
+            'roundTripTime': self.roundTripTime,
+            'rFactor': self.rFactor(),
+            'mos': self.mos(),
+        }
+
+    def compileRxStatHeader(self):
+        # Cisco style statistic headers on BYE / 200 OK to BYE
+        return (f"Dur={int(time.time() - self.startTime)},Pkt={self.packetsReceived},Oct={self.octetsReceived},"
+            + f"LostPkt={self.cumulativeLost()},AvgJit={self.jitterSeconds()*1000:f},"
+            + f"VqMetrics=\"MLQK={self.mos():.4f};CS=0;SCS=0\"")
+
+    def compileTxStatHeader(self):
+        return f"Dur={int(time.time() - self.startTime)},Pkt={self.packetsSent()},Oct={self.octetsSent()}"
+
+class RtcpSocket(threading.Thread):
+    # Sends periodic SR/RR compound packets on the RTCP port and parses the remote's reports.
+    REPORT_INTERVAL = 5 # seconds, RFC 3550 minimum; randomized by 0.5 - 1.5 on every report
+    CNAME = 'jabber4linux'
+
+    def __init__(self, sock, dstAddress, dstPort, statistics, packetizer, *args, **kwargs):
+        self.sock = sock
+        self.dstAddress = (dstAddress, dstPort)
+        self.statistics = statistics
+        self.packetizer = packetizer
+        self.stopFlag = False
+        self.lastPacketCount = 0
+
+        # call Thread constructor
+        super(RtcpSocket, self).__init__(*args, **kwargs)
+        self.daemon = True
+
+    def run(self, *args, **kwargs):
+        try:
+            nextReport = time.monotonic() + self.REPORT_INTERVAL * random.uniform(0.5, 1.5)
+            while True:
+                if(self.stopFlag): break
+                self.sock.settimeout(max(0.01, nextReport - time.monotonic()))
+                try:
+                    datagram = self.sock.recv(1500)
+                except socket.timeout:
+                    datagram = None
+                if(datagram != None):
+                    try:
+                        self.parseCompoundPacket(datagram)
+                    except (struct.error, ValueError, IndexError):
+                        # a malformed packet from the network must not end the RTCP session
+                        print(':: ignoring malformed RTCP packet')
+                if(time.monotonic() >= nextReport):
+                    self.sock.sendto(self.compileCompoundPacket(), self.dstAddress)
+                    self.statistics.rtcpPacketsSent += 1
+                    nextReport = time.monotonic() + self.REPORT_INTERVAL * random.uniform(0.5, 1.5)
+        except OSError:
+            pass
+        self.sock.close()
+
+    def stop(self):
+        self.stopFlag = True
+        try:
+            self.sock.sendto(self.compileCompoundPacket(True), self.dstAddress)
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError: pass # Errno 107 is OK, socket may already be closed
+
+    def compileCompoundPacket(self, bye=False):
+        ssrc = self.packetizer.ssrc
+        reportBlock = b''
+        if(self.statistics.remoteSsrc != None):
+            reportBlock = self.statistics.compileReportBlock()
+        reportCount = 1 if reportBlock else 0
+
+        # sender report if we sent RTP since the last report, otherwise receiver report
+        if(self.packetizer.packetCount != self.lastPacketCount):
+            self.lastPacketCount = self.packetizer.packetCount
+            seconds, fraction = ntpTimestamp(time.time())
+            # the packetizer timestamp belongs to the next frame, which is close enough to "now"
+            packet = RTCP_HEADER.pack(0x80 | reportCount, RTCP_SR, (28 + len(reportBlock)) // 4 - 1, ssrc)
+            packet += RTCP_SENDER_INFO.pack(seconds, fraction, self.packetizer.timestamp,
+                self.packetizer.packetCount & 0xffffffff, self.packetizer.octetCount & 0xffffffff)
+        else:
+            packet = RTCP_HEADER.pack(0x80 | reportCount, RTCP_RR, (8 + len(reportBlock)) // 4 - 1, ssrc)
+        packet += reportBlock
+
+        # mandatory SDES CNAME item
+        cname = self.CNAME.encode('ascii')
+        sdesChunk = struct.pack('!IBB', ssrc, 1, len(cname)) + cname + b'\x00'
+        sdesChunk += bytes(-len(sdesChunk) % 4)
+        packet += struct.pack('!BBH', 0x81, RTCP_SDES, (4 + len(sdesChunk)) // 4 - 1) + sdesChunk
+
+        if(bye):
+            packet += RTCP_HEADER.pack(0x81, RTCP_BYE, 1, ssrc)
+        return packet
+
+    def parseCompoundPacket(self, datagram):
+        offset = 0
+        while(offset + RTCP_HEADER.size <= len(datagram)):
+            firstByte, packetType, length, senderSsrc = RTCP_HEADER.unpack_from(datagram, offset)
+            if((firstByte >> 6) != 2): return # not RTCP (e.g. STUN)
+            packetEnd = offset + (length + 1) * 4
+            if(packetEnd > len(datagram)): return
+            reportCount = firstByte & 0x1f
+            blockOffset = offset + RTCP_HEADER.size
+
+            if(packetType == RTCP_SR):
+                if(blockOffset + RTCP_SENDER_INFO.size > packetEnd):
+                    offset = packetEnd
+                    continue
+                seconds, fraction, _, _, _ = RTCP_SENDER_INFO.unpack_from(datagram, blockOffset)
+                self.statistics.lastSrNtp = ntpMiddle32(seconds, fraction)
+                self.statistics.lastSrArrival = time.monotonic()
+                blockOffset += RTCP_SENDER_INFO.size
+            if(packetType == RTCP_SR or packetType == RTCP_RR):
+                for i in range(reportCount):
+                    if(blockOffset + RTCP_REPORT_BLOCK.size > packetEnd): break
+                    reporteeSsrc, fractionAndLost, _, jitter, lastSr, delaySinceLastSr = RTCP_REPORT_BLOCK.unpack_from(datagram, blockOffset)
+                    if(reporteeSsrc == self.packetizer.ssrc):
+                        self.statistics.reportBlockReceived(fractionAndLost, jitter, lastSr, delaySinceLastSr)
+                    blockOffset += RTCP_REPORT_BLOCK.size
+                self.statistics.rtcpPacketsReceived += 1
+
+            offset = packetEnd
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+import struct
+import os
+
+
+RTP_VERSION = 2
+RTP_MAX_DATAGRAM = 2048
+
+# version/padding/extension/CSRC count, marker/payload type, sequence number, timestamp, SSRC
+RTP_HEADER = struct.Struct('!BBHII')
+RTP_HEADER_EXTENSION = struct.Struct('!HH')
+
+def unpackRtpHeader(buf, size):
+    # parse the RTP header of a received datagram in one struct call without slicing
+    # returns (payloadType, marker, sequenceNumber, timestamp, ssrc, payloadStart, payloadEnd)
+    # or None if the datagram is not a valid RTP packet (e.g. STUN)
+    if(size < RTP_HEADER.size): return None
+    firstByte, secondByte, sequenceNumber, timestamp, ssrc = RTP_HEADER.unpack_from(buf)
+    if((firstByte >> 6) != RTP_VERSION): return None
+    payloadStart = RTP_HEADER.size + 4 * (firstByte & 0x0f) # skip CSRC list
+    if(firstByte & 0x10): # skip header extension
+        if(size < payloadStart + RTP_HEADER_EXTENSION.size): return None
+        _, extensionLength = RTP_HEADER_EXTENSION.unpack_from(buf, payloadStart)
+        payloadStart += RTP_HEADER_EXTENSION.size + 4 * extensionLength
+    payloadEnd = size
+    if(firstByte & 0x20): # strip padding
+        payloadEnd -= buf[size-1]
+    if(payloadEnd < payloadStart): return None
+    return (secondByte & 0x7f, secondByte >> 7, sequenceNumber, timestamp, ssrc, payloadStart, payloadEnd)
+
+# marker/payload type, sequence number, timestamp - these bytes are contiguous in the RTP header
+RTP_HEADER_VOLATILE = struct.Struct('!BHI')
+
+class RtpPacketizer():
+    # Keeps one preallocated RTP header per outgoing stream, only the changing fields are
+    # updated in-place for each packet and header + payload are sent via scatter/gather I/O.
+
+    def __init__(self, payloadType, clockRate, sampleRate=None, ssrc=None):
+        self.payloadType = payloadType
+        self.clockRate = clockRate
+        # RTP timestamps count in units of the clock rate announced in SDP,
+        # which is not necessarily the codec sample rate (e.g. G.722: 16 kHz audio, 8 kHz clock)
+        self.sampleRate = sampleRate or clockRate
+        self.ssrc = ssrc if ssrc != None else int.from_bytes(os.urandom(4), 'big')
+        # random initial values according to RFC 3550
+        self.sequenceNumber = int.from_bytes(os.urandom(2), 'big')
+        self.timestamp = int.from_bytes(os.urandom(4), 'big')
+        self.marker = True # first packet of a talkspurt
+
+        # statistics for RTCP sender reports
+        self.packetCount = 0
+        self.octetCount = 0
+
+        self.header = bytearray(RTP_HEADER.size)
+        RTP_HEADER.pack_into(self.header, 0, RTP_VERSION << 6, self.payloadType, 0, 0, self.ssrc)
+
+    def timestampIncrement(self, samples):
+        return samples * self.clockRate // self.sampleRate
+
+    def send(self, sock, address, payload, samples, payloadType=None):
+        # `samples` is the number of codec samples contained in `payload`
+        # `payloadType` may override the stream's payload type, e.g. for comfort noise packets
+        if(payloadType == None):
+            secondByte = (0x80 if self.marker else 0) | self.payloadType
+            self.marker = False
+        else: # comfort noise does not end the silence period, the next audio packet still gets the marker bit
+            secondByte = payloadType
+        RTP_HEADER_VOLATILE.pack_into(self.header, 1, secondByte, self.sequenceNumber, self.timestamp)
+        sock.sendmsg((self.header, payload), (), 0, address)
+
+        self.packetCount += 1
+        self.octetCount += len(payload)
+        self.sequenceNumber = (self.sequenceNumber + 1) & 0xffff
+        self.timestamp = (self.timestamp + self.timestampIncrement(samples)) & 0xffffffff
+
+    def skip(self, samples):
+        # nothing is sent for this frame (e.g. DTX), but the RTP timestamp keeps running
+        # the next packet starts a new talkspurt
+        self.marker = True
+        self.timestamp = (self.timestamp + self.timestampIncrement(samples)) & 0xffffffff
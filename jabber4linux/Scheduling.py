@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+# Opt-in real-time scheduling, CPU affinity and niceness for the media threads, so that calls stay
+# clean while the desktop is busy (compiling, browsing). Real-time priority is requested directly via
+# sched_setscheduler() if permitted (CAP_SYS_NICE or RLIMIT_RTPRIO), otherwise from rtkit over D-Bus
+# like PulseAudio and PipeWire do. All functions work on the calling thread.
+
+import os
+import threading
+import resource
+
+try:
+    import pydbus
+except ImportError:
+    pydbus = None
+
+
+RTKIT_SERVICE = 'org.freedesktop.RealtimeKit1'
+RTKIT_PATH = '/org/freedesktop/RealtimeKit1'
+DEFAULT_REALTIME_PRIORITY = 10 # low RT priority, above normal processes but below e.g. IRQ threads
+POLICY_NAMES = {
+    getattr(os, 'SCHED_OTHER', 0): 'SCHED_OTHER',
+    getattr(os, 'SCHED_FIFO', 1): 'SCHED_FIFO',
+    getattr(os, 'SCHED_RR', 2): 'SCHED_RR',
+}
+
+
+def rtkitInterface():
+    if(pydbus == None): raise OSError('pydbus is not installed')
+    return pydbus.SystemBus().get(RTKIT_SERVICE, RTKIT_PATH)
+
+def rtkitMakeRealtime(threadId, priority):
+    rtkit = rtkitInterface()
+    priority = min(priority, int(rtkit.MaxRealtimePriority))
+    # rtkit only hands out RT scheduling if the process limits its CPU time (runaway protection)
+    maxRtTime = int(rtkit.RTTimeUSecMax)
+    softLimit, hardLimit = resource.getrlimit(resource.RLIMIT_RTTIME)
+    if(hardLimit == resource.RLIM_INFINITY or hardLimit > maxRtTime):
+        resource.setrlimit(resource.RLIMIT_RTTIME, (maxRtTime, maxRtTime))
+    rtkit.MakeThreadRealtime(threadId, priority)
+
+def rtkitMakeHighPriority(threadId, nice):
+    rtkit = rtkitInterface()
+    nice = max(nice, int(rtkit.MinNiceLevel))
+    rtkit.MakeThreadHighPriority(threadId, nice)
+
+def setRealtime(priority):
+    # returns the method which succeeded, raises OSError if neither is permitted
+    try:
+        os.sched_setscheduler(0, os.SCHED_RR, os.sched_param(priority))
+        return 'sched_setscheduler'
+    except PermissionError as e:
+        directError = e
+    try:
+        rtkitMakeRealtime(threading.get_native_id(), priority)
+        return 'rtkit'
+    except Exception as e:
+        raise OSError(f'{directError.strerror}, rtkit: {e}')
+
+def setNice(nice):
+    threadId = threading.get_native_id()
+    try:
+        os.setpriority(os.PRIO_PROCESS, threadId, nice) # on Linux, the niceness is a per-thread attribute
+        return 'setpriority'
+    except PermissionError as e:
+        directError = e
+    try:
+        rtkitMakeHighPriority(threadId, nice)
+        return 'rtkit'
+    except Exception as e:
+        raise OSError(f'{directError.strerror}, rtkit: {e}')
+
+def currentPolicy():
+    # human readable scheduling state of the calling thread
+    policy = os.sched_getscheduler(0)
+    text = POLICY_NAMES.get(policy, str(policy))
+    if(policy in (os.SCHED_FIFO, os.SCHED_RR)):
+        text += f' priority {os.sched_getparam(0).sched_priority}'
+    else:
+        text += f' nice {os.getpriority(os.PRIO_PROCESS, threading.get_native_id())}'
+    cpus = os.sched_getaffinity(0)
+    if(len(cpus) < os.cpu_count()):
+        text += ' on CPU ' + ','.join(str(cpu) for cpu in sorted(cpus))
+    return text
+
+def applyThreadScheduling(mediaSettings):
+    # to be called at the start of a media thread; returns a report of the achieved policy
+    if(not hasattr(os, 'sched_setscheduler')): return 'not supported on this platform'
+    notes = []
+
+    cpus = mediaSettings.get('cpu-affinity')
+    if(cpus):
+        try:
+            os.sched_setaffinity(0, cpus)
+        except OSError as e:
+            notes.append(f'CPU affinity failed: {e.strerror}')
+
+    realtime = False
+    if(mediaSettings.get('realtime', False)):
+        try:
+            notes.append('via ' + setRealtime(int(mediaSettings.get('realtime-priority', DEFAULT_REALTIME_PRIORITY))))
+            realtime = True
+        except OSError as e:
+            notes.append(f'real-time scheduling failed: {e}')
+
+    nice = mediaSettings.get('nice')
+    if(nice != None and not realtime):
+        try:
+            setNice(int(nice))
+        except OSError as e:
+            notes.append(f'nice failed: {e}')
+
+    return currentPolicy() + (' (' + '; '.join(notes) + ')' if notes else '')
@@ -4,7 +4,6 @@ import socket
 import datetime
 import random
 import time
-import pyaudio
 import threading
 import traceback
 import ssl
@@ -15,8 +14,11 @@ import locale
 from threading import Timer
 from contextlib import contextmanager
 
-from .Tools import ignoreStderr
 from .AudioSocket import InputAudioSocket, OutputAudioSocket
+from .AudioBackend import createAudioBackend
+from .MediaProcess import MediaWorker, RemoteInputAudioSocket, RemoteOutputAudioSocket
+from .Conference import ConferenceMixer
+from .Codecs import codecAvailable
 
 
 class SipHandler(threading.Thread):
@@ -35,18 +37,23 @@ class SipHandler(threading.Thread):
     audio = None
     audioIn = None
     audioOut = None
+    mediaWorker = None
 
     debug = False
 
     currentCall = None
+    conferenceCall = None # second (outgoing) call of a local conference
+    conference = None
 
     evtRegistrationStatusChanged = None
     evtIncomingCall = None
     evtOutgoingCall = None
     evtCallClosed = None
+    evtConference = None
 
     inputDeviceName = None
     outputDeviceName = None
+    mediaSettings = {}
 
     # status constants
     REGISTRATION_INACTIVE = 0
@@ -66,6 +73,13 @@ class SipHandler(threading.Thread):
     OUTGOING_CALL_FAILED = 3
     OUTGOING_CALL_BUSY = 4
 
+    CONFERENCE_TRYING = 0
+    CONFERENCE_RINGING = 1
+    CONFERENCE_JOINED = 2
+    CONFERENCE_FAILED = 3
+    CONFERENCE_LEFT = 4 # the added participant hung up
+    CONFERENCE_CONTINUED = 5 # the first party hung up, the call continues with the added participant
+
     def __init__(self, serverFqdn, serverPort, tlsOptions, sipSender, sipNumber, deviceName, contactId, trustedCerts=None, debug=False, *args, **kwargs):
         self.serverFqdn = serverFqdn
         self.serverPort = serverPort
@@ -79,8 +93,9 @@ class SipHandler(threading.Thread):
 
         self.localeLock = threading.Lock()
 
-        # initialize audio interface
-        with ignoreStderr(): self.audio = pyaudio.PyAudio()
+        # audio interface, created on first use (see getAudio())
+        self.audio = None
+        self.audioLock = threading.Lock()
 
         # call Thread constructor
         super(SipHandler, self).__init__(*args, **kwargs)
@@ -170,6 +185,11 @@ class SipHandler(threading.Thread):
             else:
                 self.evtRegistrationStatusChanged.emit(self.REGISTRATION_FAILED, headers['Warning'] if 'Warning' in headers else '')
 
+        ### handle the added participant of a local conference (second dialog)
+        if(self.conferenceCall and 'Call-ID' in headers and headers['Call-ID'].split('@')[0] == self.conferenceCall['callId']):
+            self.handleConferenceMessage(headers, body)
+            return
+
         ### handle incoming calls
         if('INVITE' in headers and 'From_parsed' in headers):
             self.currentCall = {
@@ -203,9 +223,9 @@ class SipHandler(threading.Thread):
 
         if(self.currentCall and 'ACK' in headers and 'Session-ID' in headers and headers['Session-ID'].split(';')[0] == self.currentCall['headers']['Session-ID'].split(';')[0]):
             # start outgoing audio stream
-            dstAddress, dstPort, payloadType, payloadTypeMap = self.parseSdpBody(body)
+            dstAddress, dstPort, payloadType, payloadTypeMap, payloadTypeParameters, mediaAttributes = self.parseSdpBody(body)
             if(dstAddress != None and dstPort != None):
-                self.audioOut = OutputAudioSocket(self.audioIn.sock, dstAddress, dstPort, payloadType, self.audio, self.inputDeviceName, payloadTypeMap)
+                self.audioOut = self.createAudioOut(dstAddress, dstPort, payloadType, payloadTypeMap, payloadTypeParameters, mediaAttributes)
                 self.audioOut.start()
 
         ### handle outgoing calls
@@ -224,9 +244,9 @@ class SipHandler(threading.Thread):
             elif(headers['SIP/2.0'].startswith('200')):
                 self.evtOutgoingCall.emit(self.OUTGOING_CALL_ACCEPTED, '')
                 # start outgoing audio stream
-                dstAddress, dstPort, payloadType, payloadTypeMap = self.parseSdpBody(body)
+                dstAddress, dstPort, payloadType, payloadTypeMap, payloadTypeParameters, mediaAttributes = self.parseSdpBody(body)
                 if(dstAddress != None and dstPort != None):
-                    self.audioOut = OutputAudioSocket(self.audioIn.sock, dstAddress, dstPort, payloadType, self.audio, self.inputDeviceName, payloadTypeMap)
+                    self.audioOut = self.createAudioOut(dstAddress, dstPort, payloadType, payloadTypeMap, payloadTypeParameters, mediaAttributes)
                     self.audioOut.start()
                 # send SIP ACK
                 senddata = self.compileInviteOkAckHead(
@@ -249,19 +269,32 @@ class SipHandler(threading.Thread):
         ### handle BYE from remote party (of incoming and outgoing calls)
         if(self.currentCall and 'BYE' in headers and 'Call-ID' in headers and headers['Call-ID'].split('@')[0] == self.currentCall['headers']['Call-ID'].split('@')[0]):
             # stop audio streams
+            statistics = self.audioIn.statistics if self.audioIn != None else None
             if(self.audioOut != None):
                 self.audioOut.stop()
                 self.audioOut = None
             if(self.audioIn != None):
                 self.audioIn.stop()
                 self.audioIn = None
+            if(self.debug and statistics != None): print(':: call statistics:', statistics.summary())
             # ack BYE
             senddata = self.compileByeOkHead(
                 headers['Via'], headers['From'], headers['To'], headers['Call-ID'],
-                self.currentCall['mySessionId'], self.currentCall['remoteSessionId']
+                self.currentCall['mySessionId'], self.currentCall['remoteSessionId'],
+                statistics
             )
             self.sendSipMessage(senddata)
-            self.evtCallClosed.emit()
+            if(self.conferenceCall != None and self.conferenceCall['audioOut'] != None):
+                # the conference continues as normal call with the added participant
+                self.conference.removeLeg(self.currentCall['leg'])
+                self.currentCall = self.conferenceCall
+                self.conferenceCall = None
+                self.audioIn = self.currentCall['audioIn']
+                self.audioOut = self.currentCall['audioOut']
+                self.evtConference.emit(self.CONFERENCE_CONTINUED, self.currentCall['headers']['To_parsed_text'])
+            else:
+                self.endConference()
+                self.evtCallClosed.emit()
 
         ### special: handle phone events ("kpml") in order to establish outgoing external (landline) calls
         if(self.currentCall and 'SUBSCRIBE' in headers and headers['CSeq'] == '101 SUBSCRIBE'):
@@ -298,6 +331,53 @@ class SipHandler(threading.Thread):
             )
             self.sendSipMessage(senddata)
 
+    def handleConferenceMessage(self, headers, body):
+        call = self.conferenceCall
+        if('SIP/2.0' in headers and 'CSeq' in headers and 'INVITE' in headers['CSeq']):
+            if(headers['SIP/2.0'].startswith('100')):
+                call['headers'] = headers
+            elif(headers['SIP/2.0'].startswith('180') or headers['SIP/2.0'].startswith('183') or headers['SIP/2.0'].startswith('200')):
+                call['headers'] = headers
+                displayText, number = self.partyHeaderToDisplayText(headers['To'], headers['Remote-Party-ID'] if 'Remote-Party-ID' in headers else None)
+                call['headers']['To_parsed_text'] = displayText
+                call['headers']['To_parsed_number'] = number
+                if('Session-ID' in headers): call['remoteSessionId'] = headers['Session-ID'].split(';')[0]
+                if(not headers['SIP/2.0'].startswith('200')):
+                    self.evtConference.emit(self.CONFERENCE_RINGING, displayText)
+                    return
+                # start outgoing audio stream, the participant gets the mix-minus from the conference mixer
+                dstAddress, dstPort, payloadType, payloadTypeMap, payloadTypeParameters, mediaAttributes = self.parseSdpBody(body)
+                if(dstAddress != None and dstPort != None and call['audioOut'] == None):
+                    call['audioOut'] = OutputAudioSocket(call['audioIn'].sock, dstAddress, dstPort, payloadType, call['leg'], None, payloadTypeMap,
+                        statistics=call['audioIn'].statistics, fmtpMap=payloadTypeParameters, mediaAttributes=mediaAttributes,
+                        mediaSettings=call['mediaSettings'], echoSuppressor=call['audioIn'].echoSuppressor)
+                    call['audioOut'].start()
+                # send SIP ACK
+                senddata = self.compileInviteOkAckHead(
+                    headers['To_parsed'],
+                    headers['Via'], headers['From'], headers['To'], headers['Call-ID'],
+                    call['mySessionId'], call['remoteSessionId']
+                )
+                self.sendSipMessage(senddata)
+                self.evtConference.emit(self.CONFERENCE_JOINED, displayText)
+            else:
+                self.stopConferenceAudio(call)
+                self.conferenceCall = None
+                self.evtConference.emit(self.CONFERENCE_FAILED, headers['Warning'] if 'Warning' in headers else headers['SIP/2.0'])
+
+        elif('BYE' in headers):
+            statistics = self.stopConferenceAudio(call)
+            self.conferenceCall = None
+            if(self.debug): print(':: conference participant call statistics:', statistics.summary())
+            # ack BYE
+            senddata = self.compileByeOkHead(
+                headers['Via'], headers['From'], headers['To'], headers['Call-ID'],
+                call['mySessionId'], call['remoteSessionId'],
+                statistics
+            )
+            self.sendSipMessage(senddata)
+            self.evtConference.emit(self.CONFERENCE_LEFT, call['headers']['To_parsed_text'] if 'To_parsed_text' in call['headers'] else call['number'])
+
     def sendSipMessage(self, message):
         if(self.debug):
             print('=== OUTGOING SIP MESSAGE '+('(encrypted) ' if self.useTls else '')+'===')
@@ -328,6 +408,9 @@ class SipHandler(threading.Thread):
 
     def stop(self):
         if(self.debug): print(':: closing SIP(S) connection')
+        if(self.mediaWorker != None):
+            self.mediaWorker.stop()
+            self.mediaWorker = None
         if(hasattr(self, 'registerRenewalInterval') and self.registerRenewalInterval.is_alive()):
             self.registerRenewalInterval.cancel()
         try:
@@ -339,16 +422,128 @@ class SipHandler(threading.Thread):
             if(self.debug): print(':: failed to shutdown SIP socket:', e)
         self.evtRegistrationStatusChanged.emit(self.REGISTRATION_INACTIVE, 'Session closed by user')
 
+    def getAudio(self):
+        # the audio backend depends on the media settings, which are assigned after construction
+        with self.audioLock:
+            if(self.audio == None):
+                self.audio = createAudioBackend(self.mediaSettings)
+            return self.audio
+
+    def createAudioIn(self):
+        # with the media-process setting, the audio sockets run in a separate process (isolated from GUI load)
+        if(self.mediaSettings.get('media-process', False)):
+            if(self.mediaWorker == None):
+                self.mediaWorker = MediaWorker()
+                self.mediaWorker.start()
+            return RemoteInputAudioSocket(self.mediaWorker, self.sock.getsockname()[0], self.outputDeviceName, self.mediaSettings)
+        return InputAudioSocket(self.sock.getsockname()[0], self.getAudio(), self.outputDeviceName, mediaSettings=self.mediaSettings)
+
+    def createAudioOut(self, dstAddress, dstPort, payloadType, payloadTypeMap, payloadTypeParameters, mediaAttributes):
+        if(isinstance(self.audioIn, RemoteInputAudioSocket)):
+            return RemoteOutputAudioSocket(self.mediaWorker, dstAddress, dstPort, payloadType, self.inputDeviceName, payloadTypeMap, payloadTypeParameters, mediaAttributes, self.mediaSettings)
+        return OutputAudioSocket(self.audioIn.sock, dstAddress, dstPort, payloadType, self.getAudio(), self.inputDeviceName, payloadTypeMap, statistics=self.audioIn.statistics, fmtpMap=payloadTypeParameters, mediaAttributes=mediaAttributes, mediaSettings=self.mediaSettings, echoSuppressor=self.audioIn.echoSuppressor, recorder=self.audioIn.recorder)
+
+    def addConferenceParticipant(self, number):
+        # local three-way conference: the current call and a second call to `number` are mixed on this machine
+        if(self.currentCall == None or self.audioIn == None or self.audioOut == None):
+            raise Exception('There is no established call to add a participant to')
+        if(self.conferenceCall != None):
+            raise Exception('The conference already has three participants')
+        if(isinstance(self.audioIn, RemoteInputAudioSocket)):
+            raise Exception('Local conferences are not available with the media-process setting')
+
+        if(self.conference == None):
+            # move the current call onto the mixer first, so that the sound card is free for the mixer
+            self.conference = ConferenceMixer(self.getAudio(), self.inputDeviceName, self.outputDeviceName, self.mediaSettings)
+            self.currentCall['leg'] = self.conference.addLeg()
+            self.audioIn.switchAudio(self.currentCall['leg'])
+            self.audioOut.switchAudio(self.currentCall['leg'])
+            try:
+                self.conference.openAudioStreams()
+            except Exception:
+                self.audioIn.switchAudio(self.getAudio(), self.outputDeviceName)
+                self.audioOut.switchAudio(self.getAudio(), self.inputDeviceName)
+                self.conference = None
+                raise
+            self.conference.start()
+
+        # the recorder of the first call already records the conference, since its send direction is the mix-minus
+        mediaSettings = {**self.mediaSettings, 'recording': False}
+        leg = self.conference.addLeg()
+        audioIn = InputAudioSocket(self.sock.getsockname()[0], leg, mediaSettings=mediaSettings)
+        audioIn.start()
+        self.conferenceCall = {
+            'callId': self.generateCallId(),
+            'number': number,
+            'remoteSessionId': self.EMPTY_SESSION_ID,
+            'mySessionId': self.generateSessionId(),
+            'headers': [],
+            'outgoing': True,
+            'leg': leg,
+            'audioIn': audioIn,
+            'audioOut': None,
+            'mediaSettings': mediaSettings,
+            'addedToHistory': False, # set by the GUI, CONFERENCE_RINGING is emitted for every 180/183 (and retransmits)
+        }
+
+        # send SIP INVITE
+        sdp, payloadTypeMap = self.compileInviteBody(audioIn.getsockname()[0], str(audioIn.getsockname()[1]))
+        senddata = self.compileInviteHead(
+            self.sock.getsockname()[0], str(self.sock.getsockname()[1]),
+            self.conferenceCall['mySessionId'], self.conferenceCall['remoteSessionId'], number, self.conferenceCall['callId'],
+            None, sdp
+        )
+        audioIn.applyPayloadTypeMap(payloadTypeMap)
+        self.sendSipMessage(senddata)
+        self.evtConference.emit(self.CONFERENCE_TRYING, number)
+
+    def stopConferenceAudio(self, call):
+        statistics = call['audioIn'].statistics
+        if(call['audioOut'] != None):
+            call['audioOut'].stop()
+        call['audioIn'].stop()
+        self.conference.removeLeg(call['leg'])
+        return statistics
+
+    def endConference(self):
+        # hangs up the added participant and releases the sound card
+        call = self.conferenceCall
+        self.conferenceCall = None
+        if(call != None):
+            statistics = self.stopConferenceAudio(call)
+            headers = call['headers']
+            if(call['audioOut'] != None):
+                senddata = self.compileByeHeadOutgoing(
+                    headers['From'], headers['To'], headers['Call-ID'],
+                    self.sock.getsockname()[0], str(self.sock.getsockname()[1]),
+                    call['mySessionId'], call['remoteSessionId'],
+                    statistics
+                )
+                self.sendSipMessage(senddata)
+            elif(headers):
+                # still ringing
+                senddata = self.compileCancelHead(
+                    headers['From'], headers['To'], headers['Call-ID'],
+                    self.sock.getsockname()[0], str(self.sock.getsockname()[1]),
+                    call['mySessionId'], call['remoteSessionId'],
+                    call['number']
+                )
+                self.sendSipMessage(senddata)
+        if(self.conference != None):
+            self.conference.stop()
+            self.conference.join(1)
+            self.conference = None
+
     def acceptCall(self):
         if(self.currentCall == None): return
         headers = self.currentCall['headers']
 
         # prepare for incoming audio stream
-        self.audioIn = InputAudioSocket(self.sock.getsockname()[0], self.audio, self.outputDeviceName)
+        self.audioIn = self.createAudioIn()
         self.audioIn.start()
 
         # ack SIP INVITE message
-        sdp, payloadTypeMap = self.compileInviteBody(self.audioIn.sock.getsockname()[0], str(self.audioIn.sock.getsockname()[1]))
+        sdp, payloadTypeMap = self.compileInviteBody(self.audioIn.getsockname()[0], str(self.audioIn.getsockname()[1]))
         senddata = self.compileInviteOkHead(
             headers['Via'], headers['From'], headers['To'], headers['Call-ID'],
             self.currentCall['mySessionId'], self.currentCall['remoteSessionId'], headers['INVITE'].split(' ')[0],
@@ -379,11 +574,11 @@ class SipHandler(threading.Thread):
         }
 
         # prepare for incoming audio stream
-        self.audioIn = InputAudioSocket(self.sock.getsockname()[0], self.audio, self.outputDeviceName)
+        self.audioIn = self.createAudioIn()
         self.audioIn.start()
 
         # send SIP INVITE
-        sdp, payloadTypeMap = self.compileInviteBody(self.audioIn.sock.getsockname()[0], str(self.audioIn.sock.getsockname()[1]))
+        sdp, payloadTypeMap = self.compileInviteBody(self.audioIn.getsockname()[0], str(self.audioIn.getsockname()[1]))
         senddata = self.compileInviteHead(
             self.sock.getsockname()[0], str(self.sock.getsockname()[1]),
             self.currentCall['mySessionId'], self.currentCall['remoteSessionId'], number, self.currentCall['callId'],
@@ -408,8 +603,12 @@ class SipHandler(threading.Thread):
     def closeCall(self, isOutgoingCall):
         if(self.currentCall == None): return
         headers = self.currentCall['headers']
+        # after a conference, the call may have continued with the added participant (always outgoing)
+        isOutgoingCall = self.currentCall.get('outgoing', isOutgoingCall)
+        self.endConference()
 
         # stop audio streams
+        statistics = self.audioIn.statistics if self.audioIn != None else None
         if(self.audioOut != None):
             self.audioOut.stop()
             self.audioOut = None
@@ -417,17 +616,21 @@ class SipHandler(threading.Thread):
             self.audioIn.stop()
             self.audioIn = None
 
+        if(self.debug and statistics != None): print(':: call statistics:', statistics.summary())
+
         # send SIP BYE message
         if(isOutgoingCall):
             senddata = self.compileByeHeadOutgoing(
                 headers['From'], headers['To'], headers['Call-ID'],
                 self.sock.getsockname()[0], str(self.sock.getsockname()[1]),
-                self.currentCall['mySessionId'], self.currentCall['remoteSessionId']
+                self.currentCall['mySessionId'], self.currentCall['remoteSessionId'],
+                statistics
             )
         else:
             senddata = self.compileByeHeadIncoming(
                 headers['Via'], headers['From'], headers['To'], headers['Call-ID'],
-                self.currentCall['mySessionId'], self.currentCall['remoteSessionId']
+                self.currentCall['mySessionId'], self.currentCall['remoteSessionId'],
+                statistics
             )
         self.sendSipMessage(senddata)
 
@@ -497,6 +700,8 @@ class SipHandler(threading.Thread):
         targetPort = None
         payloadType = 0 # PCMU default/fallback
         payloadTypeMap = {}
+        payloadTypeParameters = {}
+        mediaAttributes = {}
         for key, value in attrs['m'].items():
             if(not key.startswith('audio ')): continue
             audioParams = key.split(' ') #m=audio 19424 RTP/AVP 8 101
@@ -511,11 +716,25 @@ class SipHandler(threading.Thread):
                     # switch to PCMA if requested (always 8)
                     # switch to G729 if requested
                     # switch to OPUS if requested
-                    if(payloadTypeDescription.upper().startswith('PCMA')
-                    or payloadTypeDescription.lower().startswith('g729')
-                    or payloadTypeDescription.lower().startswith('opus')):
+                    # switch to G722 if requested and enabled in the settings (like in our offer)
+                    # (only if the codec library is installed)
+                    codecName = payloadTypeDescription.split('/')[0].lower()
+                    if(codecName == 'g722' and not self.mediaSettings.get('g722', False)): continue
+                    if(codecName in ['pcma', 'g722', 'g729', 'opus'] and codecAvailable(codecName)):
                         payloadType = payloadTypeNumber
-        return targetAddress, targetPort, payloadType, payloadTypeMap
+                elif(splitter1[0] == 'fmtp'): #a=fmtp:114 maxplaybackrate=16000;useinbandfec=1
+                    splitter2 = codecOption.split(':', 1)[1].split(' ', 1)
+                    if(len(splitter2) != 2 or not splitter2[0].isdigit()): continue
+                    parameters = {}
+                    for parameter in splitter2[1].split(';'):
+                        splitter3 = parameter.strip().split('=', 1)
+                        parameters[splitter3[0].lower()] = splitter3[1].strip() if len(splitter3) == 2 else ''
+                    payloadTypeParameters[int(splitter2[0])] = parameters
+                elif(splitter1[0] in ['ptime', 'maxptime'] and len(splitter1) > 1): #a=ptime:20
+                    try:
+                        mediaAttributes[splitter1[0]] = int(float(splitter1[1].strip()))
+                    except ValueError: pass
+        return targetAddress, targetPort, payloadType, payloadTypeMap, payloadTypeParameters, mediaAttributes
 
     EMPTY_SESSION_ID = '00000000000000000000000000000000'
     def generateSessionId(self):
@@ -640,6 +859,15 @@ class SipHandler(threading.Thread):
             f"Content-Length: 0\r\n" +
             f"\r\n")
     def compileInviteBody(self, clientIp, clientPort):
+        # tell the remote party how we want to receive Opus (RFC 7587)
+        opusParameters = 'useinbandfec=1' if self.mediaSettings.get('opus-fec', True) else 'useinbandfec=0'
+        if(self.mediaSettings.get('opus-dtx')): opusParameters += ';usedtx=1'
+        if(self.mediaSettings.get('opus-bitrate')): opusParameters += ';maxaveragebitrate='+str(int(self.mediaSettings['opus-bitrate']))
+        # G.722 is preferred by Cisco desk phones, it is only offered if enabled in the settings
+        offerG722 = self.mediaSettings.get('g722', False) and codecAvailable('g722')
+        # Opus, G.722 and G.729 need external libraries, do not offer them if they are not installed
+        offerOpus = codecAvailable('opus')
+        offerG729 = codecAvailable('g729')
         sdp = (f"v=0\r\n" +
             f"o=Cisco-SIPUA 22437 0 IN IP4 {clientIp}\r\n" +
             f"s=SIP Call\r\n" +
@@ -648,25 +876,32 @@ class SipHandler(threading.Thread):
             f"a=cisco-mari:v1\r\n" +
             f"a=cisco-mari-rate\r\n" +
             # original: RTP/AVP 114 9 104 105 0 8 18 111 101
-            f"m=audio {clientPort} RTP/AVP 114 0 8 18 111 101\r\n" +
+            f"m=audio {clientPort} RTP/AVP {'114 ' if offerOpus else ''}{'9 ' if offerG722 else ''}0 8 {'18 ' if offerG729 else ''}111 101 13\r\n" +
             f"c=IN IP4 {clientIp}\r\n" +
-            f"a=rtpmap:114 opus/48000/2\r\n" +
-            #f"a=rtpmap:9 G722/8000\r\n" +
+            (f"a=rtpmap:114 opus/48000/2\r\n" if offerOpus else "") +
+            (f"a=fmtp:114 {opusParameters}\r\n" if offerOpus else "") +
+            (f"a=rtpmap:9 G722/8000\r\n" if offerG722 else "") +
             #f"a=rtpmap:104 G7221/16000\r\n" +
             #f"a=fmtp:104 bitrate=32000\r\n" +
             #f"a=rtpmap:105 G7221/16000\r\n" +
             #f"a=fmtp:105 bitrate=24000\r\n" +
             f"a=rtpmap:0 PCMU/8000\r\n" +
             f"a=rtpmap:8 PCMA/8000\r\n" +
-            f"a=rtpmap:18 G729/8000\r\n" +
-            f"a=fmtp:18 annexb=no\r\n" +
+            (f"a=rtpmap:18 G729/8000\r\n" if offerG729 else "") +
+            (f"a=fmtp:18 annexb={'yes' if self.mediaSettings.get('g729-annexb') else 'no'}\r\n" if offerG729 else "") +
             f"a=rtpmap:111 x-ulpfecuc/8000\r\n" +
             f"a=extmap:14/sendrecv http://protocols.cisco.com/timestamp#100us\r\n" +
             f"a=fmtp:111 max_esel=1420;m=8;max_n=32;FEC_ORDER=FEC_SRTP\r\n" +
             f"a=rtpmap:101 telephone-event/8000\r\n" +
             f"a=fmtp:101 0-16\r\n" +
+            f"a=rtpmap:13 CN/8000\r\n" +
+            f"a=ptime:{int(self.mediaSettings.get('ptime', 20))}\r\n" +
+            f"a=maxptime:60\r\n" +
             f"a=sendrecv\r\n")
-        payloadTypeMap = {114: 'opus/48000/2', 0: 'PCMU/8000', 8: 'PCMA/8000', 18:'G729/8000'}
+        payloadTypeMap = {0: 'PCMU/8000', 8: 'PCMA/8000', 13:'CN/8000'}
+        if(offerOpus): payloadTypeMap[114] = 'opus/48000/2'
+        if(offerG722): payloadTypeMap[9] = 'G722/8000'
+        if(offerG729): payloadTypeMap[18] = 'G729/8000'
         return sdp, payloadTypeMap
     def compileTryingHead(self, via, fro, to, callId, sessionId, remoteSessionId, contact):
         return (f"SIP/2.0 100 Trying\r\n" +
@@ -792,7 +1027,11 @@ class SipHandler(threading.Thread):
             f"User-Agent: Cisco-CSF\r\n" +
             f"Content-Length: 0\r\n" +
             f"\r\n")
-    def compileByeHeadOutgoing(self, fro, to, callId, clientIp, clientPort, sessionId, remoteSessionId):
+    def compileRtpStatHeaders(self, statistics):
+        if(statistics == None): return ""
+        return (f"RTP-RxStat: {statistics.compileRxStatHeader()}\r\n" +
+            f"RTP-TxStat: {statistics.compileTxStatHeader()}\r\n")
+    def compileByeHeadOutgoing(self, fro, to, callId, clientIp, clientPort, sessionId, remoteSessionId, statistics=None):
         byeTo = fro.split('<')[1].split('>')[0]
         return (f"BYE {byeTo};transport={self.getTransport()} SIP/2.0\r\n" +
             f"Via: SIP/2.0/{self.getTransport(True)} {clientIp}:{clientPort};branch=z9hG4bK00005d4d\r\n" +
@@ -804,9 +1043,10 @@ class SipHandler(threading.Thread):
             f"Date: {self.getTimestamp()}\r\n" +
             f"CSeq: 101 BYE\r\n" +
             f"User-Agent: Cisco-CSF\r\n" +
+            self.compileRtpStatHeaders(statistics) +
             f"Content-Length: 0\r\n" +
             f"\r\n")
-    def compileByeHeadIncoming(self, via, fro, to, callId, sessionId, remoteSessionId):
+    def compileByeHeadIncoming(self, via, fro, to, callId, sessionId, remoteSessionId, statistics=None):
         byeTo = fro.split('<')[1].split('>')[0]
         return (f"BYE {byeTo};transport={self.getTransport()} SIP/2.0\r\n" +
             f"Via: {via}\r\n" +
@@ -818,9 +1058,10 @@ class SipHandler(threading.Thread):
             f"Date: {self.getTimestamp()}\r\n" +
             f"CSeq: 101 BYE\r\n" +
             f"User-Agent: Cisco-CSF\r\n" +
+            self.compileRtpStatHeaders(statistics) +
             f"Content-Length: 0\r\n" +
             f"\r\n")
-    def compileByeOkHead(self, via, fro, to, callId, sessionId, remoteSessionId):
+    def compileByeOkHead(self, via, fro, to, callId, sessionId, remoteSessionId, statistics=None):
         return (f"SIP/2.0 200 OK\r\n" +
             f"Via: {via}\r\n" +
             f"From: {fro}\r\n" +
@@ -830,8 +1071,9 @@ class SipHandler(threading.Thread):
             f"Date: {self.getTimestamp()}\r\n" +
             f"CSeq: 102 BYE\r\n" +
             f"Server: Cisco-CSF\r\n" +
-            #f"RTP-RxStat: Dur=10,Pkt=454,Oct=72640,LostPkt=0,AvgJit=0.185022,VqMetrics=\"CS=0;SCS=0\"\r\n" +
-            #f"RTP-TxStat: Dur=10,Pkt=443,Oct=70880\r\n" +
+            # e.g. RTP-RxStat: Dur=10,Pkt=454,Oct=72640,LostPkt=0,AvgJit=0.185022,VqMetrics="CS=0;SCS=0"
+            #      RTP-TxStat: Dur=10,Pkt=443,Oct=70880
+            self.compileRtpStatHeaders(statistics) +
             f"Content-Length: 0\r\n" +
             f"\r\n")
     def compileSubscripeAckHead(self, via, fro, to, callId, clientIp, clientPort, cseq):
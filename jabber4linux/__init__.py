@@ -14,3 +14,4 @@ HISTORY_PATH = CFG_DIR+'/history.json'
 PHONEBOOK_PATH = CFG_DIR+'/phonebook.json'
 CLIENT_CERTS_DIR = CFG_DIR+'/client-certs'
 SERVER_CERTS_DIR = CFG_DIR+'/server-certs'
+RECORDINGS_DIR = CFG_DIR+'/recordings'
@@ -195,6 +195,30 @@
         <source>Current Call</source>
         <translation>Laufender Anruf</translation>
     </message>
+    <message>
+        <source>Quality</source>
+        <translation>Qualität</translation>
+    </message>
+    <message>
+        <source>Packet loss</source>
+        <translation>Paketverlust</translation>
+    </message>
+    <message>
+        <source>Late packets</source>
+        <translation>Verspätete Pakete</translation>
+    </message>
+    <message>
+        <source>Jitter</source>
+        <translation>Jitter</translation>
+    </message>
+    <message>
+        <source>Round trip time</source>
+        <translation>Umlaufzeit</translation>
+    </message>
+    <message>
+        <source>Decode time</source>
+        <translation>Dekodierzeit</translation>
+    </message>
     <message>
         <source>Hang Up</source>
         <translation>Auflegen</translation>